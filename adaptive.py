@@ -0,0 +1,227 @@
+"""
+Adaptive word selection for the typing game
+
+A WeaknessModel keeps a user's error rate and typing speed for every letter and pair of letters, learnt from the
+keystrokes of their games. An AdaptiveSampler then picks words with probability weighted towards the letters the user
+finds hardest, using an alias table so each draw is O(1). Building the table is O(n) in the dictionary size, so it is
+built a chunk at a time as the game runs (uniform sampling is used until it is ready) instead of in one go.
+"""
+import os
+import json
+from array import array
+from urllib.parse import quote
+from scores import write_atomically
+from wordlist import WordListError, MIN_ELIGIBLE_WORDS
+
+KEY_STATS_DIR = "key_stats"  # folder each user's weakness model is saved in
+LATENCY_SMOOTHING = 0.1  # weight of the newest keystroke in the running mean typing time of a key
+ERROR_WEIGHT = 4  # how much a key's error rate counts towards its weakness
+LATENCY_WEIGHT = 2  # how much being slower than the user's average counts towards a key's weakness
+ALIAS_CHUNK = 5000  # words processed per call to AdaptiveSampler.advance()
+MAX_ALIAS_RETRIES = 16  # weighted draws that may land on words already in play before falling back to uniform
+
+
+def update_key_stats(key_stats, key, correct, latency):
+    """
+    updates the [attempts, errors, mean latency] list of one key or letter pair
+    :param key_stats: dict of key -> [attempts, errors, mean latency in seconds]
+    :param key: letter or pair of letters
+    :param correct: whether it was typed correctly
+    :param latency: seconds it took to type, None if it was not timed
+    :return:
+    """
+    stats = key_stats.setdefault(key, [0, 0, None])
+    stats[0] += 1
+    if not correct:
+        stats[1] += 1
+    if latency is not None:
+        stats[2] = latency if stats[2] is None else stats[2] + LATENCY_SMOOTHING * (latency - stats[2])
+
+
+class WeaknessModel:
+    """
+    a user's error rate and mean typing time for every letter and pair of letters they have typed
+    """
+    def __init__(self, letters=None, bigrams=None, mean_latency=None):
+        self.letters = letters or {}  # letter -> [attempts, errors, mean latency]
+        self.bigrams = bigrams or {}  # pair of letters -> [attempts, errors, mean latency]
+        self.mean_latency = mean_latency  # running mean time to type any key
+
+    def update(self, log):
+        """
+        learns from the keystrokes of a game. a keystroke's latency is the time since the previous keystroke, and it
+        counts towards a letter pair when the previous letter of the same word was the last thing typed correctly
+        :param log: analytics.KeystrokeLog of the game
+        :return:
+        """
+        previous_char = None  # target of the last correct keystroke
+        for index in range(len(log)):
+            char = chr(log.targets[index])
+            correct = bool(log.correct[index])
+            latency = None
+            if correct and index > 0:
+                latency = log.times[index] - log.times[index - 1]
+                self.mean_latency = latency if self.mean_latency is None else \
+                    self.mean_latency + LATENCY_SMOOTHING * (latency - self.mean_latency)
+            update_key_stats(self.letters, char, correct, latency)
+            if log.positions[index] > 0 and previous_char is not None:
+                # like analytics.summarise(), a pair is only timed when both letters were typed one after the other
+                follows_on = log.correct[index - 1] and log.positions[index - 1] == log.positions[index] - 1
+                update_key_stats(self.bigrams, previous_char + char, correct, latency if follows_on else None)
+            if correct:
+                previous_char = char
+
+    def weakness(self, key_stats):
+        """
+        :param key_stats: dict of key -> [attempts, errors, mean latency]
+        :return: dict of key -> how much harder than average the user finds it, 0 or more
+        """
+        weaknesses = {}
+        for key, (attempts, errors, latency) in key_stats.items():
+            score = ERROR_WEIGHT * (errors + 1) / (attempts + 2)  # smoothed so one slip does not dominate
+            if latency is not None and self.mean_latency:
+                score += LATENCY_WEIGHT * max(0, latency / self.mean_latency - 1)
+            weaknesses[key] = score
+        return weaknesses
+
+    def to_dict(self):
+        return {"letters": self.letters, "bigrams": self.bigrams, "mean_latency": self.mean_latency}
+
+
+def key_stats_path(name):
+    """
+    :param name: user name
+    :return: path of the user's weakness model file
+    """
+    return os.path.join(KEY_STATS_DIR, quote(name, safe="") + ".json")
+
+
+def load_model(name):
+    """
+    loads a user's weakness model, starting a new one if they have none
+    :param name: user name
+    :return: WeaknessModel
+    """
+    try:
+        with open(key_stats_path(name)) as f:
+            saved = json.load(f)
+        return WeaknessModel(saved["letters"], saved["bigrams"], saved["mean_latency"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return WeaknessModel()
+
+
+def save_model(name, model):
+    """
+    saves a user's weakness model to its own file, so saving only rewrites that user's stats
+    :param name: user name
+    :param model: WeaknessModel
+    :return:
+    """
+    os.makedirs(KEY_STATS_DIR, exist_ok=True)
+    write_atomically(key_stats_path(name), json.dumps(model.to_dict()))
+
+
+class AdaptiveSampler:
+    """
+    draws distinct words from the eligible prefix of a WordIndex, weighted towards the user's weak keys
+    has the same take() / release() interface as wordlist.WordSampler. the alias table is built by advance(), which
+    the engine calls once per step, ALIAS_CHUNK words at a time. until it is finished words are drawn uniformly
+    """
+    def __init__(self, word_index, max_word_length, rng, model):
+        self.words = word_index.words
+        self.pool_size = word_index.eligible_count(max_word_length)
+        if self.pool_size < MIN_ELIGIBLE_WORDS:
+            raise WordListError("only {} words are short enough for this difficulty, at least {} are needed".format(
+                self.pool_size, MIN_ELIGIBLE_WORDS))
+        self.rng = rng
+        self.model = model
+        self.taken = set()  # words currently in play
+        self.probabilities = None  # alias table, None until it has been built
+        self.aliases = None
+        self.builder = self.build_alias_table()
+
+    def word_weight(self, word, letter_weakness, bigram_weakness):
+        """
+        :return: 1 plus the user's mean weakness over the word's letters and letter pairs
+        """
+        total = sum(letter_weakness.get(char, 0) for char in word)
+        total += sum(bigram_weakness.get(word[index:index + 2], 0) for index in range(len(word) - 1))
+        return 1 + total / (2 * len(word) - 1)
+
+    def build_alias_table(self):
+        """
+        generator that builds the alias table (Vose's method), yielding after every ALIAS_CHUNK words
+        :return:
+        """
+        letter_weakness = self.model.weakness(self.model.letters)
+        bigram_weakness = self.model.weakness(self.model.bigrams)
+        weights = array("d")
+        for start in range(0, self.pool_size, ALIAS_CHUNK):
+            for index in range(start, min(start + ALIAS_CHUNK, self.pool_size)):
+                weights.append(self.word_weight(self.words[index], letter_weakness, bigram_weakness))
+            yield
+        scale = self.pool_size / sum(weights)
+        probabilities = array("d", (weight * scale for weight in weights))
+        aliases = array("I", bytes(4 * self.pool_size))
+        small = [index for index in range(self.pool_size) if probabilities[index] < 1]
+        large = [index for index in range(self.pool_size) if probabilities[index] >= 1]
+        yield
+        paired = 0
+        while small and large:
+            small_index, large_index = small.pop(), large[-1]
+            aliases[small_index] = large_index
+            probabilities[large_index] -= 1 - probabilities[small_index]
+            if probabilities[large_index] < 1:
+                small.append(large.pop())
+            paired += 1
+            if paired % ALIAS_CHUNK == 0:
+                yield
+        for index in small + large:  # left over through rounding, they always pick themselves
+            probabilities[index] = 1
+        self.probabilities, self.aliases = probabilities, aliases
+
+    def advance(self):
+        """
+        does the next chunk of work on the alias table, if it is not finished
+        :return:
+        """
+        if self.builder is not None and next(self.builder, StopIteration) is StopIteration:
+            self.builder = None
+
+    def draw_index(self):
+        """
+        :return: a random index into the eligible words, weighted once the alias table is ready
+        """
+        index = self.rng.randrange(self.pool_size)
+        if self.probabilities is not None and self.rng.random() >= self.probabilities[index]:
+            return self.aliases[index]
+        return index
+
+    def take(self):
+        """
+        draws a word that is not already in play and marks it as in play. if the weighted draws keep landing on words in
+        play, falls back to the first free word after a uniform random start
+        :return: the word
+        """
+        if len(self.taken) >= self.pool_size:
+            raise WordListError("every eligible word is already in play")
+        for _ in range(MAX_ALIAS_RETRIES):
+            word = self.words[self.draw_index()]
+            if word not in self.taken:
+                break
+        else:
+            start = self.rng.randrange(self.pool_size)
+            for offset in range(self.pool_size):
+                word = self.words[(start + offset) % self.pool_size]
+                if word not in self.taken:
+                    break
+        self.taken.add(word)
+        return word
+
+    def release(self, word):
+        """
+        returns a word to the pool once it has left play
+        :param word: a word previously returned by take()
+        :return:
+        """
+        self.taken.discard(word)
@@ -0,0 +1,133 @@
+"""
+Keystroke analytics for the typing game
+
+The engine records every keystroke into a KeystrokeLog, which only appends to a few flat arrays so recording costs
+next to nothing while the user is typing. Once the game is over, summarise() works through the arrays to find how
+long the user takes to type each key, their slowest pairs of letters, their fastest burst of typing and which keys
+they miss the most.
+"""
+from array import array
+from collections import defaultdict, Counter
+
+BURST_WINDOW = 5  # seconds of typing the burst wpm is measured over
+CHARS_PER_WORD = 5  # standard word length used for burst wpm
+SLOWEST_DIGRAPH_COUNT = 5  # letter pairs listed in a summary
+MIN_DIGRAPH_SAMPLES = 2  # times a letter pair must be typed before it can be listed as slow
+
+
+class KeystrokeLog:
+    """
+    every keystroke of a game stored in parallel arrays: the character that should have been typed, the character that
+    was typed, when, whether it was correct and the position of the target character in its word
+    """
+    def __init__(self):
+        self.targets = array("I")  # code points
+        self.typed = array("I")
+        self.times = array("d")
+        self.correct = array("b")
+        self.positions = array("H")
+
+    def __len__(self):
+        return len(self.times)
+
+    def record(self, target_char, typed_char, timestamp, correct, position):
+        """
+        appends one keystroke
+        :param target_char: the character that should have been typed
+        :param typed_char: the character that was typed
+        :param timestamp: when it was typed, in seconds
+        :param correct: whether it matched
+        :param position: index of target_char in its word
+        :return:
+        """
+        self.targets.append(ord(target_char))
+        self.typed.append(ord(typed_char))
+        self.times.append(timestamp)
+        self.correct.append(correct)
+        self.positions.append(position)
+
+
+def percentile(sorted_values, fraction):
+    """
+    :param sorted_values: non-empty list sorted in ascending order
+    :param fraction: 0-1
+    :return: the nearest-rank percentile of the values
+    """
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def burst_wpm(correct_times):
+    """
+    finds the most correct characters typed inside any BURST_WINDOW seconds, with a sliding window
+    :param correct_times: timestamps of correct keystrokes in ascending order
+    :return: the burst as whole words per minute
+    """
+    most_chars = 0
+    window_start = 0
+    for window_end, end_time in enumerate(correct_times):
+        while end_time - correct_times[window_start] > BURST_WINDOW:
+            window_start += 1
+        most_chars = max(most_chars, window_end - window_start + 1)
+    return int(round(most_chars / CHARS_PER_WORD * 60 / BURST_WINDOW))
+
+
+def summarise(log):
+    """
+    works out a game's keystroke statistics. the time taken to type a key is the interval since the keystroke before
+    it, and only correct keystrokes are timed
+    :param log: KeystrokeLog of the game
+    :return: dict with keystrokes, burst_wpm, key_latency (key -> {p50, p90} in ms), slowest_digraphs (list of
+    [letter pair, mean ms]) and errors (key -> times it was mistyped)
+    """
+    key_intervals = defaultdict(list)
+    digraph_intervals = defaultdict(list)
+    errors = Counter()
+    correct_times = []
+    targets, times, correct, positions = log.targets, log.times, log.correct, log.positions
+    for index in range(len(log)):
+        key = chr(targets[index])
+        if not correct[index]:
+            errors[key] += 1
+            continue
+        correct_times.append(times[index])
+        if index == 0:
+            continue
+        interval = times[index] - times[index - 1]
+        key_intervals[key].append(interval)
+        # a letter pair is timed when both letters were typed correctly one after the other in the same word
+        if correct[index - 1] and positions[index] > 0 and positions[index - 1] == positions[index] - 1:
+            digraph_intervals[chr(targets[index - 1]) + key].append(interval)
+
+    key_latency = {}
+    for key, intervals in key_intervals.items():
+        intervals.sort()
+        key_latency[key] = {"p50": int(round(percentile(intervals, 0.5) * 1000)),
+                            "p90": int(round(percentile(intervals, 0.9) * 1000))}
+    digraph_means = [[digraph, int(round(sum(intervals) / len(intervals) * 1000))]
+                     for digraph, intervals in digraph_intervals.items() if len(intervals) >= MIN_DIGRAPH_SAMPLES]
+    digraph_means.sort(key=lambda digraph_mean: digraph_mean[1], reverse=True)
+    return {"keystrokes": len(log),
+            "burst_wpm": burst_wpm(correct_times) if correct_times else 0,
+            "key_latency": key_latency,
+            "slowest_digraphs": digraph_means[:SLOWEST_DIGRAPH_COUNT],
+            "errors": dict(errors)}
+
+
+def slowest_key(summary):
+    """
+    :param summary: dict returned by summarise()
+    :return: the key with the highest median time to type, or None if no key was timed
+    """
+    if not summary["key_latency"]:
+        return None
+    return max(summary["key_latency"], key=lambda key: summary["key_latency"][key]["p50"])
+
+
+def most_missed_key(summary):
+    """
+    :param summary: dict returned by summarise()
+    :return: the key mistyped the most, or None if there were no mistakes
+    """
+    if not summary["errors"]:
+        return None
+    return max(summary["errors"], key=summary["errors"].get)
@@ -0,0 +1,356 @@
+"""
+Headless benchmarks for the typing game
+
+Plays games with bot typists on every difficulty against synthetic dictionaries of different sizes, and saves scores
+into score stores pre-filled with different numbers of users, reporting:
+
+  spawn latency     time to spawn a word (draw it, measure it, find it room), p50 and p99
+  keystroke cost    time the engine takes to handle a keystroke, p50 and p99
+  step cost         mean time of a simulation step
+  persistence       time to load a score store, to record a game and to have it safely on disk
+  peak memory       peak traced allocation of each scenario, measured in a second run under tracemalloc
+
+Nothing needs a display. With --tk the canvas rendering paths are timed too, and with --startup the time the game takes
+to import and to draw its first screen in a fresh process, both of which need a display or Xvfb, e.g.
+xvfb-run python bench.py --tk --startup
+
+Results can be saved as a baseline with --save-baseline and are compared against the saved baseline on every run,
+exiting with status 1 if any metric got slower (or bigger) than the baseline by more than --tolerance.
+
+usage: python bench.py [--quick] [--tk] [--startup] [--save-baseline] [--baseline FILE] [--tolerance FRACTION]
+"""
+import gc
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from analytics import percentile
+from bots import BotTypist, play
+from engine import GameEngine, DIFFICULTY_DICT
+from scores import ScoreStore, SqliteScoreStore, write_atomically
+from wordlist import WordIndex
+
+BASELINE_FILE_NAME = "bench_baseline.json"
+DICTIONARY_SIZES = (100, 10000, 100000, 1000000)
+SCORE_USER_COUNTS = (10, 1000, 100000, 1000000)
+QUICK_DICTIONARY_SIZES = (100, 10000)
+QUICK_SCORE_USER_COUNTS = (10, 1000)
+BOTS = ((40, 0.05), (120, 0.02))  # (wpm, error rate) of the bot typists
+BENCH_GAME_SECONDS = 60  # game time each benchmark game is capped at, so a fast bot's game does not run forever
+RECORDS_PER_STORE = 20  # games recorded into each score store
+TOLERANCE = 0.5  # fraction a metric may grow by before it counts as a regression
+NOISE_FLOORS = {"_us": 20, "_ms": 5, "_mb": 1}  # metric suffix -> growth too small to count whatever the fraction
+SEED = 1234
+STARTUP_RUNS = 5  # fresh processes the startup benchmark starts, the median of each metric is kept
+SLOWEST_IMPORTS_SHOWN = 5
+# run in a fresh process by bench_startup(), prints the import time and the time to the first drawn screen
+STARTUP_SCRIPT = """
+import json, time
+start_time = time.perf_counter()
+import main
+imported_time = time.perf_counter()
+
+def ready():
+    print(json.dumps({"import_ms": (imported_time - start_time) * 1000,
+                      "first_frame_ms": (time.perf_counter() - start_time) * 1000}))
+    main.close()
+main.main(on_ready=ready)
+"""
+
+
+def synthetic_words(count, seed=SEED):
+    """
+    :param count: number of words
+    :param seed: seed for the words, so every run benchmarks the same dictionary
+    :return: list of count distinct lowercase words of 2-12 letters
+    """
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 12))))
+    return sorted(words)  # sets do not iterate in the same order between runs
+
+
+def microseconds(sorted_seconds, fraction):
+    """
+    :return: the given percentile of sorted timings, in microseconds
+    """
+    return round(percentile(sorted_seconds, fraction) * 1e6, 2) if sorted_seconds else 0
+
+
+def bench_game(word_index, difficulty, wpm, error_rate):
+    """
+    plays one game with a bot, timing every spawn, keystroke and step
+    :return: dict of metrics
+    """
+    engine = GameEngine(word_index, difficulty, seed=SEED)
+    spawn_times, key_times = [], []
+    new_word = engine.new_word
+
+    def timed_new_word(*args):
+        start_time = time.perf_counter()
+        word = new_word(*args)
+        spawn_times.append(time.perf_counter() - start_time)
+        return word
+
+    def timed_feed_key(character, timestamp):
+        start_time = time.perf_counter()
+        engine.feed_key(character, timestamp)
+        key_times.append(time.perf_counter() - start_time)
+
+    engine.new_word = timed_new_word
+    start_time = time.perf_counter()
+    play(engine, BotTypist(wpm, error_rate, seed=SEED), timed_feed_key, BENCH_GAME_SECONDS)
+    elapsed = time.perf_counter() - start_time
+    spawn_times.sort()
+    key_times.sort()
+    step_seconds = elapsed - sum(spawn_times) - sum(key_times)
+    return {"spawn_p50_us": microseconds(spawn_times, 0.5), "spawn_p99_us": microseconds(spawn_times, 0.99),
+            "key_p50_us": microseconds(key_times, 0.5), "key_p99_us": microseconds(key_times, 0.99),
+            "step_mean_us": round(step_seconds / max(1, engine.steps) * 1e6, 2),
+            "game_seconds": round(engine.time, 1), "words_typed": engine.words_typed}
+
+
+def bench_dictionary(size):
+    """
+    builds an index of a synthetic dictionary, then plays a game on every difficulty with every bot
+    :return: dict of scenario name -> metrics
+    """
+    words = synthetic_words(size)
+    start_time = time.perf_counter()
+    word_index = WordIndex(words)
+    results = {"index/{}".format(size): {"build_ms": round((time.perf_counter() - start_time) * 1000, 2)}}
+    for difficulty in DIFFICULTY_DICT:
+        for wpm, error_rate in BOTS:
+            results["game/{}/{}/{}wpm".format(size, difficulty, wpm)] = bench_game(word_index, difficulty, wpm,
+                                                                                   error_rate)
+    return results
+
+
+def fill_score_file(file_name, user_count):
+    """
+    writes a score file with user_count users spread over the difficulties
+    :return:
+    """
+    rng = random.Random(SEED)
+    scores, difficulties = {}, {difficulty: {} for difficulty in DIFFICULTY_DICT}
+    for user in range(user_count):
+        name = "user{}".format(user)
+        scores[name] = rng.randint(5, 150)
+        difficulties[rng.choice(list(DIFFICULTY_DICT))][name] = scores[name]
+    write_atomically(file_name, json.dumps({"scores": scores, "difficulties": difficulties}))
+
+
+def bench_store(backend, user_count):
+    """
+    loads a score store holding user_count users, records RECORDS_PER_STORE games into it and closes it
+    :param backend: "json" or "sqlite"
+    :return: dict of metrics
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        score_file = os.path.join(directory, "score_dict.json")
+        fill_score_file(score_file, user_count)
+        start_time = time.perf_counter()
+        if backend == "sqlite":
+            store = SqliteScoreStore(os.path.join(directory, "scores.db"), import_file_name=score_file)
+        else:
+            store = ScoreStore(score_file, os.path.join(directory, "score_log.jsonl"))
+        load_seconds = time.perf_counter() - start_time
+        record_times = []
+        persist_start = time.perf_counter()
+        for game in range(RECORDS_PER_STORE):
+            start_time = time.perf_counter()
+            store.record("user{}".format(game), 100 + game, difficulty="medium", accuracy=95, seconds=60,
+                         key_stats={"burst_wpm": 120})
+            record_times.append(time.perf_counter() - start_time)
+        store.close()  # returns once every game is on disk
+        record_times.sort()
+        return {"load_ms": round(load_seconds * 1000, 2), "record_p99_us": microseconds(record_times, 0.99),
+                "persist_ms": round((time.perf_counter() - persist_start) * 1000, 2)}
+
+
+def bench_tk(frames=300, words=40, explosions=30):
+    """
+    times frames of the canvas rendering paths: moving words through a RetainedCanvas and explosions through a
+    ParticleSystem
+    :return: dict of scenario name -> metrics, empty if there is no display
+    """
+    try:
+        import tkinter
+    except ImportError as error:
+        print("skipping Tk benchmarks: {}".format(error), file=sys.stderr)
+        return {}
+    try:
+        root = tkinter.Tk()
+    except tkinter.TclError as error:  # no display
+        print("skipping Tk benchmarks: {}".format(error), file=sys.stderr)
+        return {}
+    from render import RetainedCanvas
+    from particles import ParticleSystem
+    canvas = tkinter.Canvas(root, width=225, height=225)
+    canvas.pack()
+    retained_canvas = RetainedCanvas(canvas)
+    items = []
+    for index in range(words):
+        item = canvas.create_text(10 + index * 5, 0, text="word{}".format(index))
+        retained_canvas.track(item, (10 + index * 5, 0), text="word{}".format(index))
+        items.append(item)
+    particle_system = ParticleSystem(canvas, 225, 225, fade_steps=30)
+    frame_times, particle_times = [], []
+    for frame in range(frames):
+        start_time = time.perf_counter()
+        for index, item in enumerate(items):
+            retained_canvas.move_to(item, 10 + index * 5, (frame * (0.6 + index / words)) % 225)
+        retained_canvas.flush()
+        root.update_idletasks()
+        frame_times.append(time.perf_counter() - start_time)
+        if frame % (frames // explosions) == 0:
+            particle_system.emit(112, 112)
+        start_time = time.perf_counter()
+        particle_system.step()
+        particle_system.draw()
+        particle_times.append(time.perf_counter() - start_time)
+    root.destroy()
+    frame_times.sort()
+    particle_times.sort()
+    return {"tk/words": {"frame_p50_us": microseconds(frame_times, 0.5),
+                         "frame_p99_us": microseconds(frame_times, 0.99)},
+            "tk/particles": {"frame_p50_us": microseconds(particle_times, 0.5),
+                             "frame_p99_us": microseconds(particle_times, 0.99)}}
+
+
+def slowest_imports(import_log):
+    """
+    :param import_log: stderr of a python -X importtime run that imported main
+    :return: list of (module, milliseconds) of the modules main imports directly, slowest first, counting everything
+    they import in turn
+    """
+    imports = []  # modules one level in since the last top level import, which are listed after what they import
+    for line in import_log.splitlines():
+        if not line.startswith("import time:") or not line.split("|")[1].strip().isdigit():
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            imports.append((name.strip(), int(cumulative) / 1000))
+        elif depth == 0:
+            if name.strip() == "main":
+                return sorted(imports, key=lambda item: item[1], reverse=True)[:SLOWEST_IMPORTS_SHOWN]
+            imports = []
+    return []
+
+
+def bench_startup(runs=STARTUP_RUNS):
+    """
+    starts the game in fresh processes, timing how long importing main takes and how long it takes until the first
+    screen has been drawn and the game responds to input, and the process as a whole from the outside
+    :return: dict of scenario name -> metrics, empty if there is no display
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))  # the game loads its files relative to its folder
+    samples = []
+    import_log = ""
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT], cwd=directory,
+                                 capture_output=True, text=True)
+        process_ms = (time.perf_counter() - start_time) * 1000
+        if process.returncode != 0:
+            error_lines = [line for line in process.stderr.splitlines() if not line.startswith("import time:")]
+            print("skipping startup benchmark: {}".format(error_lines[-1] if error_lines else process.returncode),
+                  file=sys.stderr)
+            return {}
+        samples.append(dict(json.loads(process.stdout.splitlines()[-1]), process_ms=process_ms))
+        import_log = process.stderr
+    print("slowest imports of main: {}".format(", ".join("{} {:.1f} ms".format(name, milliseconds)
+                                                         for name, milliseconds in slowest_imports(import_log))))
+    return {"startup": {metric: round(sorted(sample[metric] for sample in samples)[len(samples) // 2], 2)
+                        for metric in samples[0]}}
+
+
+def peak_memory_mb(function, *args):
+    """
+    :return: peak memory traced while running function(*args), in MB
+    """
+    tracemalloc.start()
+    try:
+        function(*args)
+        return round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+    finally:
+        tracemalloc.stop()
+
+
+def compare(results, baseline, tolerance):
+    """
+    :param results: dict of scenario -> metrics of this run
+    :param baseline: dict of scenario -> metrics of the baseline
+    :param tolerance: fraction a metric may grow by
+    :return: list of regression descriptions
+    """
+    regressions = []
+    for scenario, metrics in results.items():
+        for metric, value in metrics.items():
+            if metric in ("game_seconds", "words_typed"):  # describe the game rather than measure a cost
+                continue
+            previous = baseline.get(scenario, {}).get(metric)
+            noise_floor = next((floor for suffix, floor in NOISE_FLOORS.items() if metric.endswith(suffix)), 0)
+            if previous and value > previous * (1 + tolerance) and value - previous > noise_floor:
+                regressions.append("{} {}: {} -> {} ({:+.0%})".format(scenario, metric, previous, value,
+                                                                       value / previous - 1))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="headless benchmarks for the typing game")
+    parser.add_argument("--quick", action="store_true", help="only the smaller dictionaries and score stores")
+    parser.add_argument("--tk", action="store_true", help="also time the canvas paths, needs a display or Xvfb")
+    parser.add_argument("--startup", action="store_true", help="also time startup, needs a display or Xvfb")
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory runs")
+    parser.add_argument("--baseline", default=BASELINE_FILE_NAME, help="baseline file to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="save this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="growth allowed before a regression")
+    args = parser.parse_args()
+
+    results = {}
+    for size in QUICK_DICTIONARY_SIZES if args.quick else DICTIONARY_SIZES:
+        gc.collect()  # so garbage from the last scenario is not collected in the middle of this one
+        results.update(bench_dictionary(size))
+        if not args.no_memory:
+            results["index/{}".format(size)]["peak_mb"] = peak_memory_mb(bench_dictionary, size)
+    for user_count in QUICK_SCORE_USER_COUNTS if args.quick else SCORE_USER_COUNTS:
+        for backend in ("json", "sqlite"):
+            scenario = "scores/{}/{}".format(backend, user_count)
+            gc.collect()
+            results[scenario] = bench_store(backend, user_count)
+            if not args.no_memory:
+                results[scenario]["peak_mb"] = peak_memory_mb(bench_store, backend, user_count)
+    if args.tk:
+        results.update(bench_tk())
+    if args.startup:
+        results.update(bench_startup())
+
+    for scenario, metrics in results.items():
+        print("{:<32} {}".format(scenario, "  ".join("{}={}".format(metric, value)
+                                                     for metric, value in metrics.items())))
+    try:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+    except (OSError, ValueError):
+        regressions = None
+    if args.save_baseline:
+        write_atomically(args.baseline, json.dumps(results, indent=1))
+        print("saved baseline to {}".format(args.baseline))
+    if regressions:
+        print("\n{} regression(s) against {}:".format(len(regressions), args.baseline))
+        print("\n".join(regressions))
+        sys.exit(1)
+    elif regressions is not None:
+        print("\nno regressions against {}".format(args.baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Synthetic typists for driving the game engine without a player
+
+A BotTypist types at a configurable speed and error rate, with the gap between keystrokes varied at random around the
+mean for its speed. play() runs a whole game headless with a bot at the keyboard, which the benchmarks and the
+parameter sweeps use to put the engine under a realistic load.
+"""
+import random
+
+CHARS_PER_WORD = 5  # standard word length used to turn wpm into keystrokes per second
+INTERVAL_SPREAD = 0.35  # standard deviation of the gap between keystrokes, as a fraction of the mean gap
+MAX_GAME_SECONDS = 600  # game time after which play() stops a game that a bot is too good to lose
+
+
+class BotTypist:
+    """
+    a player that types the current word at a set speed, mistyping a set fraction of keystrokes
+    """
+    def __init__(self, wpm, error_rate=0.0, seed=None):
+        """
+        :param wpm: words per minute the bot types at, counting CHARS_PER_WORD characters as a word
+        :param error_rate: chance 0-1 of each keystroke being a wrong character
+        :param seed: optional seed, so the same bot always types the same way
+        """
+        self.wpm = wpm
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.mean_interval = 60 / (wpm * CHARS_PER_WORD)  # seconds between keystrokes
+        self.next_key_time = self.interval()
+
+    def interval(self):
+        """
+        :return: seconds until the next keystroke
+        """
+        return max(0.01, self.rng.gauss(self.mean_interval, self.mean_interval * INTERVAL_SPREAD))
+
+    def keys_due(self, engine):
+        """
+        generator of what the bot types up to the engine's current game time. each key is chosen from the engine's
+        state when it is asked for, so the caller must feed a key to the engine before asking for the next one
+        :param engine: GameEngine being played
+        :return: iterator of (character, game time) keystrokes to feed the engine, in order
+        """
+        while self.next_key_time <= engine.time:
+            target = engine.target()
+            timestamp = self.next_key_time
+            self.next_key_time += self.interval()
+            if target is not None:
+                character = target.full_text[engine.letter_num]
+                if self.rng.random() < self.error_rate:
+                    character = "#" if character != "#" else "~"  # never a letter of a word
+                yield character, timestamp
+
+
+def play(engine, bot, on_key=None, max_seconds=MAX_GAME_SECONDS, on_events=None):
+    """
+    plays a game to the end with a bot at the keyboard, feeding keystrokes at the start of each step like the frontend
+    :param engine: GameEngine, not yet started
+    :param bot: BotTypist
+    :param on_key: optional callable used instead of engine.feed_key, e.g. to time each keystroke
+    :param max_seconds: game time after which the game is ended
+    :param on_events: optional callable given the engine's events after every step, in place of a frontend
+    :return: the engine
+    """
+    feed_key = on_key or engine.feed_key
+    engine.start()
+    engine.drain_events()
+    while engine.in_game:
+        for character, timestamp in bot.keys_due(engine):  # fed one at a time, as each key depends on the last
+            feed_key(character, timestamp)
+        if not engine.step():
+            break
+        events = engine.drain_events()  # nothing draws them, but draining returns destroyed words to the pool
+        if on_events is not None:
+            on_events(events)
+        if engine.time >= max_seconds:
+            engine.end()
+    engine.drain_events()
+    return engine
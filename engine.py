@@ -0,0 +1,444 @@
+"""
+Headless game engine for the typing game
+
+Holds all of the game state and rules: spawning words, moving them down the play area, matching typed characters
+against the current word and scoring. Nothing in here touches Tkinter, so the engine can be imported, stepped and fed
+keystrokes without a display. The frontend in main.py drains the engine's events every frame and draws them.
+"""
+import random
+from collections import deque
+from bisect import insort, bisect_left
+from wordlist import WordIndex
+from analytics import KeystrokeLog, summarise
+from adaptive import AdaptiveSampler
+from textmetrics import estimate_text_width
+
+# GLOBAL VARIABLES
+CANVAS_WIDTH = 225
+CANVAS_HEIGHT = 225
+WORD_SPEED_INCREMENT = 1.0005
+DIFFICULTY_DICT = {"easy": [0.6, 4], "medium": [0.9, 5], "hard": [1.75, float("inf")]}
+DEFAULT_UPDATE_SPEED = 16
+PHYSICS_STEP = DEFAULT_UPDATE_SPEED / 1000  # seconds of game time per simulation step
+DEFAULT_Y_SPAWN = 10
+SPAWN_BAND_TOP = 30  # words inside this band block new words from spawning above them
+SPAWN_BAND_BOTTOM = 70
+SPAWN_MARGIN = 30  # closest a new word's centre may spawn to the sides of the play area
+SMALL_FONT_SIZE = 10
+MEDIUM_FONT_SIZE = 12
+LARGE_FONT_SIZE = 14
+TEXT_HEIGHT_RATIO = 1.5  # rough line height as a fraction of the font size
+
+
+class SpawnBand:
+    """
+    occupancy index of the x ranges taken up by words currently inside the spawn band
+    kept as a list of (left, right, id) intervals sorted by left edge. words are added as they fall into the band and
+    removed as they leave it, so finding a free spawn position only looks at the few words in the band and never has
+    to retry
+    """
+    def __init__(self):
+        self.intervals = []
+        self.next_id = 0  # tie breaker so intervals never compare words
+
+    def add(self, left, right):
+        """
+        marks an x range as occupied
+        :return: the interval, to be passed to remove() later
+        """
+        interval = (left, right, self.next_id)
+        self.next_id += 1
+        insort(self.intervals, interval)
+        return interval
+
+    def remove(self, interval):
+        """
+        frees an x range previously returned by add()
+        :return:
+        """
+        del self.intervals[bisect_left(self.intervals, interval)]
+
+    def free_position(self, half_width, rng):
+        """
+        picks a uniformly random centre x between the spawn margins, and far enough from the sides for the whole word to
+        be on the canvas, at which a word half_width either side of it would not overlap any occupied range
+        :param half_width: half the width of the word being spawned
+        :param rng: random.Random instance to pick with
+        :return: the x position, or None if there is no room
+        """
+        lowest, highest = max(SPAWN_MARGIN, half_width), min(CANVAS_WIDTH - SPAWN_MARGIN, CANVAS_WIDTH - half_width)
+        if lowest >= highest:  # too wide to fit anywhere but the middle, which it needs to itself
+            centre = CANVAS_WIDTH / 2
+            if any(left < centre + half_width and right > centre - half_width for left, right, _ in self.intervals):
+                return None
+            return centre
+        free_ranges = []
+        cursor = lowest
+        for left, right, _ in self.intervals:  # walk the gaps between occupied ranges, widened by the new word's size
+            if left - half_width > cursor:
+                free_ranges.append((cursor, min(left - half_width, highest)))
+            cursor = max(cursor, right + half_width)
+            if cursor >= highest:
+                break
+        if cursor < highest:
+            free_ranges.append((cursor, highest))
+        free_ranges = [(start, end) for start, end in free_ranges if end > start]
+        total_free = sum(end - start for start, end in free_ranges)
+        if total_free <= 0:
+            return None
+        offset = rng.uniform(0, total_free)
+        for start, end in free_ranges:
+            if offset <= end - start:
+                return start + offset
+            offset -= end - start
+        return free_ranges[-1][1]
+
+
+class Word:
+    """
+    a word falling down the play area. words are pooled by the engine, so once a destroyed word has been drawn off the
+    screen the same object is reset() and reused for a later word instead of a new one being created
+    """
+    __slots__ = ("engine", "active", "velocity", "max_word_length", "text", "full_text", "colour", "y", "previous_y",
+                 "half_width", "band_interval", "x", "id")
+
+    def __init__(self, engine, y, inherit_velocity=True):  # code run when an instance is created
+        self.reset(engine, y, inherit_velocity)
+
+    def reset(self, engine, y, inherit_velocity=True):
+        """
+        (re)spawns the word with a new random word at y, leaving it inactive if there is no room to spawn
+        :param engine: GameEngine the word belongs to
+        :param y: y to spawn the word at
+        :param inherit_velocity: whether the word moves as fast as the current target word
+        :return:
+        """
+        self.engine = engine
+        self.active = True  # if the word is active / hasn't been typed or destroyed
+        target = engine.target()
+        if inherit_velocity and target is not None:
+            self.velocity = target.velocity
+        else:
+            self.velocity = engine.start_velocity
+        self.max_word_length = engine.max_word_length
+
+        # a word drawn for a spawn that had no room is spawned first, so words appear in the order they were drawn
+        self.text = engine.pending_words.popleft() if engine.pending_words else self.random_word()
+        self.full_text = self.text  # self.text loses letters as they are typed
+        self.colour = "black"
+
+        self.y = y
+        self.previous_y = y  # y before the last simulation step, for interpolated rendering
+        self.half_width = engine.measure(self.text) / 2
+        self.band_interval = None  # occupied range in the engine's spawn band while the word is inside it
+        self.x = self.gen_coord()
+        if self.x is None:  # no room to spawn, the engine will try again with the same word next step
+            self.active = False
+            engine.pending_words.appendleft(self.full_text)
+            return
+
+        self.id = engine.next_word_id
+        engine.next_word_id += 1
+        engine.target_queue.append(self)  # queues the word to be typed after the ones already falling
+        engine.update_band(self)
+        engine.events.append(("spawn", self))
+
+    def random_word(self):
+        """
+        selects a random word from the word list and returns it
+        the engine's sampler only draws from words shorter or equal to max word length and never returns a word that
+        is already displayed on the screen, raising WordListError if there is no such word left
+        :return: the randomly chosen word
+        """
+        return self.engine.sampler.take()
+
+    def gen_coord(self):
+        """
+        finds coordinates in which no other word is currently in, as to avoid collisions between words
+        picks straight from the free ranges of the engine's spawn band using the word's measured width
+        :return: the x val to generate the word object at, or None if the spawn band has no room
+        """
+        return self.engine.spawn_band.free_position(self.half_width, self.engine.rng)
+
+    def move(self):  # move the word down the play area
+        """
+        advances the word's position and velocity by one simulation step
+        :return:
+        """
+        self.previous_y = self.y
+        self.y += self.velocity
+        self.velocity *= self.engine.speed_increment  # increases velocity
+
+    def del_first(self):
+        """
+        removes the first character of the self.text string
+        :return:
+        """
+        self.text = self.text[1:]
+        self.engine.events.append(("update", self))
+
+    def set_colour(self, colour):
+        """
+        sets the colour the frontend should draw the word in, only telling the frontend if it has changed
+        :param colour: Tk colour name
+        :return:
+        """
+        if colour != self.colour:
+            self.colour = colour
+            self.engine.events.append(("update", self))
+
+    def destroy(self):
+        """
+        sets state of object to false so it is no longer moved, returns the word to the sampler and tells the frontend
+        to remove it
+        :return:
+        """
+        self.active = False
+        self.engine.sampler.release(self.full_text)
+        if self.band_interval is not None:
+            self.engine.spawn_band.remove(self.band_interval)
+            self.band_interval = None
+        self.engine.events.append(("destroy", self))
+        self.engine.retired_words.append(self)  # pooled once the frontend has seen the destroy event
+
+
+class GameEngine:
+    """
+    one game of the typing game, independent of any GUI
+    call start() once, then step() once every PHYSICS_STEP of game time and feed_key() for every typed character. the
+    frontend reads drain_events() after each frame to learn which words spawned, changed, exploded or were destroyed
+    """
+    def __init__(self, words, difficulty, font_size=MEDIUM_FONT_SIZE, measure=None, seed=None, weakness_model=None,
+                 word_source=None, start_velocity=None, max_word_length=None, speed_increment=WORD_SPEED_INCREMENT,
+                 spawn_y=DEFAULT_Y_SPAWN):
+        """
+        :param words: WordIndex to choose words from, or a plain list of words to build one from
+        :param difficulty: key into DIFFICULTY_DICT
+        :param font_size: font size the words are drawn at, used for collision checks
+        :param measure: optional callable taking a word and returning its drawn width in pixels
+        :param seed: optional seed for the engine's random number generator
+        :param weakness_model: optional adaptive.WeaknessModel of the player, words are then drawn weighted towards
+        their weak keys instead of uniformly
+        :param word_source: optional sampler to draw words from instead of the word list, with the take(), release()
+        and advance() methods of wordlist.WordSampler, e.g. a SequenceSampler of a race's shared words
+        :param start_velocity: pixels per step words start falling at, defaults to the difficulty's
+        :param max_word_length: longest word drawn, defaults to the difficulty's
+        :param speed_increment: factor words speed up by every step
+        :param spawn_y: y new words spawn at
+        """
+        self.word_index = words if isinstance(words, WordIndex) else WordIndex(words)
+        self.difficulty = difficulty
+        self.font_size = font_size
+        self.measure = measure if measure is not None else lambda text: estimate_text_width(text, self.font_size)
+        self.seed = seed if seed is not None else random.getrandbits(64)  # kept so the game can be replayed
+        self.rng = random.Random(self.seed)
+        # the difficulty's values unless overridden, e.g. by a parameter sweep in tune.py
+        self.start_velocity = start_velocity if start_velocity is not None else DIFFICULTY_DICT[difficulty][0]
+        self.max_word_length = max_word_length if max_word_length is not None else DIFFICULTY_DICT[difficulty][1]
+        self.speed_increment = speed_increment
+        self.spawn_y = spawn_y
+        if word_source is not None:
+            self.sampler = word_source
+        elif weakness_model is not None:  # both raise WordListError if too few words are eligible
+            self.sampler = AdaptiveSampler(self.word_index, self.max_word_length, self.rng, weakness_model)
+        else:
+            self.sampler = self.word_index.sampler(self.max_word_length, self.rng)
+        self.spawn_band = SpawnBand()
+        self.half_height = font_size * TEXT_HEIGHT_RATIO / 2
+
+        self.target_queue = deque()  # words currently falling down, the word being typed first
+        self.word_pool = []  # destroyed words ready to be reused
+        self.retired_words = []  # destroyed words the frontend may still be drawing, pooled by drain_events()
+        self.next_word_id = 0
+        self.events = []  # (kind, word) tuples for the frontend
+        self.letter_num = 0
+        self.words_typed = 0
+        self.accuracy_list = [0, 0]  # [correct keystrokes, incorrect keystrokes]
+        self.keystrokes = KeystrokeLog()
+        self.time = 0  # seconds of game time simulated so far
+        self.steps = 0
+        self.in_game = False
+        self.game_over = False
+        self.pending_spawns = 0  # words waiting for room in the spawn band
+        self.pending_words = deque()  # words already drawn for some of the pending spawns
+        self.spawn_failures = 0  # times a word could not spawn straight away
+
+    def start(self):
+        """
+        spawns the first 3 words, sets the first one to green and starts the game
+        :return:
+        """
+        self.spawn(self.spawn_y, False)
+        self.target().set_colour("green")  # sets the first word spawned to green
+        self.spawn(self.spawn_y-25)
+        self.spawn(self.spawn_y-40)
+        self.in_game = True
+
+    def target(self):
+        """
+        :return: the word the user is currently typing, or None if there are no words
+        """
+        return self.target_queue[0] if self.target_queue else None
+
+    def spawn(self, y=None, inherit_velocity=True):
+        """
+        spawns a new word, or if there is no room in the spawn band, counts the failure and queues the word to be
+        spawned on a later step
+        :param y: y to spawn the word at, defaults to spawn_y
+        :param inherit_velocity: whether the word moves as fast as the current target word
+        :return: the new Word, or None if it was queued
+        """
+        word = self.new_word(y, inherit_velocity)
+        if word.active:
+            return word
+        self.spawn_failures += 1
+        self.pending_spawns += 1
+        return None
+
+    def new_word(self, y=None, inherit_velocity=True):
+        """
+        spawns a word, reusing one from the pool if there is one
+        :param y: y to spawn the word at, defaults to spawn_y
+        :param inherit_velocity: whether the word moves as fast as the current target word
+        :return: the Word, inactive if there was no room to spawn it
+        """
+        if y is None:
+            y = self.spawn_y
+        if self.word_pool:
+            word = self.word_pool.pop()
+            word.reset(self, y, inherit_velocity)
+        else:
+            word = Word(self, y, inherit_velocity)
+        if not word.active:  # never reached the frontend, so it can go straight back to the pool
+            self.word_pool.append(word)
+        return word
+
+    def update_band(self, word):
+        """
+        adds a word to the spawn band once it overlaps it and removes it once it has fallen past it
+        :param word: the word that has just spawned or moved
+        :return:
+        """
+        if word.band_interval is None:
+            if word.y + self.half_height >= SPAWN_BAND_TOP and word.y - self.half_height <= SPAWN_BAND_BOTTOM:
+                word.band_interval = self.spawn_band.add(word.x - word.half_width, word.x + word.half_width)
+        elif word.y - self.half_height > SPAWN_BAND_BOTTOM:
+            self.spawn_band.remove(word.band_interval)
+            word.band_interval = None
+
+    def step(self):
+        """
+        advances the game by one PHYSICS_STEP, moving every active word. if a word falls off the bottom of the play
+        area the game ends
+        :return: False once the game is over
+        """
+        if not self.in_game:
+            return False
+        self.time += PHYSICS_STEP
+        self.steps += 1
+        self.sampler.advance()  # spreads any precomputation the sampler needs over the first steps of the game
+        for word in self.target_queue:
+            word.move()
+            if word.y > CANVAS_HEIGHT:
+                self.end()
+                return False
+            self.update_band(word)
+        while self.pending_spawns > 0:  # retry spawns that had no room
+            word = self.new_word()
+            if not word.active:
+                break
+            self.pending_spawns -= 1
+            if len(self.target_queue) == 1:  # every other word was typed while this one waited
+                word.set_colour("green")
+        return True
+
+    def feed_key(self, typed_char, timestamp=None):
+        """
+        checks a typed character against the next letter of the current word, updates vars
+        if the user has typed the correct character, the word's first letter is removed and the word is set to green.
+        else, the word is set to red and no letter is removed. once the whole word is typed it explodes, a new word is
+        spawned and the next word becomes the target
+        :param typed_char: the character the user typed
+        :param timestamp: when the character was typed in seconds, defaults to the current game time
+        :return: True if the character was correct, False if not, None if there was no word to type
+        """
+        object_ref = self.target()  # the word at the front of the queue is the one being typed
+        if object_ref is None:  # if there are no words falling
+            return None
+        active_word = object_ref.full_text
+        correct = typed_char == active_word[self.letter_num]
+        self.keystrokes.record(active_word[self.letter_num], typed_char, self.time if timestamp is None else timestamp,
+                               correct, self.letter_num)
+        if correct:  # if the user has typed the correct letter
+            object_ref.del_first()
+            object_ref.set_colour("green")  # sets word colour to green
+            self.letter_num += 1
+            self.accuracy_list[0] += 1
+        else:  # if the user enters the wrong character, set the word colour to red
+            object_ref.set_colour("red")
+            self.accuracy_list[1] += 1
+        if self.letter_num == len(active_word):  # if the user has typed the whole word correctly
+            self.events.append(("explode", object_ref))
+            object_ref.destroy()
+            self.target_queue.popleft()
+            self.spawn()
+            self.letter_num = 0
+            self.words_typed += 1
+            if self.target_queue:  # the replacement word may still be waiting for room to spawn
+                self.target().set_colour("green")  # sets the next active word to green
+        return correct
+
+    def drain_events(self):
+        """
+        hands the events raised since the last call to the frontend. words destroyed before this call are returned to
+        the pool, so the frontend must be done with a destroyed word by the time it next drains events
+        :return: list of (kind, word) tuples, kind is one of spawn, update, explode, destroy, game_over
+        """
+        events = self.events
+        self.events = []
+        self.word_pool.extend(self.retired_words)
+        self.retired_words.clear()
+        return events
+
+    def end(self):
+        """
+        stops the game and destroys all remaining words
+        :return:
+        """
+        self.in_game = False
+        self.game_over = True
+        for word in self.target_queue:
+            word.destroy()
+        self.target_queue.clear()
+        self.events.append(("game_over", None))
+
+    def wpm(self):
+        """
+        calculates words per minute over the game time so far
+        :return: wpm rounded to a whole number, 0 before any word has been typed
+        """
+        if self.words_typed == 0 or self.time == 0:
+            return 0
+        return int(round(self.words_typed / (self.time / 60)))
+
+    def accuracy(self):
+        """
+        calculates the percentage of keystrokes that were correct
+        :return: accuracy as a whole number percentage, 0 if the user has not typed anything
+        """
+        try:
+            return int(round(self.accuracy_list[0] / (self.accuracy_list[0] + self.accuracy_list[1]) * 100))
+        except ZeroDivisionError:
+            return 0
+
+    def keystroke_summary(self):
+        """
+        :return: the game's keystroke statistics, see analytics.summarise()
+        """
+        return summarise(self.keystrokes)
+
+    def elapsed_seconds(self):
+        """
+        :return: whole seconds of game time elapsed since the game was started
+        """
+        return int(round(self.time))
@@ -7,219 +7,514 @@ The purpose of this program is to allow a range of different users to hone their
 for beginner, intermediate, and advanced typists. Allows for the storage of user scores and the lookup of their scores.
 """
 from tkinter import *
-import random
+import tkinter.font
+import os
+import sys
 import time
-import json
+import string
+from urllib.parse import quote
+from collections import deque
+from engine import GameEngine, CANVAS_WIDTH, CANVAS_HEIGHT, DIFFICULTY_DICT, DEFAULT_UPDATE_SPEED, PHYSICS_STEP, \
+    SMALL_FONT_SIZE, MEDIUM_FONT_SIZE, LARGE_FONT_SIZE
+from wordlist import WordListLoader, WordIndex, SequenceSampler, WordListError, load_cached_index, \
+    save_cached_index, MIN_ELIGIBLE_WORDS
+from scores import ScoreStore, SqliteScoreStore, ScoreWriteError
+from analytics import slowest_key, most_missed_key
+from adaptive import load_model, save_model
+from particles import ParticleSystem
+from profiler import FrameProfiler, audit_itemconfig
+from render import RetainedCanvas
+from textmetrics import TextMeasurer
+from passage import PassageSampler, LineIndexBuilder, load_line_index, save_line_index, resume_position, \
+    save_position
+from replay import SessionRecorder, ReplayPlayer, ReplayError, save_session, load_session
 
 # GLOBAL VARIABLES
 ROOT_WIDTH = 300
 ROOT_HEIGHT = 300
-CANVAS_WIDTH = 225
-CANVAS_HEIGHT = 225
 DEFAULT_TEXT_FILE = "defaulttext.txt"
 MIN_WORDS = 10
+GAME_FONT = "TkDefaultFont"  # font family words are drawn in
+MEASURE_CHUNK_WORDS = 2000  # words measured per turn of the event loop before a game starts
+# measured before a passage game, whose words are then measured from their characters' widths
+PASSAGE_CHARACTERS = string.ascii_letters + string.digits + string.punctuation
 DEFAULT_PADDING = 5
-WORD_SPEED_INCREMENT = 1.0005
-DIFFICULTY_DICT = {"easy": [0.6, 4], "medium": [0.9, 5], "hard": [1.75, float("inf")]}
-EXPLOSION_SPEED = 3
+EXPLOSION_PARTICLES = 4  # lines flying out of each typed word
+EXPLOSION_FADE_STEPS = 0  # simulation steps explosion lines take to fade out, 0 to keep them until off the canvas
+CANVAS_COLOUR = (186, 186, 186)  # grey73, the colour explosion lines fade into
 MIN_NAME_LENGTH = 3
 MAX_NAME_LENGTH = 15
 SCORE_FILE_NAME = "score_dict.json"
-DEFAULT_UPDATE_SPEED = 16
-DEFAULT_Y_SPAWN = 10
-SMALL_FONT_SIZE = 10
-MEDIUM_FONT_SIZE = 12
-LARGE_FONT_SIZE = 14
-
-
-class Word:
-    def __init__(self, master, y=DEFAULT_Y_SPAWN, inherit_velocity=True):  # code run when an instance is created
-        self.active = True  # if the word is active / hasn't been typed or destroyed
-        self.difficulty = DIFFICULTY_DICT[chosen_difficulty]
-        if inherit_velocity:
-            list_item = list(active_words.keys())[0]
-            object_ref = active_words.get(list_item)
-            self.velocity = object_ref.velocity
-        else:
-            self.velocity = self.difficulty[0]
-        self.max_word_length = self.difficulty[1]
-
-        self.text = self.random_word()  # select a random word from the words list
-
-        self.master = master
-        self.y = y
-
-        # create an instance attributes for explosion lines
-        self.explosion_line_1 = None
-        self.explosion_line_2 = None
-        self.explosion_line_3 = None
-        self.explosion_line_4 = None
-        self.explosion_lines = []
-
-        self.x = self.gen_coord()
-        self.word_object = self.master.create_text(self.x, self.y, text=self.text, font=("TkDefaultFont", font_size))
-
-        active_words[self.text] = self  # adds the text and ref to object to dictionary
-
-        self.move()  # initiate movement
-
-    def random_word(self):
+SCORE_LOG_FILE_NAME = "score_log.jsonl"
+SCORE_BACKEND = "json"  # "json" for the score file, "sqlite" to share a score database between game instances
+SCORE_DB_FILE_NAME = "scores.db"
+LEADERBOARD_SIZE = 5
+FIXED_TIMESTEP = True  # simulate against wall-clock time, False moves words one step per frame however late it is
+MAX_STEPS_PER_FRAME = 4  # simulation steps a single late frame may catch up before the rest is dropped
+TRACE_FILE_NAME = "frame_trace.json"  # where F4 dumps the frame profiler's trace
+OVERLAY_REFRESH_FRAMES = 15  # frames between updates of the FPS overlay, toggled with F3
+AUDIT_ITEMCONFIG = False  # count itemconfig calls that change nothing, costs an extra Tcl call per option
+REPLAY_DIR = "replays"  # folder the last game and every user's best game are saved in
+LAST_REPLAY_NAME = "last.twr"
+RACE_DIFFICULTY = "medium"  # difficulty every racer plays a race at
+RACE_STANDINGS_SHOWN = 3  # racers listed on the game canvas during a race
+
+
+class FrameScheduler:
+    """
+    owns the single root.after loop that drives everything that moves or updates every frame
+    entities are registered with add() as any of an input, update or render callable. input callables are called once
+    at the start of every frame to handle buffered input, update callables advance the simulation by one fixed
+    PHYSICS_STEP and are called as many times as wall-clock time requires, render callables are called once per frame
+    with how far (0-1) the frame is between the last two simulation steps so movement can be interpolated. a callable
+    that returns False unregisters its entity, and the after loop stops itself when nothing is left to update
+    """
+    def __init__(self, master, interval=DEFAULT_UPDATE_SPEED, profiler=None):
         """
-        selects a random word from the word list and returns it
-        contains a while function that continuously selects a random word until it satisfies the given parameters
-        of being shorter or equal to max word length and not already displayed on the screen
-        :return: generates_word: the randomly chosen word
+        :param master: Tk widget to schedule the after loop on
+        :param interval: milliseconds between frames
+        :param profiler: optional profiler.FrameProfiler to time the phases of every frame with
         """
-        generated_word = ""
-        while len(generated_word) < 1 or len(generated_word) > self.max_word_length or generated_word in active_words:
-            generated_word = random.choice(words_list)
-        return generated_word
-
-    def gen_coord(self):
+        self.master = master
+        self.interval = interval
+        self.profiler = profiler
+        self.entities = []  # [process_input, update, render] lists, any of which may be None
+        self.after_id = None  # id of the pending after callback, None when the loop is idle
+        self.last_time = 0  # perf_counter() value of the previous frame
+        self.accumulator = 0  # wall-clock seconds not yet simulated
+
+    def add(self, update=None, render=None, process_input=None):
         """
-        finds coordinates in which no other word is currently in, as to avoid collisions between words
-        :return: potential_coord; the x val to generate the word object at
+        registers an entity to be updated every frame and starts the loop if it is idle
+        :param update: callable run once per simulation step, returns False once it no longer needs updating
+        :param render: callable run once per frame with the interpolation factor, returns False to unregister
+        :param process_input: callable run once at the start of every frame, returns False to unregister
+        :return:
         """
-        potential_coord = random.randint(30, CANVAS_WIDTH-30)
-        while len(self.master.find_overlapping(potential_coord-10, 30, potential_coord+10, 70)) != 0:
-            potential_coord = random.randint(30, CANVAS_WIDTH-30)
-
-        return potential_coord
+        self.entities.append([process_input, update, render])
+        if self.after_id is None:
+            self.last_time = time.perf_counter()
+            self.accumulator = 0
+            self.after_id = self.master.after(self.interval, self.tick)
 
-    def move(self):  # move the word down the canvas
+    def run(self, index, *args):
         """
-        controls word movement and checks if it within borders
-        if the word is active, move the word using the move() function down the screen. if the word is off the
-        screen, end the game
+        calls the input (index 0), update (index 1) or render (index 2) callable of every entity, dropping the ones that
+        return False
+        entities registered during this pass (e.g. a word spawned by another word) are kept for the next pass
         :return:
         """
-        if self.active:
-            self.master.move(self.word_object, 0, self.velocity)
-            try:
-                if self.master.coords(self.word_object)[1] > CANVAS_HEIGHT:
-                    show_end_screen()
-            except IndexError:
-                pass
-
-            self.velocity *= WORD_SPEED_INCREMENT  # increases velocity
-            root.after(DEFAULT_UPDATE_SPEED, self.move)  # repeat
-
-    def explode(self):
+        current_entities = self.entities
+        self.entities = []
+        survivors = [entity for entity in current_entities
+                     if entity[index] is None or entity[index](*args) is not False]
+        self.entities = survivors + self.entities
+
+    def tick(self):
         """
-        generates explosion lines around the word and then calls the move_explosion_line function
+        handles input, works out how many simulation steps the elapsed wall-clock time is worth, runs them, renders once
+        and schedules the next frame. if the frame arrived so late that more than MAX_STEPS_PER_FRAME steps are owed,
+        the extra time is dropped rather than queued so a stall does not turn into a burst of catch-up frames
         :return:
         """
-        x = self.master.coords(self.word_object)[0]
-        y = self.master.coords(self.word_object)[1]
-
-        self.explosion_line_1 = self.master.create_line(x+20, y-20, x+30, y-30)  # top right
-        self.explosion_lines.append(self.explosion_line_1)
-        self.move_explosion_line(0, [EXPLOSION_SPEED, -EXPLOSION_SPEED])
-        self.explosion_line_2 = self.master.create_line(x-20, y-20, x-30, y-30)  # top left
-        self.explosion_lines.append(self.explosion_line_2)
-        self.move_explosion_line(1, [-EXPLOSION_SPEED, -EXPLOSION_SPEED])
-        self.explosion_line_3 = self.master.create_line(x + 20, y + 20, x + 30, y + 30)  # bottom right
-        self.explosion_lines.append(self.explosion_line_3)
-        self.move_explosion_line(2, [EXPLOSION_SPEED, EXPLOSION_SPEED])
-        self.explosion_line_4 = self.master.create_line(x - 20, y + 20, x - 30, y + 30)  # bottom left
-        self.explosion_lines.append(self.explosion_line_4)
-        self.move_explosion_line(3, [-EXPLOSION_SPEED, EXPLOSION_SPEED])
-
-    def move_explosion_line(self, instance_number, direction):
+        current_time = time.perf_counter()
+        if FIXED_TIMESTEP:
+            self.accumulator += current_time - self.last_time
+            steps = int(self.accumulator / PHYSICS_STEP)
+            if steps > MAX_STEPS_PER_FRAME:  # skip catch-up frames
+                steps = MAX_STEPS_PER_FRAME
+                self.accumulator = 0
+            else:
+                self.accumulator -= steps * PHYSICS_STEP
+            alpha = self.accumulator / PHYSICS_STEP
+        else:  # frame-based simulation, one step per callback however late it is
+            steps, alpha = 1, 1
+        self.last_time = current_time
+
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start_frame(current_time)
+        self.run(0)
+        if profiler is not None:
+            profiler.mark("input")
+        for _ in range(steps):
+            self.run(1)
+        if profiler is not None:
+            profiler.mark("update")
+        self.run(2, alpha)
+        if profiler is not None:
+            profiler.mark("render")
+            profiler.end_frame(steps)
+
+        if self.entities:
+            self.after_id = self.master.after(self.interval, self.tick)
+        else:
+            self.after_id = None
+
+    def clear(self):
         """
-        every frame, move the given explosion line in the given direction
-        :param instance_number: the line number to retrieve the proper line
-        :param direction: a list that contains the x and y values for the move function
+        unregisters everything and cancels the pending frame
         :return:
         """
-        pos_x = self.master.coords(self.explosion_lines[instance_number])[0]
-        pos_y = self.master.coords(self.explosion_lines[instance_number])[1]
+        self.entities = []
+        if self.after_id is not None:
+            self.master.after_cancel(self.after_id)
+            self.after_id = None
 
-        if 0 < pos_x < CANVAS_WIDTH or 0 < pos_y < CANVAS_HEIGHT:  # if the explosion lines can still be seen
-            self.master.move(self.explosion_lines[instance_number], direction[0], direction[1])
 
-            root.after(DEFAULT_UPDATE_SPEED, lambda: self.move_explosion_line(instance_number, direction))
-        else:  # if the explosion lines are out of bounds, delete for efficiency
-            self.master.delete(self.explosion_lines[instance_number])
+class CanvasItemPool:
+    """
+    recycles canvas items of one type instead of deleting and recreating them
+    released items are hidden and kept, and acquire() moves, reconfigures and shows a hidden item when there is one, so
+    after the first few words the canvas stops creating and deleting Tcl items altogether. changes to reused items go
+    through the retained canvas, so they are only sent to Tk on its next flush and only if they differ
+    """
+    def __init__(self, retained_canvas, item_type):
+        """
+        :param retained_canvas: RetainedCanvas of the Canvas the items are drawn on
+        :param item_type: canvas item type, e.g. "text" or "line"
+        """
+        self.retained_canvas = retained_canvas
+        self.create = getattr(retained_canvas.canvas, "create_" + item_type)  # e.g. canvas.create_text
+        self.free_items = []  # hidden items ready to be reused
 
-    def del_first(self):
+    def acquire(self, coords, **options):
         """
-        removes the first character of the self.text string using the del method
+        :param coords: coordinates of the item
+        :param options: item options, e.g. text and fill
+        :return: id of a visible canvas item with the given coordinates and options
+        """
+        if not self.free_items:
+            item = self.create(*coords, **options)
+            self.retained_canvas.track(item, coords, state="normal", **options)
+            return item
+        item = self.free_items.pop()
+        self.retained_canvas.move_to(item, *coords)
+        self.retained_canvas.configure(item, state="normal", **options)
+        return item
+
+    def release(self, item):
+        """
+        hides an item and keeps it to be reused
+        :param item: id of an item previously returned by acquire()
         :return:
         """
-        self.text = self.text[1:]
-        self.master.itemconfig(self.word_object, text=self.text)
+        self.retained_canvas.configure(item, state="hidden")
+        self.free_items.append(item)
+
 
-    def destroy(self):
+def explode(word):
+    """
+    sends explosion lines flying out of a typed word, registering the particle system with the frame scheduler if no
+    other explosion is still on screen
+    :param word: the engine word that was typed
+    :return:
+    """
+    global particles_running
+    particle_system.emit(word.x, word.y)
+    if not particles_running:
+        particles_running = True
+        frame_scheduler.add(update=particle_system.step, render=draw_particles)
+
+
+def draw_particles(alpha):
+    """
+    draws every explosion line, called once per frame by the frame scheduler while there are any
+    :param alpha: how far through the current simulation step the frame is, 0-1
+    :return: False once every line has left the canvas
+    """
+    global particles_running
+    particles_running = particle_system.draw(alpha)
+    return particles_running
+
+
+class KeyBuffer:
+    """
+    queue of keystrokes waiting to be fed to the game engine
+    key events are pushed as they arrive with a perf_counter() timestamp and drained in one batch at the start of each
+    frame, so no character is lost however fast the user types or pastes. the delay between a key arriving and being
+    handled is recorded on the frame profiler for every keystroke
+    """
+    def __init__(self):
+        self.keys = deque()  # (character, timestamp) pairs
+
+    def push(self, character, timestamp):
+        self.keys.append((character, timestamp))
+
+    def drain(self, profiler=None):
         """
-        sets state of object to false, halts movement function to save processing, removes word item from canvas
-        :return:
+        removes every buffered keystroke
+        :param profiler: optional profiler.FrameProfiler to record how long each keystroke waited on
+        :return: list of (character, timestamp) pairs in the order they were typed
         """
-        self.active = False
-        self.master.delete(self.word_object)
-
-
-def callback(entry_text):
-    """
-    checks user's input against stored correct word, visual feedback provided, updates vars
-    called every time user edits the entry field. retrieves input and checks it against reference word spelling
-    every time the user edits the entry field, i.e. types a character, this function is called. it checks the user's
-    input against the reference word's spelling using an if/else statement. if the user has typed the correct character,
-    the function calls the reference objects .del_first function to remove the first letter, and clears the entry
-    field. this also sets the word colour to green. else, the word is set to red and no letter is removed.
-    :param entry_text:
-    :return:
-    """
-    try:  # tries following code
-        global letter_num, words_typed, accuracy_list
-        active_word = list(active_words.keys())[0]  # sets the current active word as the first in the dictionary
-        object_ref = active_words.get(active_word)  # stores the object name in a variable
-        typed_chars = entry_text.get().strip()  # retrieves user's input
-        if typed_chars != "":  # if the user has typed something
-            if typed_chars[0] == active_word[letter_num]:  # if the user has typed the correct letter
-                object_ref.del_first()
-                game_canvas.itemconfig(object_ref.word_object, fill="green")  # sets word colour to green
-                letter_num += 1
-                game_entry.delete(0, 'end')
-                accuracy_list[0] += 1
-            else:  # if the user enters the wrong character(s), set the word colour to red
-                game_canvas.itemconfig(object_ref.word_object, fill="red")
-                accuracy_list[1] += 1
-            if letter_num == len(active_word):  # if the user has typed the whole word correctly
-                object_ref.explode()
-                game_canvas.delete(object_ref.word_object)
-                del active_words[active_word]
-                Word(game_canvas)
-                letter_num = 0
-                words_typed += 1
-                next_word = active_words.get(list(active_words.keys())[0])
-                game_canvas.itemconfig(next_word.word_object, fill="green")  # sets the next active word to green
-    except IndexError:  # if there is an index error / nothing is in the active words list
-        pass
+        keys = list(self.keys)
+        self.keys.clear()
+        if profiler is not None and keys:
+            current_time = time.perf_counter()
+            profiler.record_keys(current_time - timestamp for _, timestamp in keys)
+        return keys
+
+    def clear(self):
+        self.keys.clear()
+
+
+def key_pressed(event):
+    """
+    called by Tk for every key pressed in the entry field, buffers the typed character for the next frame
+    whitespace and keys that do not type a character (shift, backspace etc.) are ignored. returns "break" so the
+    character is not inserted into the entry field
+    :param event: Tk key event
+    :return:
+    """
+    if event.char != "" and not event.char.isspace() and event.char.isprintable():
+        key_buffer.push(event.char, time.perf_counter())
+    return "break"
+
+
+def text_pasted(event):
+    """
+    called by Tk when the user pastes into the entry field, buffers every pasted character as if it had been typed
+    :param event: Tk virtual event
+    :return:
+    """
+    try:
+        pasted_text = root.clipboard_get()
+    except TclError:  # nothing on the clipboard
+        return "break"
+    timestamp = time.perf_counter()
+    for character in pasted_text:
+        if not character.isspace():
+            key_buffer.push(character, timestamp)
+    return "break"
 
 
-def initiate_game():
+def process_keys():
+    """
+    feeds every keystroke buffered since the last frame to the game engine in one batch, through the session recorder
+    if the game is being recorded, called at the start of each frame by the frame scheduler. in a race the keystrokes
+    the engine accepted are sent to the race server instead, in as few messages as possible
+    :return: False once the game has ended
+    """
+    if not engine.in_game:
+        return False
+    if not racing:
+        feed_key = recorder.feed_key if recorder is not None else engine.feed_key  # passages are not recorded
+        for character, timestamp in key_buffer.drain(profiler):
+            feed_key(character, timestamp)
+        return True
+    race_keys = "".join(character for character, timestamp in key_buffer.drain(profiler)
+                        if engine.feed_key(character, timestamp) is not None)  # keys with no word to type are dropped
+    if race_client is not None and race_keys:
+        race_client.send_keys(race_keys)
+    return True
+
+
+def render_game(alpha):
     """
-    called when game is started. focuses on entry, spawns the first 3 words, updated in_game to True, calls update_wpm()
+    draws the engine's state onto the game canvas, called once per frame by the frame scheduler
+    applies the events the engine raised since the last frame (creating, recolouring, exploding and deleting word
+    items), then moves every word item to its position interpolated between the last two simulation steps
+    :param alpha: how far through the current simulation step the frame is, 0-1
+    :return: False once the game has ended
+    """
+    for kind, word in engine.drain_events():
+        if kind == "spawn":
+            word_items[word] = text_pool.acquire((word.x, word.y), text=word.text, fill=word.colour,
+                                                 font=(GAME_FONT, engine.font_size))
+        elif kind == "update":
+            retained_canvas.configure(word_items[word], text=word.text, fill=word.colour)
+        elif kind == "explode":
+            explode(word)
+        elif kind == "destroy":
+            text_pool.release(word_items.pop(word))
+        elif kind == "game_over":
+            show_end_screen()
+            return False
+    for word, word_item in word_items.items():
+        retained_canvas.move_to(word_item, word.x, word.previous_y + (word.y - word.previous_y) * alpha)
+    return True
+
+
+def initiate_game(race_words=None, passage=None):
+    """
+    called when game is started. focuses on entry, creates the game engine and spawns the first 3 words, registers
+    the engine, the canvas renderer and the HUD updates with the frame scheduler
+    :param race_words: the words of a race to play in order, None for a normal game
+    :param passage: PassageSampler of the text to type in order, None for a normal game
     :return:
     """
-    global start_time, in_game
+    global engine, recorder, replaying, racing, passage_sampler
     game_entry.focus()  # sets user focus to entry field so they do not need to manually click on it
-    Word(game_canvas, DEFAULT_Y_SPAWN, False)
-    first_word_ref = active_words.get(list(active_words.keys())[0])  # sets the first word spawned to green 
-    game_canvas.itemconfig(first_word_ref.word_object, fill="green")
-    Word(game_canvas, DEFAULT_Y_SPAWN-25)
-    Word(game_canvas, DEFAULT_Y_SPAWN-40)
-    start_time = time.time()
-    in_game = True
-    update_wpm()
+    measure = text_measurer.measure_function(GAME_FONT, font_size)  # words are measured before the game starts
+    if race_words is not None:  # every racer gets the race's words in the same order, and the game is not recorded
+        text_measurer.precompute(race_words, GAME_FONT, font_size)
+        engine = GameEngine(WordIndex(race_words), RACE_DIFFICULTY, font_size, measure=measure,
+                            word_source=SequenceSampler(race_words))
+        recorder = None
+    elif passage is not None:  # every word comes from the passage, which a replay could not draw from again
+        engine = GameEngine([], chosen_difficulty, font_size, measure=measure, word_source=passage)
+        recorder = None
+    else:
+        model = user_weaknesses() if adaptive_words.get() else None
+        engine = GameEngine(word_index, chosen_difficulty, font_size, measure=measure, weakness_model=model)
+        recorder = SessionRecorder(engine, model, start_time=time.perf_counter())
+    replaying = False
+    racing = race_words is not None
+    if passage_sampler is not None and passage_sampler is not passage:  # normally already closed by the end screen
+        passage_sampler.close()
+    passage_sampler = passage
+    retained_canvas.configure(standings_item, text="", state="normal" if racing else "hidden")
+    engine.start()
+    key_buffer.clear()
+    add_game(engine.step, process_keys)
+
+
+def add_game(step, process_input=None):
+    """
+    registers a game with the frame scheduler. its step, input and renderer are separate entities, as the step returns
+    False on the step the game ends and render_game() still has to draw that step and show the end screen
+    :param step: callable that steps the game, returns False once it is over
+    :param process_input: optional callable that feeds buffered input to the game
+    :return:
+    """
+    frame_scheduler.add(update=step)
+    if process_input is not None:
+        frame_scheduler.add(process_input=process_input)
+    frame_scheduler.add(render=render_game)
+    add_hud()
+
+
+def add_hud():
+    """
+    registers the HUD and the canvas flush with the frame scheduler, after the game's renderer so they render last
+    :return:
+    """
+    frame_scheduler.add(render=update_wpm)
+    frame_scheduler.add(render=update_timer)
+    frame_scheduler.add(render=update_profile_overlay)
+    frame_scheduler.add(render=flush_canvas)
+
+
+def watch_replay():
+    """
+    plays the last game back in real time on the game canvas, with the recorded keystrokes fed in on the simulation
+    steps they were typed on
+    :return:
+    """
+    global engine, replaying, racing, passage_sampler
+    if word_index is None:  # no game has been played on a word list this session
+        stats_label.configure(text="could not play the replay: no words are loaded")
+        return
+    try:
+        player = ReplayPlayer(load_session(os.path.join(REPLAY_DIR, LAST_REPLAY_NAME)), word_index)
+    except (OSError, ReplayError) as error:
+        stats_label.configure(text="could not play the replay: {}".format(error))
+        return
+    engine = player.engine
+    replaying = True
+    racing = False
+    if passage_sampler is not None:
+        passage_sampler.close()
+    passage_sampler = None
+    retained_canvas.configure(standings_item, state="hidden")
+    show_screen("game")
+    engine.start()
+    add_game(player.step)
+
+
+def save_replay(wpm_score, previous_best):
+    """
+    saves the game just played as the last game, and as the user's best game if it beat their previous best
+    :param wpm_score: wpm of the game
+    :param previous_best: the user's top wpm before this game, None if they had not played before
+    :return:
+    """
+    session = recorder.finish()
+    try:
+        os.makedirs(REPLAY_DIR, exist_ok=True)
+        save_session(os.path.join(REPLAY_DIR, LAST_REPLAY_NAME), session)
+        if previous_best is None or wpm_score > previous_best:
+            save_session(os.path.join(REPLAY_DIR, quote(user_name, safe="") + ".twr"), session)
+    except OSError:  # a replay is a nice to have, the score is already saved
+        pass
+
+
+def join_race():
+    """
+    connects to the race server entered in the race entry (host or host:port) and waits for the next race, polling
+    the connection once per frame through the frame scheduler so the network never holds up a frame
+    :return:
+    """
+    global race_client
+    if race_client is not None or start_when_loaded:  # already racing or about to start a game
+        return
+    from race import RaceClient, RACE_PORT  # imported on first use, as asyncio takes a while to import
+    host, _, port = race_entry.get().strip().partition(":")
+    try:
+        race_client = RaceClient(host or "localhost", int(port) if port else RACE_PORT, user_name)
+    except (OSError, ValueError) as error:
+        race_label.configure(text="could not join the race: {}".format(error))
+        race_label.grid()
+        return
+    race_label.configure(text="waiting for the race to start...")
+    race_label.grid()
+    frame_scheduler.add(process_input=poll_race)
+
+
+def poll_race():
+    """
+    handles the messages the race server sent since the last frame, called at the start of each frame by the frame
+    scheduler while connected: starts the race when its words arrive and shows the standings as they change
+    :return: False once the race is over or the connection is lost
+    """
+    global race_client, race_standings
+    for message in race_client.poll():
+        if message["type"] == "race" and engine is not None and engine.in_game:  # busy with another game
+            race_client.send({"type": "done"})
+        elif message["type"] == "race" and not racing:
+            race_label.grid_remove()
+            show_screen("game")
+            initiate_game(message["words"])
+        elif message["type"] in ("standings", "result") and racing:
+            title = "RACE RESULT" if message["type"] == "result" else "RACE"
+            race_standings = ["{} ({} racers)".format(title, message["racers"])] + [
+                "{}. {} {} words {} WPM".format(place, name, words_typed, wpm)
+                for place, (name, words_typed, wpm, finished) in enumerate(message["standings"], 1)]
+            retained_canvas.configure(standings_item, text="\n".join(race_standings[:RACE_STANDINGS_SHOWN + 1]))
+            if not engine.in_game:  # the user's game is over, so the standings are on the end screen
+                stats_label.configure(text="\n".join(race_standings[:LEADERBOARD_SIZE + 1]))
+            if message["type"] == "result":
+                race_client.close()
+    if race_client.closed:
+        if not racing:
+            race_label.configure(text="lost the connection to the race server")
+        race_client = None
+        return False
+    return True
+
+
+def user_weaknesses():
+    """
+    :return: the user's adaptive.WeaknessModel, loaded from their key stats file the first time it is needed
+    """
+    global weakness_model
+    if weakness_model is None:
+        weakness_model = load_model(user_name)
+    return weakness_model
 
 
 def close():
     """
-    closes the program by destroying root (main window)
+    closes the program by saving any scores still being written and destroying root (main window)
     :return:
     """
+    global closed
+    closed = True
+    if score_store is not None:
+        try:
+            score_store.close()
+        except ScoreWriteError as error:  # nothing more can be done as the window closes, but say what was lost
+            print("could not save scores: {}".format(error), file=sys.stderr)
     root.destroy()
 
 
@@ -228,8 +523,7 @@ def show_instructions():
     hides the main menu and shows the instructions
     :return:
     """
-    menu_frame.grid_remove()
-    instruction_frame.grid()
+    show_screen("instructions")
 
 
 def show_settings():
@@ -237,8 +531,7 @@ def show_settings():
     hides the main menu and shows the settings
     :return:
     """
-    menu_frame.grid_remove()
-    settings_frame.grid()
+    show_screen("settings")
 
 
 def show_score_screen():
@@ -246,59 +539,238 @@ def show_score_screen():
     hides the main menu and shows the score screen, clears the score info label in advance
     :return:
     """
-    menu_frame.grid_remove()
+    show_screen("scores")
     score_info_label.config(text="")
-    score_frame.grid()
 
 
 def prepare_game(text_file_name, difficulty):
     """
-    import text file, hides the settings and shows the game frame
+    finds the words for the chosen text file. if they were loaded in the background or the file has an up to date
+    cache the game starts straight away, otherwise the file is opened and load_words starts the game once it has been
+    read
     :return:
     """
-    global chosen_difficulty, words_list
+    global chosen_difficulty, start_when_loaded
+    if start_when_loaded:  # a game is already waiting for its file to load
+        return
     chosen_difficulty = difficulty  # updates difficulty
 
     error_label.grid_remove()  # hides the error message
 
+    if text_file_name != "" and not text_file_name.endswith('.txt'):
+        error_label.grid()
+        return
+    file_name = text_file_name or DEFAULT_TEXT_FILE  # if the user has not chosen to use their own file, use the default
+    if passage_mode.get():
+        start_passage(file_name, passage_line_entry.get().strip())
+        return
+    if text_file_name == "" and default_index is not None:  # loaded in the background after startup
+        start_with_words(default_index, len(default_index),
+                         default_index.eligible_count(DIFFICULTY_DICT[difficulty][1]), True)
+        return
+    if word_loader is not None and word_loader_file == file_name:  # being loaded in the background already
+        start_when_loaded = True
+        loading_label.grid()
+        return
+    with profiler.measure_io():
+        cached_index = load_cached_index(file_name)
+    if cached_index is not None:
+        start_with_words(cached_index, len(cached_index), cached_index.eligible_count(DIFFICULTY_DICT[difficulty][1]),
+                         text_file_name == "")
+        return
+    start_when_loaded = True  # set first, as a short file is read in full straight away
     try:
-        if text_file_name == "":  # if the user has not chosen to use their own file, use the default
-            with open(DEFAULT_TEXT_FILE) as f:
-                words_list = f.read().splitlines()
-                settings_frame.grid_remove()
-                game_frame.grid()
-                initiate_game()
-        else:  # if the user has chosen to use their own text file
-            with open(text_file_name) as f:
-                words_list = f.read().splitlines()
-                for word in words_list:  # removes all characters after whitespace in every item in list
-                    words_list[words_list.index(word)] = word.split(" ", 1)[0]
-                non_duplicate_words_list = []
-                for word in words_list:  # removes duplicate words
-                    if word not in non_duplicate_words_list:
-                        non_duplicate_words_list.append(word)
-                words_less_than_min = 0
-                for word in words_list:
-                    if len(word) <= (DIFFICULTY_DICT[difficulty])[1]:
-                        words_less_than_min += 1
-                print(non_duplicate_words_list)
-                if len(non_duplicate_words_list) >= MIN_WORDS and text_file_name.endswith('.txt') and \
-                        words_less_than_min > 3:
-                    settings_frame.grid_remove()
-                    game_frame.grid()
-                    initiate_game()
-                else:  # creates a popup if the text file does not have enough words or incorrect file type
-                    if text_file_name.endswith('.txt'):
-                        popup = Toplevel(root)
-                        few_words_label = Label(popup, text="your text file does not have enough words! please make "
-                                                            "sure it has more than 10 non-duplicate words "
-                                                            "OR make sure you have more than 5 short words as well "
-                                                            "(less than 5 characters)")
-                        few_words_label.pack()
-                    else:
-                        error_label.grid()
+        start_loading(file_name, text_file_name == "")
     except FileNotFoundError:  # if the file is not found show error label
+        start_when_loaded = False
+        error_label.grid()
+        return
+    if start_when_loaded:  # still loading
+        loading_label.grid()
+
+
+def preload_words():
+    """
+    loads the default text file in the background after startup, from its cache if it has one, so the first game on
+    the default words starts straight away
+    :return:
+    """
+    global default_index
+    if word_loader is not None or default_index is not None:
+        return
+    with profiler.measure_io():
+        default_index = load_cached_index(DEFAULT_TEXT_FILE)
+    if default_index is None:
+        try:
+            start_loading(DEFAULT_TEXT_FILE, True)
+        except FileNotFoundError:  # reported if the user picks the default words
+            pass
+
+
+def start_loading(file_name, default_file):
+    """
+    opens a text file and starts reading it in chunks with load_words, raises FileNotFoundError if it does not exist.
+    a file still loading in the background is abandoned
+    :param file_name: path of the text file
+    :param default_file: True if it is the default text file
+    :return:
+    """
+    global word_loader, word_loader_file
+    loader = WordListLoader(file_name, {name: difficulty_info[1] for name, difficulty_info in DIFFICULTY_DICT.items()})
+    word_loader, word_loader_file = loader, file_name
+    load_words(loader, file_name, default_file)
+
+
+def load_words(loader, file_name, default_file):
+    """
+    loads the next chunk of the text file, rescheduling itself until the whole file has been read so the window stays
+    responsive while a large file loads. then caches the indexed words and starts the game if one is waiting for them
+    :param loader: WordListLoader of the file, stops if another file has been started since
+    :param file_name: path of the text file being loaded
+    :param default_file: True if the default text file is being loaded
+    :return:
+    """
+    global word_loader, word_loader_file, start_when_loaded, default_index
+    if loader is not word_loader:  # abandoned for another file
+        loader.file.close()
+        return
+    with profiler.measure_io():
+        done = loader.load_lines()
+    if not done:
+        root.after(1, lambda: load_words(loader, file_name, default_file))
+        return
+    word_loader = word_loader_file = None
+    loaded_index = loader.index()
+    with profiler.measure_io():
+        save_cached_index(file_name, loaded_index)
+    if default_file:
+        default_index = loaded_index
+    if start_when_loaded:
+        start_when_loaded = False
+        loading_label.grid_remove()
+        start_with_words(loaded_index, len(loader.words), loader.eligible_counts[chosen_difficulty], default_file)
+
+
+def start_with_words(new_index, word_count, eligible_count, default_file):
+    """
+    checks a custom text file has enough words, then measures them and starts the game
+    :param new_index: WordIndex of the file's words
+    :param word_count: number of unique words in the file
+    :param eligible_count: number of words short enough for the chosen difficulty
+    :param default_file: True if the words are from the default text file, which is not checked
+    :return:
+    """
+    global word_index, start_when_loaded
+    if default_file or (word_count >= MIN_WORDS and eligible_count >= MIN_ELIGIBLE_WORDS):
+        word_index = new_index
+        start_when_loaded = True  # the game waits for its words to be measured
+        measure_words(new_index, eligible_count)
+    else:  # creates a popup if the text file does not have enough words
+        popup = Toplevel(root)
+        few_words_label = Label(popup, text="your text file does not have enough words! please make "
+                                            "sure it has more than 10 non-duplicate words "
+                                            "OR make sure you have more than 5 short words as well "
+                                            "(less than 5 characters)")
+        few_words_label.pack()
+
+
+def measure_words(words, eligible_count, start=0):
+    """
+    measures the words the game can draw with the game font before it starts, so spawning a word never waits on Tk.
+    measures MEASURE_CHUNK_WORDS words per call, rescheduling itself until done so the window stays responsive with a
+    large dictionary, then shows the game frame and starts the game
+    :param words: WordIndex of the game's words, shortest first
+    :param eligible_count: number of words short enough for the chosen difficulty, only as many as the measurer's
+    cache holds are measured and the rest are estimated from their characters' widths
+    :param start: index of the first word to measure in this call
+    :return:
+    """
+    global start_when_loaded
+    count = min(eligible_count, text_measurer.cache_size)
+    end = min(start + MEASURE_CHUNK_WORDS, count)
+    text_measurer.precompute((words.words[index] for index in range(start, end)), GAME_FONT, font_size)
+    if end < count:
+        root.after(1, lambda: measure_words(words, eligible_count, end))
+        return
+    start_when_loaded = False
+    show_screen("game")
+    initiate_game()
+
+
+def start_passage(file_name, start_line):
+    """
+    opens a text file to type as a passage, from a chosen line or from where the user got to last time. the file is
+    memory-mapped rather than loaded, so even a very large file opens straight away. a chosen line is found with the
+    file's line index, which index_lines builds first if there is no up to date one
+    :param file_name: path of the text file
+    :param start_line: line to start at counting from 1, or "" to carry on from the user's last position
+    :return:
+    """
+    global start_when_loaded
+    if start_line != "" and not start_line.isdigit():
+        error_label.grid()
+        return
+    try:
+        with profiler.measure_io():
+            sampler = PassageSampler(file_name, *resume_position(user_name, file_name))
+    except (OSError, WordListError):
+        error_label.grid()
+        return
+    if start_line == "":
+        start_passage_game(sampler)
+        return
+    line = max(0, int(start_line) - 1)
+    with profiler.measure_io():
+        line_index = load_line_index(file_name)
+    if line_index is not None:
+        sampler.seek_line(line_index, line)
+        line_index.close()
+        start_passage_game(sampler)
+        return
+    start_when_loaded = True
+    loading_label.grid()
+    index_lines(LineIndexBuilder(file_name), sampler, line)
+
+
+def index_lines(builder, sampler, line):
+    """
+    indexes the next chunk of a passage's lines, rescheduling itself until the whole file has been indexed so the
+    window stays responsive while a large file is indexed. then saves the index and starts the passage at the line
+    :param builder: LineIndexBuilder of the file
+    :param sampler: PassageSampler of the same file
+    :param line: line to start at, counting from 0
+    :return:
+    """
+    global start_when_loaded
+    with profiler.measure_io():
+        done = builder.index_blocks()
+    if not done:
+        root.after(1, lambda: index_lines(builder, sampler, line))
+        return
+    with profiler.measure_io():
+        save_line_index(builder)
+    start_when_loaded = False
+    loading_label.grid_remove()
+    sampler.seek_line(builder.index(), line)
+    start_passage_game(sampler)
+
+
+def start_passage_game(sampler):
+    """
+    measures the font's characters, which passage words are measured with, then shows the game frame and starts the
+    passage. a passage with no words short enough to type shows the error label instead
+    :param sampler: PassageSampler at the position to start from
+    :return:
+    """
+    try:
+        sampler.fill()
+    except WordListError:
+        sampler.close()
         error_label.grid()
+        return
+    text_measurer.precompute(PASSAGE_CHARACTERS, GAME_FONT, font_size)
+    show_screen("game")
+    initiate_game(passage=sampler)
 
 
 def back():
@@ -306,74 +778,160 @@ def back():
     function to go back to menu by grid_removing frames and grid() menu frame
     :return:
     """
-    instruction_frame.grid_remove()
-    game_frame.grid_remove()
-    end_frame.grid_remove()
-    score_frame.grid_remove()
-    menu_frame.grid()
+    show_screen("menu")
 
 
-def update_wpm():
+def update_wpm(alpha=1):
     """
-    updates the wpm variable
-    if the number of words typed is greater than 0, retrieves current time, calculate time elapsed, calculates
-    WPM after converting current time to minutes. calls function again if in_game is True, otherwise reset WPM item
-    :return:
+    updates the WPM item with the engine's current wpm once the user has typed a word
+    called every frame by the frame scheduler while the game is running, otherwise resets the WPM item and unregisters
+    :param alpha: interpolation factor passed by the frame scheduler, unused
+    :return: False once the game has ended
     """
-    global wpm
-    if words_typed > 0:  # if the user has correctly typed more than 0 words
-        current_time = time.time()
-        time_elapsed = current_time - start_time
-        time_elapsed /= 60  # convert to minutes
-        wpm = words_typed / time_elapsed  # find wpm
-        wpm = int(round(wpm))  # rounds wpm to whole no.
-        game_canvas.itemconfig(wpm_item, text="WPM: {}".format(wpm))
-    if in_game:  # if the game is running, repeat the function
-        root.after(DEFAULT_UPDATE_SPEED, update_wpm)
-    else:
-        game_canvas.itemconfig(wpm_item, text="WPM: ")  # resets the wpm_item
+    if not engine.in_game:
+        retained_canvas.configure(wpm_item, text="WPM: ")  # resets the wpm_item
+        return False
+    if engine.words_typed > 0:  # if the user has correctly typed more than 0 words
+        retained_canvas.configure(wpm_item, text="WPM: {}".format(engine.wpm()))
+    return True
 
 
-def update_timer():
+def update_timer(alpha=1):
     """
-    called every 16 ms, updates the timer by subtracting the current time from the starting time
-    :return: updated_time: time elapsed since game is started
+    updates the timer item with the seconds elapsed since the game started
+    called every frame by the frame scheduler while the game is running, otherwise resets the timer and unregisters
+    :param alpha: interpolation factor passed by the frame scheduler, unused
+    :return: False once the game has ended
     """
-    updated_time = int(round(time.time() - start_time))
-    game_canvas.itemconfig(timer_item, text="TIME: {}".format(updated_time))
-    root.after(DEFAULT_UPDATE_SPEED, update_timer)
-    return updated_time
+    if not engine.in_game:
+        retained_canvas.configure(timer_item, text="TIME: ")  # resets the timer_item
+        return False
+    retained_canvas.configure(timer_item, text="TIME: {}".format(engine.elapsed_seconds()))
+    return True
+
+
+def flush_canvas(alpha=1):
+    """
+    sends the frame's changes to the game canvas in as few Tcl calls as possible. registered with the frame scheduler
+    after the game's other render callables so it runs last in the frame
+    :param alpha: interpolation factor passed by the frame scheduler, unused
+    :return: False once the game has ended
+    """
+    retained_canvas.flush()
+    return engine.in_game
+
+
+def update_profile_overlay(alpha=1):
+    """
+    shows the frame rate, p99 frame time and p99 keystroke latency in the corner of the game canvas while the overlay
+    is turned on
+    called every frame by the frame scheduler while the game is running, refreshing every OVERLAY_REFRESH_FRAMES frames
+    :param alpha: interpolation factor passed by the frame scheduler, unused
+    :return: False once the game has ended
+    """
+    if not engine.in_game:
+        return False
+    if show_overlay and profiler.frame_count % OVERLAY_REFRESH_FRAMES == 0:
+        summary = profiler.summary()
+        retained_canvas.configure(overlay_item, text="FPS {:.0f}\np99 {:.1f}ms\nkeys p99 {:.1f}ms".format(
+            summary["fps"], summary["p99"], summary["key_p99"]))
+    return True
+
+
+def toggle_overlay(event=None):
+    """
+    shows or hides the frame time overlay, bound to F3
+    :param event: Tk key event, unused
+    :return: "break" so a key bound on both the entry field and the window is only handled once
+    """
+    global show_overlay
+    show_overlay = not show_overlay
+    retained_canvas.configure(overlay_item, state="normal" if show_overlay else "hidden")
+    retained_canvas.flush()  # may be pressed outside a game, when nothing else flushes
+    return "break"
+
+
+def dump_trace(event=None):
+    """
+    writes the frame profiler's recent frames to TRACE_FILE_NAME, bound to F4
+    :param event: Tk key event, unused
+    :return: "break" so a key bound on both the entry field and the window is only handled once
+    """
+    profiler.dump_trace(TRACE_FILE_NAME)
+    return "break"
+
+
+def pending_after_count():
+    """
+    :return: number of after callbacks Tk has waiting
+    """
+    return len(root.tk.splitlist(root.tk.call("after", "info")))
 
 
 def show_end_screen():
     """
-    clears all game related variables and calculates user accuracy
-    resets letter_num, start_time, words_typed, accuracy_list, sets in_game to False. updates end screen
-    labels to respective values, changes to end_frame
+    clears the game canvas and shows the user's results
+    deletes any word items left on the canvas, changes to the end screen, updates the end screen labels to the engine's
+    wpm, accuracy and time and saves the user's score
     :return:
     """
-    global letter_num, start_time, words_typed, in_game, accuracy_list
-    time_seconds = update_timer()
-    end_frame.focus()  # takes focus off of the entry field
     game_entry.delete(0, 'end')  # clears entry field
-    for word in active_words:  # goes through active_words dictionary and deletes objects
-        active_words[word].destroy()
-    letter_num, start_time, words_typed = 0, 0, 0
-    active_words.clear()  # clears active_words dict
-    # switch to end_frame
-    game_frame.grid_remove()
-    end_frame.grid()
-    try:  # try calculate user accuracy
-        user_accuracy = accuracy_list[0]/(accuracy_list[0] + accuracy_list[1])
-        user_accuracy = int(round(user_accuracy*100))
-        accuracy_list = [0, 0]
-    except ZeroDivisionError:  # except if the user has not typed anything
-        user_accuracy = 0
+    for word_item in word_items.values():  # hides any word items still on the canvas
+        text_pool.release(word_item)
+    word_items.clear()
+    # switch to the end screen
+    show_screen("end").focus()  # takes focus off of the entry field
     # updates scoring labels
+    wpm = engine.wpm()
+    key_stats = engine.keystroke_summary()
     wpm_label.configure(text="WPM: {}".format(wpm))
-    update_scores(wpm)  # updates the user's score in the main score file / dictionary
-    accuracy_label.configure(text="ACCURACY: {}%".format(user_accuracy))
-    timer_label.configure(text="TIME: {} seconds".format(time_seconds))
+    # races and passages are not recorded, so there is no replay of them to watch
+    replay_button.configure(state="normal" if recorder is not None else "disabled")
+    if racing:  # a race is not scored, its standings come from the race server
+        if race_client is not None:
+            race_client.send({"type": "done"})
+        accuracy_label.configure(text="ACCURACY: {}%".format(engine.accuracy()))
+        timer_label.configure(text="TIME: {} seconds".format(engine.elapsed_seconds()))
+        stats_label.configure(text="\n".join(race_standings[:LEADERBOARD_SIZE + 1]))
+        return
+    if not replaying:  # a replayed game was already scored when it was played
+        previous_best = get_score_store().leaderboard().get(user_name)
+        # updates the user's score in the score store
+        update_scores(wpm, engine.accuracy(), engine.elapsed_seconds(), key_stats)
+        # learns the user's weak keys from every game, so adaptive word selection is ready whenever it is turned on
+        user_weaknesses().update(engine.keystrokes)
+        with profiler.measure_io():
+            save_model(user_name, weakness_model)
+            if passage_sampler is not None:  # the next passage game carries on from the first word not typed
+                save_passage_position()
+            else:
+                save_replay(wpm, previous_best)
+    accuracy_label.configure(text="ACCURACY: {}%".format(engine.accuracy()))
+    timer_label.configure(text="TIME: {} seconds".format(engine.elapsed_seconds()))
+    stats_lines = ["BURST: {} WPM".format(key_stats["burst_wpm"])]
+    if slowest_key(key_stats) is not None:
+        stats_lines.append("SLOWEST KEY: {} ({} ms)".format(slowest_key(key_stats),
+                                                             key_stats["key_latency"][slowest_key(key_stats)]["p50"]))
+    if key_stats["slowest_digraphs"]:
+        stats_lines.append("SLOWEST PAIR: {} ({} ms)".format(*key_stats["slowest_digraphs"][0]))
+    if most_missed_key(key_stats) is not None:
+        stats_lines.append("MOST MISSED: {} ({}x)".format(most_missed_key(key_stats),
+                                                          key_stats["errors"][most_missed_key(key_stats)]))
+    if passage_sampler is not None:
+        stats_lines.append("REACHED LINE: {}".format(passage_sampler.position_of(engine.words_typed)[1] + 1))
+        passage_sampler.close()
+    stats_label.configure(text="\n".join(stats_lines))
+
+
+def save_passage_position():
+    """
+    saves the position of the first word of the passage the user did not type
+    :return:
+    """
+    try:
+        save_position(user_name, passage_sampler, engine.words_typed)
+    except OSError:  # the next game starts from the top instead
+        pass
 
 
 def name_checking():
@@ -387,67 +945,67 @@ def name_checking():
     user_name = name_field.get().strip()
     # following if statement checks for spaces and character length
     if MIN_NAME_LENGTH <= len(user_name) <= MAX_NAME_LENGTH and user_name.find(" ") < 0:
-        opening_frame.grid_remove()
-        menu_frame.grid()
+        show_screen("menu")
     else:  # create a popup if the user has not satisfied naming requirements
         popup = Toplevel(root)
         Label(popup, text="please revise your username (less than {} chars, more than {} chars, no spaces".format(
             MAX_NAME_LENGTH, MIN_NAME_LENGTH)).pack()
 
 
-def update_scores(wpm_score):
+def update_scores(wpm_score, accuracy, time_seconds, key_stats):
     """
-    updates the user's WPM score in the main score json file
-    opens the score file, retrieves the dictionary from inside and stores it as score_dict. if the user's current score
-    is higher than their top WPM, overwrite. then, re open the json file and update the dictionary inside
-    :param wpm_score:
+    records the user's game in the score store
+    the store updates the user's top WPM in memory straight away and writes the game to disk on a background thread
+    :param wpm_score: wpm of the game
+    :param accuracy: accuracy of the game as a whole number percentage
+    :param time_seconds: length of the game in seconds
+    :param key_stats: keystroke statistics of the game, see analytics.summarise()
     :return:
     """
-    with open(SCORE_FILE_NAME, 'r') as f:  # retrieve dictionary from json file
-        score_dict = json.load(f)
-    if user_name not in score_dict or score_dict[user_name] < wpm_score:
-        score_dict[user_name] = wpm_score
-    json_dict = json.dumps(score_dict)
-    with open(SCORE_FILE_NAME, "w") as a:  # write the new data back to the json file
-        a.write(json_dict)
+    get_score_store().record(user_name, wpm_score, difficulty=chosen_difficulty, accuracy=accuracy,
+                             seconds=time_seconds, key_stats=key_stats)
 
 
-def retrieve_score(requested_name):
+def retrieve_score(requested_name, difficulty=None):
     """
-    find and display top score or retrieves the score of a given name
-    opens SCORE_FILE_NAME, retrieves the dictionary from inside. sort through score dict and find top score holder and
-    value. if the requested_name is empty, display this information. else, if the given name is in the keys of this
-    dictionary, display the score through a label. If not, display error message through a label.
+    display the leaderboard or the top score and rank of a given name
+    looks the scores up in the score store's in-memory leaderboards. if the requested_name is empty, display the top
+    LEADERBOARD_SIZE users on the chosen board. else, if the given name has a score, display their top WPM and rank
+    overall and on each difficulty they have played. If not, display error message through a label.
     :param requested_name: string containing the user's requested name to find score for
+    :param difficulty: difficulty of the leaderboard to show, None for the overall leaderboard
     :return:
     """
-    with open(SCORE_FILE_NAME, "r") as f:  # opens score file
-        score_dict = json.load(f)  # loads dict from file
-        top_score_list = [0, ""]
-        for name in score_dict:
-            name_score = score_dict[name]
-            if name_score > top_score_list[0]:
-                top_score_list[0] = name_score
-                top_score_list[1] = name
+    board = get_score_store().leaderboard(difficulty)
     if requested_name != "":
-        if requested_name in score_dict:  # if the user's requested name is in the dict
-            requested_score = score_dict[requested_name]
-            score_info_label.config(text="{}'s top WPM is {}".format(requested_name, requested_score))
+        if requested_name in board:  # if the user's requested name has a score
+            lines = ["{}'s top WPM is {}, rank {} of {}".format(requested_name, board.get(requested_name),
+                                                                board.rank(requested_name), len(board))]
+            for difficulty_name in DIFFICULTY_DICT:
+                difficulty_board = get_score_store().leaderboard(difficulty_name)
+                if requested_name in difficulty_board:
+                    lines.append("{}: {} WPM, rank {}".format(difficulty_name, difficulty_board.get(requested_name),
+                                                              difficulty_board.rank(requested_name)))
+            score_info_label.config(text="\n".join(lines))
         else:  # if user's requested name is not in dict
             score_info_label.config(text="USER NOT FOUND")  # updates score_info_label with error message
+    elif len(board) == 0:
+        score_info_label.config(text="no scores yet")
     else:
-        score_info_label.config(text="the highest score is held by {} with {}WPM".format(top_score_list[1],
-                                                                                         top_score_list[0]))
+        lines = ["TOP WPM ({})".format(difficulty or "all")]
+        for name, name_score in board.top(LEADERBOARD_SIZE):
+            lines.append("{}. {} {}WPM".format(board.rank(name), name, name_score))
+        score_info_label.config(text="\n".join(lines))
 
 
 def create_consent_popup():
     """
     creates a popup for the user to consent
-    disables all children of opening_frame, creates a Toplevel with root as parent, creates label, configures label
+    disables all children of the opening screen, creates a Toplevel with root as parent, creates label, configures label
     sets popup to top, making it on top of root
     :return:
     """
-    for child in opening_frame.winfo_children():  # sets all children of opening_frame to disabled
+    for child in screens["opening"].winfo_children():  # sets all children of the opening screen to disabled
         child.configure(state="disabled")
     consent_popup = Toplevel(root)
     consent_popup.geometry("300x300")
@@ -469,11 +1027,11 @@ def create_consent_popup():
 
 def consent(popup_name):
     """
-    enables all children of opening_frame, destroys popup, places root on top
+    enables all children of the opening screen, destroys popup, places root on top
     :param popup_name: name of the consent popup
     :return:
     """
-    for child in opening_frame.winfo_children():
+    for child in screens["opening"].winfo_children():
         child.configure(state="normal")
     popup_name.destroy()
     root.attributes("-topmost", True)
@@ -490,181 +1048,376 @@ def update_font_size(size):
         font_size = LARGE_FONT_SIZE
 
 
+def build_opening_screen():
+    """
+    builds the screen asking for the user's name
+    :return: the screen's frame
+    """
+    global name_field
+    opening_frame = Frame(root, bg="grey43")
+    opening_frame.grid(row=0, column=0)
+    info_label = Label(opening_frame, text="hi there, please enter your user name into the entry field below and then"
+                                           "click continue. thanks")
+    # changes font size to make it larger
+    info_label.config(font=("TkDefaultFont", 17), wraplength=250, bg="grey43", anchor=N, justify=CENTER)
+    name_field = Entry(opening_frame)
+    continue_button = Button(opening_frame, text="CONTINUE", command=name_checking)
+    info_label.grid(row=0, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    name_field.grid(row=1, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    continue_button.grid(row=2, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    return opening_frame
+
+
+def build_menu_screen():
+    """
+    builds the main menu
+    :return: the screen's frame
+    """
+    menu_frame = Frame(root, bg="grey43")
+    menu_frame.grid(row=0, column=0)
+    top_frame = Frame(menu_frame, bg="grey63")
+    button_frame = Frame(menu_frame, bg="grey63")
+    image_frame = Frame(menu_frame, bg="grey63")
+    top_frame.grid(row=0, column=0, sticky="WE", padx=10, pady=10)
+    top_frame.grid_columnconfigure(0, weight=1)
+    button_frame.grid(row=1, column=0, sticky="WE", padx=10, pady=10)
+    button_frame.grid_columnconfigure(0, weight=1)
+    button_frame.grid_columnconfigure(1, weight=1)
+    button_frame.grid_columnconfigure(2, weight=1)
+    image_frame.grid(row=2, column=0, padx=10, pady=10)
+    image_frame.grid_columnconfigure(0, weight=1)
+    title_label = Label(top_frame, text="WELCOME TO FLYNN'S TYPING GAME")
+    start_button = Button(button_frame, text="START", command=show_settings)
+    instructions_button = Button(button_frame, text="INSTRUCTIONS", command=show_instructions)
+    scores_button = Button(button_frame, text="SCORES", command=lambda: [show_score_screen(), retrieve_score("")])
+    exit_button = Button(button_frame, text="EXIT", command=close)
+    type_writer_canvas = Canvas(image_frame, width=173, height=150, bg="grey63")
+    type_writer_canvas.grid(row=0, column=0, padx=10, pady=10)
+    type_writer_canvas.create_image(0, 0, anchor=NW, image=load_images())
+    title_label.grid(row=0, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    start_button.grid(row=0, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    scores_button.grid(row=0, column=1, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    instructions_button.grid(row=0, column=2, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    exit_button.grid(row=0, column=3, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    return menu_frame
+
+
+def build_instructions_screen():
+    """
+    builds the instructions screen
+    :return: the screen's frame
+    """
+    instruction_frame = Frame(root, bg="grey43")
+    instruction_frame.grid(row=0, column=0)
+    instructions_label = Label(instruction_frame, text="text falls from the sky. it is your job to type the words into "
+                                                       "the entry field before they reach the bottom or you will die. "
+                                                       "you dont have to press space after you type a word, but you "
+                                                       "can.")
+    # changes font size to make it larger
+    instructions_label.config(font=("TkDefaultFont", 17), wraplength=250, bg="grey43", anchor=N, justify=CENTER)
+    instructions_back_button = Button(instruction_frame, text="BACK", command=back)
+    instructions_label.pack(padx=10, pady=10)
+    instructions_back_button.pack(pady=5)
+    return instruction_frame
+
+
+def build_score_screen():
+    """
+    builds the score lookup screen
+    :return: the screen's frame
+    """
+    global score_info_label
+    score_frame = Frame(root, bg="grey43")
+    score_frame.grid(row=0, column=0)
+    score_instructions_label = Label(score_frame, text="enter the name of the desired user below and then click the "
+                                                       "find score button")
+    score_instructions_label.config(font=("TkDefaultFont", 13), wraplength=250, bg="grey43", fg="black",
+                                    justify=CENTER)
+    retrieve_score_entry = Entry(score_frame)
+    retrieve_score_button = Button(score_frame, text="FIND SCORE",
+                                   command=lambda: retrieve_score(retrieve_score_entry.get()))
+    board_frame = Frame(score_frame, bg="grey43")
+    all_board_button = Button(board_frame, text="all", command=lambda: retrieve_score(""))
+    easy_board_button = Button(board_frame, text="easy", command=lambda: retrieve_score("", "easy"))
+    medium_board_button = Button(board_frame, text="medium", command=lambda: retrieve_score("", "medium"))
+    hard_board_button = Button(board_frame, text="hard", command=lambda: retrieve_score("", "hard"))
+    score_back_button = Button(score_frame, text="BACK", command=back)
+    score_info_label = Label(score_frame, text="")
+    score_info_label.config(font=("TkDefaultFont", 12), wraplength=250, bg="grey43", anchor=N, justify=CENTER)
+    score_instructions_label.grid(row=0, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    retrieve_score_entry.grid(row=1, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    retrieve_score_button.grid(row=2, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    board_frame.grid(row=3, column=0)
+    all_board_button.grid(row=0, column=0, padx=DEFAULT_PADDING)
+    easy_board_button.grid(row=0, column=1, padx=DEFAULT_PADDING)
+    medium_board_button.grid(row=0, column=2, padx=DEFAULT_PADDING)
+    hard_board_button.grid(row=0, column=3, padx=DEFAULT_PADDING)
+    score_back_button.grid(row=4, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    score_info_label.grid(row=5, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    return score_frame
+
+
+def build_settings_screen():
+    """
+    builds the settings screen, where the text file, passage mode, font size, difficulty and race server are chosen
+    :return: the screen's frame
+    """
+    global error_label, loading_label, adaptive_words, passage_mode, passage_line_entry, race_entry, race_label
+    settings_frame = Frame(root, bg="grey43")
+    settings_frame.grid(row=0, column=0)
+    choose_text_label = Label(settings_frame, text="OPTIONAL : enter the name of your custom text file into the entry "
+                                                   "field below. make sure to include the .txt at the end!")
+    choose_text_label.config(font=("TkDefaultFont", 11), wraplength=250, bg="grey43", justify=CENTER)
+    custom_text = Entry(settings_frame)
+    small_size_button = Button(settings_frame, text="small font", command=lambda: update_font_size("small"))
+    medium_size_button = Button(settings_frame, text="medium font", command=lambda: update_font_size("medium"))
+    large_size_button = Button(settings_frame, text="large font", command=lambda: update_font_size("large"))
+    easy_button = Button(settings_frame, text="easy", command=lambda: prepare_game(custom_text.get(), "easy"))
+    medium_button = Button(settings_frame, text="medium", command=lambda: prepare_game(custom_text.get(), "medium"))
+    hard_button = Button(settings_frame, text="hard", command=lambda: prepare_game(custom_text.get(), "hard"))
+    error_label = Label(settings_frame, text="ERROR: invalid file name and/or type")
+    error_label.config(font=("TkDefaultFont", 13), wraplength=250, bg="grey43", fg="red", justify=CENTER)
+    loading_label = Label(settings_frame, text="loading words...")
+    loading_label.config(font=("TkDefaultFont", 13), wraplength=250, bg="grey43", justify=CENTER)
+    adaptive_words = BooleanVar(value=False)  # whether words are weighted towards the user's weak keys
+    adaptive_button = Checkbutton(settings_frame, text="practise my weak keys", variable=adaptive_words)
+    adaptive_button.config(font=("TkDefaultFont", 11), bg="grey43")
+    passage_mode = BooleanVar(value=False)  # whether the text file is typed in order as a passage
+    passage_button = Checkbutton(settings_frame, text="type it as a passage from line:", variable=passage_mode)
+    passage_button.config(font=("TkDefaultFont", 11), bg="grey43")
+    passage_line_entry = Entry(settings_frame, width=8)  # line to start the passage at, empty to carry on
+    race_entry = Entry(settings_frame)  # race server as host or host:port, localhost if empty
+    race_button = Button(settings_frame, text="RACE", command=join_race)
+    race_label = Label(settings_frame, text="")
+    race_label.config(font=("TkDefaultFont", 11), wraplength=250, bg="grey43", justify=CENTER)
+    choose_text_label.grid(row=0, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING, columnspan=3)
+    custom_text.grid(row=1, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING, columnspan=3)
+    small_size_button.grid(row=2, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    medium_size_button.grid(row=2, column=1, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    large_size_button.grid(row=2, column=2, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    easy_button.grid(row=3, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    medium_button.grid(row=3, column=1, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    hard_button.grid(row=3, column=2, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    error_label.grid(row=4, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING, columnspan=3)
+    error_label.grid_remove()  # hide the error label until an error with the file type or name occurs
+    loading_label.grid(row=5, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING, columnspan=3)
+    adaptive_button.grid(row=6, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING, columnspan=3)
+    loading_label.grid_remove()  # only shown while a text file is loading
+    passage_button.grid(row=7, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING, columnspan=2)
+    passage_line_entry.grid(row=7, column=2, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    race_entry.grid(row=8, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING, columnspan=2)
+    race_button.grid(row=8, column=2, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    race_label.grid(row=9, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING, columnspan=3)
+    race_label.grid_remove()  # only shown while joining or waiting for a race
+    return settings_frame
+
+
+def build_game_screen():
+    """
+    builds the game canvas, its HUD and the entry field keystrokes are typed into
+    :return: the screen's frame
+    """
+    global game_canvas, wpm_item, timer_item, overlay_item, standings_item, retained_canvas, text_pool, \
+        particle_system, game_entry
+    game_frame = Frame(root, bg="grey43")
+    game_frame.grid(row=0, column=0)
+    game_canvas = Canvas(game_frame, width=CANVAS_WIDTH, height=CANVAS_HEIGHT, bg="grey73")
+    wpm_item = game_canvas.create_text(25, 15, text="WPM: ")
+    timer_item = game_canvas.create_text(25, 30, text="TIME: ")
+    overlay_item = game_canvas.create_text(CANVAS_WIDTH - 5, 5, text="", anchor=NE, justify=RIGHT, state="hidden")
+    standings_item = game_canvas.create_text(5, CANVAS_HEIGHT - 5, text="", anchor=SW, justify=LEFT, state="hidden")
+    if AUDIT_ITEMCONFIG:
+        audit_itemconfig(game_canvas, profiler)
+    retained_canvas = RetainedCanvas(game_canvas)  # every change to the canvas apart from explosions goes through it
+    for hud_item, hud_text, hud_state in ((wpm_item, "WPM: ", "normal"), (timer_item, "TIME: ", "normal"),
+                                          (overlay_item, "", "hidden"), (standings_item, "", "hidden")):
+        retained_canvas.track(hud_item, game_canvas.coords(hud_item), text=hud_text, state=hud_state)
+    text_pool = CanvasItemPool(retained_canvas, "text")  # word items
+    particle_system = ParticleSystem(game_canvas, CANVAS_WIDTH, CANVAS_HEIGHT, EXPLOSION_PARTICLES,
+                                     EXPLOSION_FADE_STEPS, background=CANVAS_COLOUR)
+    game_entry = Entry(game_frame)
+    game_entry.bind("<Key>", key_pressed)  # buffers keystrokes for the frame scheduler instead of editing the entry
+    game_entry.bind("<<Paste>>", text_pasted)
+    game_entry.bind("<Control-v>", text_pasted)  # more specific than <Key>, which would otherwise swallow the paste
+    for key, handler in (("<F3>", toggle_overlay), ("<F4>", dump_trace)):
+        game_entry.bind(key, handler)  # more specific than <Key>, whose "break" would stop bind_all seeing it
+        root.bind_all(key, handler)
+    game_canvas.grid(row=0, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    game_entry.grid(row=1, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    return game_frame
+
+
+def build_end_screen():
+    """
+    builds the screen showing the results of a game
+    :return: the screen's frame
+    """
+    global wpm_label, accuracy_label, timer_label, stats_label, replay_button
+    end_frame = Frame(root, bg="grey43")
+    end_frame.grid(row=0, column=0)
+    wpm_label = Label(end_frame, text="")
+    wpm_label.config(font=("TkDefaultFont", 15), wraplength=250, bg="grey43", justify=CENTER)
+    accuracy_label = Label(end_frame, text="")
+    accuracy_label.config(font=("TkDefaultFont", 15), wraplength=250, bg="grey43", justify=CENTER)
+    timer_label = Label(end_frame, text="")
+    timer_label.config(font=("TkDefaultFont", 15), wraplength=250, bg="grey43", justify=CENTER)
+    stats_label = Label(end_frame, text="")
+    stats_label.config(font=("TkDefaultFont", 11), wraplength=250, bg="grey43", justify=CENTER)
+    end_back_button = Button(end_frame, text="BACK", command=back)
+    replay_button = Button(end_frame, text="WATCH REPLAY", command=watch_replay)
+    wpm_label.grid(row=0, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    accuracy_label.grid(row=0, column=1, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    timer_label.grid(row=1, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING, columnspan=2)
+    stats_label.grid(row=2, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING, columnspan=2)
+    end_back_button.grid(row=3, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    replay_button.grid(row=3, column=1, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
+    return end_frame
+
+
+SCREEN_BUILDERS = {"opening": build_opening_screen, "menu": build_menu_screen,
+                   "instructions": build_instructions_screen, "scores": build_score_screen,
+                   "settings": build_settings_screen, "game": build_game_screen, "end": build_end_screen}
+
+
+def show_screen(name):
+    """
+    hides the screen on show and shows another, building it the first time it is shown
+    :param name: key into SCREEN_BUILDERS
+    :return: the screen's frame
+    """
+    global current_screen
+    if current_screen is not None:
+        screens[current_screen].grid_remove()
+    if name not in screens:
+        screens[name] = SCREEN_BUILDERS[name]()
+    screens[name].grid()
+    current_screen = name
+    return screens[name]
+
+
+def load_images():
+    """
+    :return: the menu's typewriter PhotoImage, loaded the first time it is needed
+    """
+    global type_writer_image
+    if type_writer_image is None:
+        type_writer_image = PhotoImage(file="typerwriter.png")
+    return type_writer_image
+
+
+def get_score_store():
+    """
+    :return: the score store, opened the first time it is needed
+    """
+    global score_store
+    if score_store is None:
+        if SCORE_BACKEND == "sqlite":
+            score_store = SqliteScoreStore(SCORE_DB_FILE_NAME, import_file_name=SCORE_FILE_NAME)
+        else:
+            score_store = ScoreStore(SCORE_FILE_NAME, SCORE_LOG_FILE_NAME)  # every user's top wpm
+    return score_store
+
+
+def load_in_background(tasks=None):
+    """
+    runs the startup work the first screen does not need, one task per turn of the event loop once the window has
+    been drawn, so the window is up and responsive as soon as possible. anything the user reaches first is loaded on
+    demand instead
+    :param tasks: list of the callables still to run, all of them when first called
+    :return:
+    """
+    if tasks is None:
+        tasks = [get_score_store, load_images, preload_words]
+    if tasks:
+        tasks.pop(0)()
+        root.after(1, lambda: load_in_background(tasks))
+
+
+def when_drawn(callback):
+    """
+    calls callback once the window is on screen and drawn, checking from the event loop
+    :param callback: callable taking no arguments
+    :return:
+    """
+    if root.winfo_viewable():
+        root.update_idletasks()  # finishes drawing anything still waiting to be drawn
+        callback()
+    else:
+        root.after(1, lambda: when_drawn(callback))
+
+
+def first_screen_drawn(on_ready=None):
+    """
+    called once the first screen is up, starts loading everything else in the background
+    :param on_ready: optional callable to run first, see main()
+    :return:
+    """
+    if on_ready is not None:
+        on_ready()
+    if not closed:  # on_ready may close the program, e.g. once the startup benchmark has its time
+        load_in_background()
+
+
 # variables
 user_name = ""  # string for user name
-active_words = {}  # list of words currently falling down
-letter_num = 0
-start_time = 0
-words_typed = 0
-in_game = False  # bool for whether or not the user is in game
-wpm = 0
-timer = 0
-accuracy_list = [0, 0]
+engine = None  # GameEngine for the current or last game
+word_items = {}  # engine Word -> canvas text item
+key_buffer = KeyBuffer()  # keystrokes waiting for the next frame
 chosen_difficulty = ""  # string for chosen difficulty
-words_list = []
+word_index = None  # WordIndex of the words for the current game
+word_loader = None  # WordListLoader of the text file being loaded, None when not loading
+word_loader_file = None  # path of the text file being loaded
+start_when_loaded = False  # whether to start a game once the text file being loaded has been read
+default_index = None  # WordIndex of the default text file, loaded in the background after startup
+score_store = None  # ScoreStore or SqliteScoreStore, see get_score_store()
+closed = False  # whether close() has destroyed root
+# word widths, measured with Tk fonts once there is a window
+text_measurer = TextMeasurer(lambda family, size: tkinter.font.Font(font=(family, size)))
 font_size = MEDIUM_FONT_SIZE
-
-
-# create widgets / root
-root = Tk()
-root.title("flynns typing game")
-root.columnconfigure(0, weight=1)
-root.configure(bg="grey43")
-root.geometry("{}x{}".format(ROOT_WIDTH, ROOT_HEIGHT))
-root.resizable(width=False, height=False)
-
-# create frames
-
-# main frames
-opening_frame = Frame(root, bg="grey43")
-menu_frame = Frame(root, bg="grey43")
-instruction_frame = Frame(root, bg="grey43")
-score_frame = Frame(root, bg="grey43")
-game_frame = Frame(root, bg="grey43")
-settings_frame = Frame(root, bg="grey43")
-end_frame = Frame(root, bg="grey43")
-# menu
-top_frame = Frame(menu_frame, bg="grey63")
-button_frame = Frame(menu_frame, bg="grey63")
-image_frame = Frame(menu_frame, bg="grey63")
-
-# grid frames
-
-# main frames
-opening_frame.grid(row=0, column=0)
-menu_frame.grid(row=0, column=0)
-instruction_frame.grid(row=0, column=0)
-score_frame.grid(row=0, column=0)
-game_frame.grid(row=0, column=0)
-settings_frame.grid(row=0, column=0)
-end_frame.grid(row=0, column=0)
-# menu
-top_frame.grid(row=0, column=0, sticky="WE", padx=10, pady=10)
-top_frame.grid_columnconfigure(0, weight=1)
-button_frame.grid(row=1, column=0, sticky="WE", padx=10, pady=10)
-button_frame.grid_columnconfigure(0, weight=1)
-button_frame.grid_columnconfigure(1, weight=1)
-button_frame.grid_columnconfigure(2, weight=1)
-image_frame.grid(row=2, column=0, padx=10, pady=10)
-image_frame.grid_columnconfigure(0, weight=1)
-
-# create widgets
-
-# opening frame
-info_label = Label(opening_frame, text="hi there, please enter your user name into the entry field below and then"
-                                       "click continue. thanks")
-# changes font size to make it larger
-info_label.config(font=("TkDefaultFont", 17), wraplength=250, bg="grey43", anchor=N, justify=CENTER)
-name_field = Entry(opening_frame)
-continue_button = Button(opening_frame, text="CONTINUE", command=name_checking)
-# menu
-title_label = Label(top_frame, text="WELCOME TO FLYNN'S TYPING GAME")
-start_button = Button(button_frame, text="START", command=show_settings)
-instructions_button = Button(button_frame, text="INSTRUCTIONS", command=show_instructions)
-scores_button = Button(button_frame, text="SCORES", command=lambda: [show_score_screen(), retrieve_score("")])
-exit_button = Button(button_frame, text="EXIT", command=close)
-type_writer_canvas = Canvas(image_frame, width=173, height=150, bg="grey63")
-type_writer_canvas.grid(row=0, column=0, padx=10, pady=10)
-type_writer_image = PhotoImage(file="typerwriter.png")
-type_writer_canvas.create_image(0, 0, anchor=NW, image=type_writer_image)
-# instructions
-instructions_label = Label(instruction_frame, text="text falls from the sky. it is your job to type the words into the "
-                                                   "entry field before they reach the bottom or you will die. you dont "
-                                                   "have to press space after you type a word, but you can.")
-# changes font size to make it larger
-instructions_label.config(font=("TkDefaultFont", 17), wraplength=250, bg="grey43", anchor=N, justify=CENTER)
-instructions_back_button = Button(instruction_frame, text="BACK", command=back)
-# score frame
-score_instructions_label = Label(score_frame, text="enter the name of the desired user below and then click the find "
-                                                   "score button")
-score_instructions_label.config(font=("TkDefaultFont", 13), wraplength=250, bg="grey43", fg="black", justify=CENTER)
-retrieve_score_entry = Entry(score_frame)
-retrieve_score_button = Button(score_frame, text="FIND SCORE", command=lambda: retrieve_score(retrieve_score_entry.get()
-                                                                                              ))
-score_back_button = Button(score_frame, text="BACK", command=back)
-score_info_label = Label(score_frame, text="")
-score_info_label.config(font=("TkDefaultFont", 17), wraplength=250, bg="grey43", anchor=N, justify=CENTER)
-# settings
-choose_text_label = Label(settings_frame, text="OPTIONAL : enter the name of your custom text file into the entry field"
-                                               " below. make sure to include the .txt at the end!")
-choose_text_label.config(font=("TkDefaultFont", 11), wraplength=250, bg="grey43", justify=CENTER)
-custom_text = Entry(settings_frame)
-small_size_button = Button(settings_frame, text="small font", command=lambda: update_font_size("small"))
-medium_size_button = Button(settings_frame, text="medium font", command=lambda: update_font_size("medium"))
-large_size_button = Button(settings_frame, text="large font", command=lambda: update_font_size("large"))
-easy_button = Button(settings_frame, text="easy", command=lambda: prepare_game(custom_text.get(), "easy"))
-medium_button = Button(settings_frame, text="medium", command=lambda: prepare_game(custom_text.get(), "medium"))
-hard_button = Button(settings_frame, text="hard", command=lambda: prepare_game(custom_text.get(), "hard"))
-error_label = Label(settings_frame, text="ERROR: invalid file name and/or type")
-error_label.config(font=("TkDefaultFont", 13), wraplength=250, bg="grey43", fg="red", justify=CENTER)
-# game
-game_canvas = Canvas(game_frame, width=CANVAS_WIDTH, height=CANVAS_HEIGHT, bg="grey73")
-wpm_item = game_canvas.create_text(25, 15, text="WPM: ")
-timer_item = game_canvas.create_text(25, 30, text="TIME: ")
-sv = StringVar()
-sv.trace("w", lambda name, index, mode, av=sv: callback(sv))  # trace method to run callback function when entry edited
-game_entry = Entry(game_frame, textvariable=sv)
-# end
-wpm_label = Label(end_frame, text="")
-wpm_label.config(font=("TkDefaultFont", 15), wraplength=250, bg="grey43", justify=CENTER)
-accuracy_label = Label(end_frame, text="")
-accuracy_label.config(font=("TkDefaultFont", 15), wraplength=250, bg="grey43", justify=CENTER)
-timer_label = Label(end_frame, text="")
-timer_label.config(font=("TkDefaultFont", 15), wraplength=250, bg="grey43", justify=CENTER)
-end_back_button = Button(end_frame, text="BACK", command=back)
-
-# grid widgets
-
-# opening frame
-info_label.grid(row=0, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-name_field.grid(row=1, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-continue_button.grid(row=2, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-# menu
-title_label.grid(row=0, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-start_button.grid(row=0, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-scores_button.grid(row=0, column=1, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-instructions_button.grid(row=0, column=2, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-exit_button.grid(row=0, column=3, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-# instructions
-instructions_label.pack(padx=10, pady=10)
-instructions_back_button.pack(pady=5)
-# score frame
-score_instructions_label.grid(row=0, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-retrieve_score_entry.grid(row=1, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-retrieve_score_button.grid(row=2, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-score_back_button.grid(row=3, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-score_info_label.grid(row=4, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-# settings
-choose_text_label.grid(row=0, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING, columnspan=3)
-custom_text.grid(row=1, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING, columnspan=3)
-small_size_button.grid(row=2, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-medium_size_button.grid(row=2, column=1, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-large_size_button.grid(row=2, column=2, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-easy_button.grid(row=3, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-medium_button.grid(row=3, column=1, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-hard_button.grid(row=3, column=2, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-error_label.grid(row=4, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING, columnspan=3)
-error_label.grid_remove()  # hide the error label until an error with the file type or name occurs
-# game
-game_canvas.grid(row=0, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-game_entry.grid(row=1, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-# end
-wpm_label.grid(row=0, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-accuracy_label.grid(row=0, column=1, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING)
-timer_label.grid(row=1, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING, columnspan=2)
-end_back_button.grid(row=2, column=0, padx=DEFAULT_PADDING, pady=DEFAULT_PADDING, columnspan=2)
-
-# hides all frames but main menu frame to start with
-menu_frame.grid_remove()
-game_frame.grid_remove()
-instruction_frame.grid_remove()
-score_frame.grid_remove()
-settings_frame.grid_remove()
-end_frame.grid_remove()
-
-# runs starting functions
-update_timer()
-create_consent_popup()
-
-# loops root
-root.mainloop()
+weakness_model = None  # adaptive.WeaknessModel of the user, None until it is first needed
+recorder = None  # SessionRecorder of the current or last game played
+replaying = False  # whether the game on screen is a replay
+racing = False  # whether the game on screen is a race
+race_client = None  # RaceClient while connected to a race server
+race_standings = []  # lines of the latest race standings
+passage_sampler = None  # PassageSampler of the passage being typed, None in other games
+show_overlay = False  # whether the frame time overlay is shown
+particles_running = False  # whether the particle system is registered with the frame scheduler
+type_writer_image = None  # PhotoImage on the menu, see load_images()
+screens = {}  # screen name -> its frame, for every screen built so far
+current_screen = None  # name of the screen on show
+# created by main() and the screen builders, as Tk widgets can only exist once there is a window
+root = profiler = frame_scheduler = None
+name_field = score_info_label = error_label = loading_label = adaptive_words = passage_mode = passage_line_entry = \
+    race_entry = race_label = None
+game_canvas = wpm_item = timer_item = overlay_item = standings_item = retained_canvas = text_pool = \
+    particle_system = game_entry = None
+wpm_label = accuracy_label = timer_label = stats_label = replay_button = None
+
+
+def main(on_ready=None):
+    """
+    creates the window and shows the opening screen, then runs the Tk event loop. every other screen is built the
+    first time it is shown, and the score store, images and default words are loaded once the window has been drawn
+    :param on_ready: optional callable run once the first screen has been drawn, e.g. by the startup benchmark
+    :return:
+    """
+    global root, profiler, frame_scheduler
+    root = Tk()
+    root.title("flynns typing game")
+    root.columnconfigure(0, weight=1)
+    root.configure(bg="grey43")
+    root.geometry("{}x{}".format(ROOT_WIDTH, ROOT_HEIGHT))
+    root.resizable(width=False, height=False)
+    root.protocol("WM_DELETE_WINDOW", close)  # closing the window also saves pending scores
+    profiler = FrameProfiler({"after_callbacks": pending_after_count,
+                              "canvas_items": lambda: len(game_canvas.find_all()) if game_canvas is not None else 0})
+    frame_scheduler = FrameScheduler(root, profiler=profiler)  # one after loop for the engine, explosions and HUD
+    show_screen("opening")
+    create_consent_popup()
+    root.after_idle(lambda: when_drawn(lambda: first_screen_drawn(on_ready)))
+    root.mainloop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Particle system for the typing game's explosions
+
+Every live particle is kept in flat arrays of position, velocity, age and canvas item, so moving all of them is one
+pass per simulation step however many explosions are on screen. A particle is culled as soon as it leaves the canvas
+or has faded out, and its line item is hidden and kept for the next explosion. Drawing sends every change made in a
+frame to Tk as a single Tcl script rather than one call per line. This module does not import tkinter, it only draws
+onto the canvas it is given, and without a canvas it only simulates the particles (e.g. for tune.py to measure how
+many are on screen).
+"""
+import math
+from array import array
+
+PARTICLE_SPEED = 3 * math.sqrt(2)  # pixels a particle moves each simulation step
+PARTICLE_START = 20 * math.sqrt(2)  # distance from the centre of the typed word a particle starts at
+PARTICLE_LENGTH = 10 * math.sqrt(2)  # length of the line drawn for a particle
+FADE_SHADES = 16  # colours a fading particle passes through
+UNDRAWN_SHADE = 255  # shade of a particle whose colour has not been set since its line was reused
+
+
+def fade_palette(start, end, shades):
+    """
+    :param start: (red, green, blue) 0-255 colour to fade from
+    :param end: (red, green, blue) 0-255 colour to fade to, usually the canvas background
+    :param shades: number of colours
+    :return: list of Tk "#rrggbb" colours going from start to end
+    """
+    palette = []
+    for shade in range(shades):
+        fraction = shade / max(1, shades - 1)
+        palette.append("#{:02x}{:02x}{:02x}".format(*(int(round(a + (b - a) * fraction)) for a, b in zip(start, end))))
+    return palette
+
+
+class ParticleSystem:
+    """
+    every explosion line on a canvas
+    call emit() for each explosion, step() once per simulation step and draw() once per frame
+    """
+    def __init__(self, canvas, width, height, density=4, fade_steps=0, colour=(0, 0, 0), background=(0, 0, 0),
+                 speed=PARTICLE_SPEED):
+        """
+        :param canvas: Canvas the particles are drawn on, None to simulate them without drawing
+        :param width: width of the canvas, particles are culled once they leave it
+        :param height: height of the canvas
+        :param density: particles per explosion, spread evenly around the word starting from the top right diagonal
+        :param fade_steps: simulation steps a particle takes to fade into the background, 0 for no fading
+        :param colour: (red, green, blue) colour of a new particle
+        :param background: (red, green, blue) colour particles fade into
+        :param speed: pixels a particle moves each simulation step
+        """
+        self.canvas = canvas
+        self.path = str(canvas)  # Tcl name of the canvas widget
+        self.speed = speed
+        self.width = width
+        self.height = height
+        self.fade_steps = fade_steps
+        self.palette = fade_palette(colour, background, FADE_SHADES if fade_steps else 1)
+        # unit direction of every particle in an explosion, the first is 45 degrees up and to the right
+        self.directions = [(math.cos(math.pi / 4 + 2 * math.pi * index / density),
+                            -math.sin(math.pi / 4 + 2 * math.pi * index / density)) for index in range(density)]
+        self.x = array("d")  # inner end of each live particle's line
+        self.y = array("d")
+        self.dx = array("d")  # unit direction each live particle is flying in
+        self.dy = array("d")
+        self.age = array("I")  # simulation steps since each live particle was emitted
+        self.shades = array("B")  # palette index each live particle was last drawn with, UNDRAWN_SHADE if not yet
+        self.items = array("I")  # canvas line item of each live particle
+        self.free_items = []  # hidden line items ready to be reused
+        self.shown_items = []  # reused items to show on the next draw
+        self.hidden_items = []  # items of culled particles to hide on the next draw
+
+    def __len__(self):
+        return len(self.x)
+
+    def emit(self, x, y):
+        """
+        adds an explosion's particles around a point
+        :param x: centre of the explosion
+        :param y: centre of the explosion
+        :return:
+        """
+        for dx, dy in self.directions:
+            start_x, start_y = x + dx * PARTICLE_START, y + dy * PARTICLE_START
+            shade = 0
+            if self.canvas is None:  # nothing is drawn
+                item = 0
+            elif self.free_items:  # a reused line may have been hidden while faded, so its colour is set when drawn
+                item = self.free_items.pop()
+                self.shown_items.append(item)
+                shade = UNDRAWN_SHADE
+            else:
+                item = self.canvas.create_line(start_x, start_y, start_x + dx * PARTICLE_LENGTH,
+                                               start_y + dy * PARTICLE_LENGTH, fill=self.palette[0])
+            self.x.append(start_x)
+            self.y.append(start_y)
+            self.dx.append(dx)
+            self.dy.append(dy)
+            self.age.append(0)
+            self.shades.append(shade)
+            self.items.append(item)
+
+    def cull(self, index):
+        """
+        removes a particle by moving the last particle into its place
+        :param index: index of the particle
+        :return:
+        """
+        if self.canvas is not None:
+            self.hidden_items.append(self.items[index])
+        for values in (self.x, self.y, self.dx, self.dy, self.age, self.shades, self.items):
+            values[index] = values[-1]
+            values.pop()
+
+    def step(self):
+        """
+        moves every particle by one simulation step, culling particles whose line has left the canvas or faded out
+        :return: True, the system stays registered for as long as draw() says so
+        """
+        x, y, dx, dy, age = self.x, self.y, self.dx, self.dy, self.age
+        index = 0
+        while index < len(x):
+            x[index] += dx[index] * self.speed
+            y[index] += dy[index] * self.speed
+            age[index] += 1
+            # the inner end of the line is the last part of it to leave the canvas
+            visible = 0 < x[index] < self.width and 0 < y[index] < self.height
+            if visible and (not self.fade_steps or age[index] < self.fade_steps):
+                index += 1
+            else:
+                self.cull(index)  # the last particle is moved into index, so it is looked at next
+        return True
+
+    def draw(self, alpha=1):
+        """
+        moves every particle's line to its position interpolated between the last two simulation steps and hides the
+        lines of culled particles, in one Tcl call
+        :param alpha: how far through the current simulation step the frame is, 0-1
+        :return: False once there is nothing left to draw
+        """
+        # shown before hiding, as a reused line whose particle was culled before it was ever drawn is in both lists
+        commands = ["{} itemconfigure {} -state normal".format(self.path, item) for item in self.shown_items]
+        commands.extend("{} itemconfigure {} -state hidden".format(self.path, item) for item in self.hidden_items)
+        self.free_items.extend(self.hidden_items)
+        self.hidden_items.clear()
+        self.shown_items.clear()
+        offset = (alpha - 1) * self.speed  # from the last simulated position back towards the previous one
+        for index in range(len(self.x)):
+            dx, dy = self.dx[index], self.dy[index]
+            x, y = self.x[index], self.y[index]
+            if self.age[index] > 0:  # a particle that has not moved yet has no previous position
+                x, y = x + dx * offset, y + dy * offset
+            commands.append("{} coords {} {:.1f} {:.1f} {:.1f} {:.1f}".format(
+                self.path, self.items[index], x, y, x + dx * PARTICLE_LENGTH, y + dy * PARTICLE_LENGTH))
+            shade = min(self.age[index] * len(self.palette) // self.fade_steps, len(self.palette) - 1) \
+                if self.fade_steps else 0
+            if shade != self.shades[index]:
+                self.shades[index] = shade
+                commands.append("{} itemconfigure {} -fill {}".format(self.path, self.items[index],
+                                                                      self.palette[shade]))
+        if commands:
+            self.canvas.tk.eval("\n".join(commands))
+        return len(self.x) > 0
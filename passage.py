@@ -0,0 +1,405 @@
+"""
+Passage mode for the typing game: typing through a text in order instead of random words
+
+A PassageSampler memory-maps the text file and tokenizes it a window of bytes at a time as words are drawn, so only
+the window and the words drawn from it are ever held in memory, whether the text is a short story or a corpus of
+several gigabytes. It has the take() / release() / advance() interface of wordlist.WordSampler and is handed to the
+engine as its word source, so passage words spawn, fall and are typed like any other word.
+
+A position in a text is the byte offset of a word together with the line it is on. Each user's position in every text
+they have typed is saved when a game ends, so the next game carries on from the first word they did not type. Starting
+at a chosen line instead uses a sparse line index that records the offset of one line start in every
+INDEX_BLOCK_BYTES of the file, saved next to the word list caches and rebuilt when the file changes. Finding a line
+only scans forward from the closest indexed line before it.
+"""
+import os
+import re
+import mmap
+import json
+import struct
+from array import array
+from bisect import bisect_right
+from collections import deque
+from urllib.parse import quote
+from scores import write_atomically
+from wordlist import WordListError, CACHE_DIR, cache_path, evict_stale_caches
+
+PASSAGE_DIR = "passages"  # folder each user's positions in the texts they have typed are saved in
+READ_AHEAD_BYTES = 16384  # bytes of the text tokenized at a time
+MAX_PASSAGE_WORD_LENGTH = 20  # longer tokens (links, rows of dashes...) are skipped, no one could type them in time
+POSITIONS_KEPT = 64  # positions of the latest words drawn that are kept, more than can be in play at once
+INDEX_BLOCK_BYTES = 65536  # bytes between the line starts recorded in a line index
+INDEX_CHUNK_BLOCKS = 256  # blocks indexed per call to LineIndexBuilder.index_blocks()
+INDEX_MAGIC = b"TWLI"
+INDEX_VERSION = 2
+# magic, version, source size, source mtime_ns, source path length, number of indexed lines
+INDEX_HEADER = struct.Struct("<4sIQqII")
+TOKEN = re.compile(rb"\S+")  # a word is anything between ASCII whitespace, which never splits a UTF-8 character
+
+
+def map_text(file_name):
+    """
+    memory-maps a text file read-only, raises FileNotFoundError if it does not exist
+    :param file_name: path of the text file
+    :return: (mmap, size of the file in bytes), raises WordListError if the file is empty
+    """
+    with open(file_name, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:  # an empty file can not be mapped
+            raise WordListError("the text file is empty")
+        text_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, "MADV_SEQUENTIAL"):  # not on every platform
+        text_map.madvise(mmap.MADV_SEQUENTIAL)
+    return text_map, size
+
+
+def count_newlines(text_map, start, end):
+    """
+    :return: number of newlines between two byte offsets of a mapped text, counted a block at a time so a very long
+    stretch is never copied in one go
+    """
+    count = 0
+    for block_start in range(start, end, INDEX_BLOCK_BYTES):
+        count += text_map[block_start:min(block_start + INDEX_BLOCK_BYTES, end)].count(b"\n")
+    return count
+
+
+class PassageSampler:
+    """
+    hands out the words of a text file in order, starting from a position in it and wrapping around to the start at
+    the end of the text. words are tokenized READ_AHEAD_BYTES at a time, by advance() when the engine steps so a
+    keystroke rarely waits for it
+    """
+    def __init__(self, file_name, offset=0, line=0):
+        """
+        :param file_name: path of the text file, raises FileNotFoundError if it does not exist
+        :param offset: byte offset of the word to start at, from a saved position or LineIndex.line_start()
+        :param line: line the word is on, counting from 0
+        """
+        self.file_name = file_name
+        self.text_map, self.size = map_text(file_name)
+        self.tokens = deque()  # (word, offset, line) of the words tokenized but not yet drawn
+        self.positions = deque(maxlen=POSITIONS_KEPT)  # (offset, line) of the latest words drawn
+        self.words_taken = 0
+        self.offset = self.line = 0  # where the next window of the text starts
+        self.in_long_token = False  # whether the next window starts partway through a token longer than a window
+        self.seek(offset, line)
+
+    def seek(self, offset, line):
+        """
+        moves to a position in the text, the next word drawn is the one at it
+        :param offset: byte offset of the start of a word or line, past the end of the text to start again from the top
+        :param line: line at the offset, counting from 0
+        :return:
+        """
+        self.tokens.clear()
+        self.offset, self.line = offset, line
+        self.in_long_token = False
+
+    def seek_line(self, line_index, line):
+        """
+        moves to the start of a line
+        :param line_index: LineIndex of the text
+        :param line: line to start at, counting from 0. the last line if the text is shorter
+        :return:
+        """
+        self.seek(*line_index.line_start(self.text_map, line))
+
+    def read_window(self):
+        """
+        tokenizes the next READ_AHEAD_BYTES of the text into the token buffer. a token cut off by the end of the window
+        is left for the next window, and one longer than a whole window is skipped
+        :return:
+        """
+        if self.offset >= self.size:  # the end of the text, so it starts again from the top
+            self.offset = self.line = 0
+        end = min(self.offset + READ_AHEAD_BYTES, self.size)
+        window = self.text_map[self.offset:end]
+        matches = list(TOKEN.finditer(window))
+        window_end = len(window)  # where the next window starts, relative to this one
+        continues_long_token = self.in_long_token
+        self.in_long_token = False
+        if matches and end < self.size and matches[-1].end() == len(window):
+            if matches[-1].start() == 0:  # nowhere to cut it, skipped along with the rest of it in the next window
+                self.in_long_token = True
+            else:
+                window_end = matches[-1].start()
+            matches.pop()
+        if continues_long_token and matches and matches[0].start() == 0:
+            matches.pop(0)
+        line = self.line
+        previous = 0
+        for match in matches:
+            line += window.count(b"\n", previous, match.start())
+            previous = match.start()
+            word = match.group().decode("utf-8", errors="replace")
+            if len(word) <= MAX_PASSAGE_WORD_LENGTH:
+                self.tokens.append((word, self.offset + match.start(), line))
+        self.line = line + window.count(b"\n", previous, window_end)
+        self.offset += window_end
+
+    def fill(self):
+        """
+        reads windows of the text until there is a word to draw, raises WordListError if the text has none
+        :return:
+        """
+        wrapped = False
+        while not self.tokens:
+            self.read_window()
+            if self.offset >= self.size and not self.tokens:
+                if wrapped:  # read the whole text from the top without finding a word
+                    raise WordListError("the text file has no words short enough to type")
+                wrapped = True
+
+    def advance(self):
+        """
+        tokenizes the next window once every word read so far has been drawn
+        :return:
+        """
+        if not self.tokens:
+            self.fill()
+
+    def take(self):
+        """
+        :return: the next word of the text
+        """
+        self.fill()
+        word, offset, line = self.tokens.popleft()
+        self.positions.append((offset, line))
+        self.words_taken += 1
+        return word
+
+    def release(self, word):
+        """
+        words are handed out in order whether or not they are still in play, so there is nothing to return
+        :param word: a word previously returned by take()
+        :return:
+        """
+
+    def position_of(self, word_number):
+        """
+        :param word_number: how many words have been drawn before the word, e.g. the engine's words_typed at the end of
+        a game for the first word that was not typed
+        :return: (offset, line) of the word, to save and seek() back to later
+        """
+        if word_number >= self.words_taken:
+            if self.tokens:
+                return self.tokens[0][1:]
+            return (self.offset, self.line) if self.offset < self.size else (0, 0)
+        return self.positions[max(0, word_number - (self.words_taken - len(self.positions)))]
+
+    def close(self):
+        """
+        unmaps the text file
+        :return:
+        """
+        self.text_map.close()
+
+
+class LineIndex:
+    """
+    offsets of line starts roughly every INDEX_BLOCK_BYTES through a text, with the number of each line
+    """
+    def __init__(self, offsets, line_numbers, index_map=None):
+        """
+        :param offsets: sequence of line start offsets
+        :param line_numbers: sequence of the number of the line at each offset
+        :param index_map: the mapped index file the sequences are views of, None if they are in memory
+        """
+        self.offsets = offsets
+        self.line_numbers = line_numbers
+        self.index_map = index_map
+
+    def line_start(self, text_map, line):
+        """
+        :param text_map: the mapped text the index was built from
+        :param line: line counting from 0
+        :return: (byte offset, line) of the start of the line, or of the last line if the text has fewer lines
+        """
+        entry = max(0, bisect_right(self.line_numbers, line) - 1)
+        offset, current = self.offsets[entry], self.line_numbers[entry]
+        while current < line:
+            newline = text_map.find(b"\n", offset)
+            if newline == -1 or newline + 1 >= len(text_map):
+                break
+            offset, current = newline + 1, current + 1
+        return offset, current
+
+    def close(self):
+        """
+        unmaps the index file, if the index was loaded from one
+        :return:
+        """
+        if self.index_map is not None:
+            self.offsets.release()  # the map can only be closed once no views of it are left
+            self.line_numbers.release()
+            self.index_map.close()
+
+
+class LineIndexBuilder:
+    """
+    builds the line index of a text file a block at a time, so a very large file can be indexed without freezing the
+    GUI. call index_blocks() repeatedly (e.g. from root.after) until it returns True
+    """
+    def __init__(self, file_name):
+        """
+        :param file_name: path of the text file, raises FileNotFoundError if it does not exist
+        """
+        self.file_name = file_name
+        self.text_map, self.size = map_text(file_name)
+        self.offsets = array("Q")
+        self.line_numbers = array("Q")
+        self.next_start = 0  # start of the next line to record
+        self.lines = 0  # number of that line
+        self.done = False
+
+    def index_blocks(self, max_blocks=INDEX_CHUNK_BLOCKS):
+        """
+        records the next max_blocks line starts, each the first line to start at least INDEX_BLOCK_BYTES after the last
+        :param max_blocks: number of line starts to record in this call
+        :return: True once the whole file has been indexed
+        """
+        for _ in range(max_blocks):
+            if self.done:
+                break
+            self.offsets.append(self.next_start)
+            self.line_numbers.append(self.lines)
+            newline = self.text_map.find(b"\n", self.next_start + INDEX_BLOCK_BYTES - 1)
+            if newline == -1 or newline + 1 >= self.size:
+                self.done = True
+                self.text_map.close()
+                break
+            self.lines += count_newlines(self.text_map, self.next_start, newline + 1)
+            self.next_start = newline + 1
+        return self.done
+
+    def index(self):
+        """
+        :return: LineIndex of the lines indexed so far
+        """
+        return LineIndex(self.offsets, self.line_numbers)
+
+
+def line_index_path(file_name):
+    """
+    :param file_name: path of a text file
+    :return: path of the line index file for it inside CACHE_DIR, next to its word list cache
+    """
+    return os.path.splitext(cache_path(file_name))[0] + ".lines"
+
+
+def read_line_index_header(index_file):
+    """
+    :param index_file: open binary line index file
+    :return: (source path, source size, source mtime_ns, number of indexed lines), or None if not a line index
+    """
+    header = index_file.read(INDEX_HEADER.size)
+    if len(header) != INDEX_HEADER.size:
+        return None
+    magic, version, size, mtime_ns, path_length, count = INDEX_HEADER.unpack(header)
+    if magic != INDEX_MAGIC or version != INDEX_VERSION:
+        return None
+    return index_file.read(path_length).decode("utf-8"), size, mtime_ns, count
+
+
+def load_line_index(file_name):
+    """
+    memory-maps the saved line index of a text file if there is one that matches the file's current size and
+    modification time
+    :param file_name: path of the text file
+    :return: LineIndex backed by the index file, or None if there is no up to date index
+    """
+    try:
+        source_stat = os.stat(file_name)
+        with open(line_index_path(file_name), "rb") as f:
+            header = read_line_index_header(f)
+            if header is None or header[0] != os.path.abspath(file_name) or \
+                    header[1:3] != (source_stat.st_size, source_stat.st_mtime_ns):
+                return None
+            count = header[3]
+            table_start = f.tell()
+            if os.fstat(f.fileno()).st_size != table_start + count * 16:  # cut short or padded
+                return None
+            index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # no index, or it could not be read
+        return None
+    tables = memoryview(index_map)[table_start:]
+    return LineIndex(tables[:count * 8].cast("Q"), tables[count * 8:].cast("Q"), index_map)
+
+
+def save_line_index(builder):
+    """
+    writes a finished line index to its file, replacing it atomically, then evicts line indexes that have gone stale.
+    the index is only an optimisation so failing to write it is ignored
+    :param builder: LineIndexBuilder that has indexed the whole file
+    :return:
+    """
+    try:
+        source_stat = os.stat(builder.file_name)
+        if source_stat.st_size != builder.size:  # changed while it was being indexed
+            return
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        source_path = os.path.abspath(builder.file_name).encode("utf-8")
+        target = line_index_path(builder.file_name)
+        with open(target + ".tmp", "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, source_stat.st_size, source_stat.st_mtime_ns,
+                                      len(source_path), len(builder.offsets)))
+            f.write(source_path)
+            f.write(builder.offsets.tobytes())
+            f.write(builder.line_numbers.tobytes())
+        os.replace(target + ".tmp", target)
+        evict_stale_caches(".lines", read_line_index_header)
+    except OSError:
+        pass
+
+
+def positions_path(name):
+    """
+    :param name: user name
+    :return: path of the file of the user's positions in the texts they have typed
+    """
+    return os.path.join(PASSAGE_DIR, quote(name, safe="") + ".json")
+
+
+def load_positions(name):
+    """
+    :param name: user name
+    :return: dict of absolute text file path -> {"offset", "line", "size"} of the user's position in it
+    """
+    try:
+        with open(positions_path(name)) as f:
+            positions = json.load(f)
+        return positions if isinstance(positions, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def resume_position(name, file_name):
+    """
+    :param name: user name
+    :param file_name: path of a text file
+    :return: (offset, line) the user got to in the text, the start of it if they have not typed it or it has changed
+    size since
+    """
+    try:
+        saved = load_positions(name)[os.path.abspath(file_name)]
+        if saved["size"] == os.path.getsize(file_name):
+            return saved["offset"], saved["line"]
+    except (OSError, KeyError, TypeError):
+        pass
+    return 0, 0
+
+
+def save_position(name, sampler, word_number):
+    """
+    saves where the user got to in a text, rewriting only that user's positions file
+    :param name: user name
+    :param sampler: PassageSampler of the game
+    :param word_number: how many of the sampler's words were typed
+    :return:
+    """
+    offset, line = sampler.position_of(word_number)
+    positions = load_positions(name)
+    positions[os.path.abspath(sampler.file_name)] = {"offset": offset, "line": line, "size": sampler.size}
+    os.makedirs(PASSAGE_DIR, exist_ok=True)
+    write_atomically(positions_path(name), json.dumps(positions))
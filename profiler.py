@@ -0,0 +1,188 @@
+"""
+Frame-time profiling for the typing game
+
+The frame scheduler marks the end of each phase of a frame (input, update, render) on a FrameProfiler, and anything
+that does file I/O on the Tk thread wraps it in measure_io(). The last PROFILE_WINDOW frames are kept in flat arrays,
+so profiling costs a few perf_counter() calls per frame. Counters such as pending after callbacks and live canvas items
+are sampled every SAMPLE_EVERY frames, and the input phase records how long each keystroke waited to be handled. The
+frames can be summarised (FPS, p99 frame time, p99 keystroke latency) for an overlay, or dumped to a trace file in the
+Chrome trace event format, which chrome://tracing and Perfetto can open.
+"""
+import json
+import time
+from array import array
+from contextlib import contextmanager
+from collections import Counter
+from analytics import percentile
+from scores import write_atomically
+
+PROFILE_WINDOW = 1800  # frames kept, about 30 seconds at 60 FPS
+SAMPLE_EVERY = 30  # frames between samples of the counters
+KEY_WINDOW = 1000  # keystrokes whose latency is kept
+PHASES = ("input", "update", "render", "io")
+
+
+class FrameProfiler:
+    """
+    timings of the most recent frames, kept in a ring of arrays
+    """
+    def __init__(self, counters=None, window=PROFILE_WINDOW, key_window=KEY_WINDOW):
+        """
+        :param counters: optional dict of name -> callable returning a number, sampled every SAMPLE_EVERY frames
+        :param window: number of frames kept
+        :param key_window: number of keystroke latencies kept
+        """
+        self.counters = counters or {}
+        self.window = window
+        self.starts = array("d", bytes(8 * window))  # perf_counter() at the start of each frame
+        self.phases = {phase: array("d", bytes(8 * window)) for phase in PHASES}  # seconds spent in each phase
+        self.steps = array("H", bytes(2 * window))  # simulation steps run in each frame
+        self.keys = array("H", bytes(2 * window))  # keystrokes handled in each frame
+        self.key_delays = array("d", bytes(8 * window))  # longest wait of a keystroke handled in each frame
+        self.key_window = key_window
+        self.key_latencies = array("d", bytes(8 * key_window))  # seconds each keystroke waited, in a ring
+        self.key_count = 0  # keystrokes recorded since the profiler was created
+        self.frame_count = 0  # frames recorded since the profiler was created
+        self.slot = 0  # ring index of the frame being recorded
+        self.last_mark = 0
+        self.pending_io = 0  # seconds of I/O since the last frame ended
+        self.samples = []  # (perf_counter() time, {counter: value}) for the frames in the window
+        self.redundant_configs = Counter()  # option name -> itemconfig calls that did not change it
+
+    def start_frame(self, current_time):
+        """
+        starts recording a frame
+        :param current_time: perf_counter() value the frame started at
+        :return:
+        """
+        self.slot = self.frame_count % self.window
+        self.starts[self.slot] = current_time
+        self.last_mark = current_time
+        self.keys[self.slot] = 0
+        self.key_delays[self.slot] = 0
+
+    def record_keys(self, latencies):
+        """
+        records the keystrokes handled in the current frame
+        :param latencies: seconds each keystroke waited between arriving and being handled
+        :return:
+        """
+        handled = 0
+        for latency in latencies:
+            self.key_latencies[self.key_count % self.key_window] = latency
+            self.key_count += 1
+            handled += 1
+            if latency > self.key_delays[self.slot]:
+                self.key_delays[self.slot] = latency
+        self.keys[self.slot] = min(self.keys[self.slot] + handled, 0xFFFF)
+
+    def mark(self, phase):
+        """
+        records the time since the last mark as the given phase of the current frame
+        :param phase: one of PHASES
+        :return:
+        """
+        current_time = time.perf_counter()
+        self.phases[phase][self.slot] = current_time - self.last_mark
+        self.last_mark = current_time
+
+    def end_frame(self, steps):
+        """
+        finishes recording the current frame, sampling the counters if it is time to
+        :param steps: simulation steps run in the frame
+        :return:
+        """
+        self.phases["io"][self.slot] = self.pending_io
+        self.pending_io = 0
+        self.steps[self.slot] = min(steps, 0xFFFF)
+        self.frame_count += 1
+        if self.frame_count % SAMPLE_EVERY == 0:
+            self.samples.append((self.starts[self.slot], {name: counter() for name, counter in self.counters.items()}))
+            del self.samples[:-(self.window // SAMPLE_EVERY)]
+
+    @contextmanager
+    def measure_io(self):
+        """
+        context manager timing file I/O done on the Tk thread, counted towards the frame that ends next
+        :return:
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.pending_io += time.perf_counter() - start_time
+
+    def frames(self):
+        """
+        :return: ring indexes of the recorded frames still in the window, oldest first
+        """
+        count = min(self.frame_count, self.window)
+        return [(self.frame_count - count + offset) % self.window for offset in range(count)]
+
+    def summary(self):
+        """
+        works out the frame rate and frame times over the window. frame time is the interval between frames starting,
+        which includes the time Tk spends outside the scheduler
+        :return: dict of fps, p50 and p99 frame time in ms, mean ms of each phase, p50 and p99 keystroke latency in ms
+        over the last key_window keystrokes and the last counter sample
+        """
+        latencies = sorted(self.key_latencies[:min(self.key_count, self.key_window)])
+        key_latency = {"key_p50": percentile(latencies, 0.5) * 1000 if latencies else 0,
+                       "key_p99": percentile(latencies, 0.99) * 1000 if latencies else 0}
+        slots = self.frames()
+        if len(slots) < 2:
+            return {"fps": 0, "p50": 0, "p99": 0, "phases": {phase: 0 for phase in PHASES}, **key_latency,
+                    "counters": self.samples[-1][1] if self.samples else {}}
+        intervals = sorted(self.starts[b] - self.starts[a] for a, b in zip(slots, slots[1:]))
+        elapsed = self.starts[slots[-1]] - self.starts[slots[0]]
+        return {"fps": (len(slots) - 1) / elapsed if elapsed > 0 else 0,
+                "p50": percentile(intervals, 0.5) * 1000,
+                "p99": percentile(intervals, 0.99) * 1000,
+                "phases": {phase: sum(self.phases[phase][slot] for slot in slots) / len(slots) * 1000
+                           for phase in PHASES},
+                **key_latency,
+                "counters": self.samples[-1][1] if self.samples else {}}
+
+    def dump_trace(self, file_name):
+        """
+        writes the frames in the window to a Chrome trace event file: one complete event per phase of every frame,
+        with the keystrokes the frame handled and the longest any of them waited in its args, a counter event per
+        sample, and the redundant itemconfig counts in the metadata
+        :param file_name: path of the trace file
+        :return:
+        """
+        slots = self.frames()
+        origin = self.starts[slots[0]] if slots else 0
+        events = []
+        for slot in slots:
+            timestamp = (self.starts[slot] - origin) * 1e6  # microseconds
+            for phase in PHASES:
+                duration = self.phases[phase][slot] * 1e6
+                events.append({"name": phase, "ph": "X", "ts": timestamp, "dur": duration, "pid": 0, "tid": 0,
+                               "args": {"steps": self.steps[slot], "keys": self.keys[slot],
+                                        "key_latency_ms": self.key_delays[slot] * 1000}})
+                timestamp += duration
+        for sample_time, values in self.samples:
+            if sample_time >= origin:
+                events.append({"name": "counters", "ph": "C", "ts": (sample_time - origin) * 1e6, "pid": 0,
+                               "args": values})
+        write_atomically(file_name, json.dumps({"traceEvents": events,
+                                                "otherData": {"redundant_itemconfig": dict(self.redundant_configs)}}))
+
+
+def audit_itemconfig(canvas, profiler):
+    """
+    makes the canvas count itemconfig calls that set an option to the value it already has, so redundant Tcl calls
+    can be found. every call then costs an extra itemcget per option, so this is only for profiling
+    :param canvas: Canvas to audit
+    :param profiler: FrameProfiler whose redundant_configs counter is updated
+    :return:
+    """
+    itemconfig = canvas.itemconfig
+
+    def audited_itemconfig(item, cnf=None, **options):
+        for option, value in options.items():
+            if isinstance(value, (str, int, float)) and canvas.itemcget(item, option) == str(value):
+                profiler.redundant_configs[option] += 1
+        return itemconfig(item, cnf, **options)
+    canvas.itemconfig = canvas.itemconfigure = audited_itemconfig
@@ -0,0 +1,492 @@
+"""
+Multiplayer races for the typing game
+
+A RaceServer runs on asyncio and can serve hundreds of racers from one process on localhost or a LAN. A race starts
+COUNTDOWN seconds after a racer joins: every connected racer is sent the same words, drawn from the server's word list
+with a seeded random number generator, and each plays them as an ordinary game whose words come from that list in
+order. Clients send the keystrokes their engine accepted in batches, and the server checks them against the race words
+the same way GameEngine.feed_key() does, so the standings it pushes out are based on what it validated itself, not on
+what clients claim.
+
+Messages are single lines of JSON. Lines from clients are capped at MAX_MESSAGE_BYTES by the stream reader, and
+standings (which are replaced by the next ones anyway) are skipped for a client whose unsent data has passed
+MAX_BUFFERED_BYTES, so a slow or stuck client cannot make the server buffer without bound.
+
+RaceClient is the Tk side: a non-blocking socket that the frame scheduler polls once per frame, so the network never
+blocks a frame and no thread is needed.
+
+usage: python race.py serve [--host HOST] [--port PORT] [--words FILE]
+       python race.py loadtest [--racers N] [--wpm WPM]
+"""
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tracemalloc
+from wordlist import WordListLoader
+
+RACE_PORT = 8765
+RACE_WORDS = 30  # words a racer has to type to finish
+RACE_STREAM_WORDS = 40  # words sent for a race, more than RACE_WORDS as a client's engine spawns words ahead
+COUNTDOWN = 5  # seconds between a racer joining and the race starting, so others can join
+RACE_TIME_LIMIT = 180  # seconds a race can last
+STANDINGS_INTERVAL = 0.25  # seconds between standings updates
+STANDINGS_SIZE = 10  # racers listed in a standings message
+MAX_MESSAGE_BYTES = 4096  # longest line accepted from a client
+MAX_KEYS_PER_MESSAGE = 256  # keystrokes accepted in one keys message
+MAX_BUFFERED_BYTES = 64 * 1024  # unsent bytes to a client past which standings are skipped for it
+MAX_RACER_NAME_LENGTH = 15
+CONNECT_TIMEOUT = 3  # seconds RaceClient waits to connect
+RECEIVE_SIZE = 65536  # bytes RaceClient reads from its socket at a time
+LOAD_TEST_KEY_INTERVAL = 0.1  # seconds between the keys messages of a fake client
+LOAD_TEST_ERROR_RATE = 0.02  # chance of a fake client mistyping a key
+
+
+def encode(message):
+    """
+    :param message: dict to send
+    :return: the message as a line of JSON
+    """
+    return (json.dumps(message, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def decode(line):
+    """
+    :param line: a line of JSON
+    :return: the message dict, raises ValueError if the line is not a JSON object
+    """
+    message = json.loads(line)
+    if not isinstance(message, dict):
+        raise ValueError("a message must be a JSON object")
+    return message
+
+
+class RaceTracker:
+    """
+    a racer's progress through the race words, checked one keystroke at a time like GameEngine.feed_key()
+    """
+    def __init__(self, words, race_words):
+        self.words = words
+        self.race_words = race_words
+        self.words_typed = 0
+        self.letter_num = 0
+        self.correct = 0
+        self.errors = 0
+        self.finish_time = None  # time the racer finished or dropped out, None while they are still racing
+
+    def feed(self, characters):
+        """
+        checks keystrokes against the race words
+        :param characters: the keystrokes, in the order they were typed
+        :return: True once the racer has typed every race word
+        """
+        for character in characters:
+            if self.words_typed >= self.race_words:
+                break
+            word = self.words[self.words_typed % len(self.words)]
+            if character == word[self.letter_num]:
+                self.correct += 1
+                self.letter_num += 1
+                if self.letter_num == len(word):
+                    self.words_typed += 1
+                    self.letter_num = 0
+            else:
+                self.errors += 1
+        return self.words_typed >= self.race_words
+
+
+class Racer:
+    """
+    a connected client
+    """
+    def __init__(self, name, writer):
+        self.name = name
+        self.writer = writer
+        self.tracker = None  # RaceTracker while the racer is in a race
+
+
+class RaceServer:
+    """
+    accepts racers and runs races between everyone connected, one race at a time
+    """
+    def __init__(self, words, race_words=RACE_WORDS, countdown=COUNTDOWN, time_limit=RACE_TIME_LIMIT, seed=None):
+        """
+        :param words: list of words races are drawn from, at least RACE_STREAM_WORDS of them
+        :param race_words: words a racer has to type to finish
+        :param countdown: seconds between a racer joining and the race starting
+        :param time_limit: seconds a race can last
+        :param seed: optional seed for choosing race words
+        """
+        if len(words) < RACE_STREAM_WORDS:
+            raise ValueError("a race server needs at least {} words".format(RACE_STREAM_WORDS))
+        self.words = words
+        self.race_words = race_words
+        self.countdown = countdown
+        self.time_limit = time_limit
+        self.rng = random.Random(seed)
+        self.racers = set()
+        self.connections = set()  # handle() tasks of open connections
+        self.racer_joined = asyncio.Event()
+        self.entrants = []  # racers in the current race
+        self.race_start = 0
+        self.standings_changed = False
+        self.server = None
+        self.race_task = None
+        self.races_run = 0
+        self.keys_validated = 0
+
+    async def start(self, host="localhost", port=RACE_PORT, run_races=True):
+        """
+        starts accepting racers
+        :param host: address to listen on, "0.0.0.0" for the whole LAN
+        :param port: port to listen on, 0 for any free port
+        :param run_races: whether to start running races, False to call start_races() later
+        :return: the port being listened on
+        """
+        self.server = await asyncio.start_server(self.handle, host, port, limit=MAX_MESSAGE_BYTES)
+        if run_races:
+            self.start_races()
+        return self.server.sockets[0].getsockname()[1]
+
+    def start_races(self):
+        self.race_task = asyncio.create_task(self.run_races())
+
+    async def close(self):
+        if self.race_task is not None:
+            self.race_task.cancel()
+        self.server.close()
+        for racer in list(self.racers):
+            racer.writer.close()
+        await asyncio.gather(*self.connections)  # closing a writer ends its connection's handle()
+        await self.server.wait_closed()
+
+    def send(self, racer, data, droppable=False):
+        """
+        queues data for a racer without waiting for it to be sent
+        :param racer: Racer to send to
+        :param data: encoded message
+        :param droppable: whether the message may be skipped if the racer is not keeping up
+        :return:
+        """
+        if droppable and racer.writer.transport.get_write_buffer_size() > MAX_BUFFERED_BYTES:
+            return
+        racer.writer.write(data)
+
+    async def handle(self, reader, writer):
+        """
+        serves one connection: a join message, then keys and done messages until the client disconnects
+        :return:
+        """
+        racer = None
+        connection = asyncio.current_task()
+        self.connections.add(connection)
+        try:
+            message = decode(await reader.readline())
+            name = str(message.get("name", ""))[:MAX_RACER_NAME_LENGTH]
+            if message.get("type") != "join" or not name:
+                return
+            racer = Racer(name, writer)
+            self.racers.add(racer)
+            self.send(racer, encode({"type": "welcome", "racers": len(self.racers)}))
+            self.racer_joined.set()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = decode(line)
+                if message.get("type") == "keys":
+                    self.receive_keys(racer, message.get("keys"))
+                elif message.get("type") == "done" and racer.tracker is not None:
+                    self.finish(racer)
+        except (ValueError, ConnectionError):  # a malformed or too long line, or the client went away
+            pass
+        finally:
+            if racer is not None:
+                self.racers.discard(racer)
+                if racer.tracker is not None:
+                    self.finish(racer)
+            writer.close()
+            self.connections.discard(connection)
+
+    def receive_keys(self, racer, keys):
+        """
+        validates a batch of a racer's keystrokes
+        :param racer: Racer that sent them
+        :param keys: string of keystrokes
+        :return:
+        """
+        if racer.tracker is None or racer.tracker.finish_time is not None:
+            return
+        if not isinstance(keys, str) or len(keys) > MAX_KEYS_PER_MESSAGE:
+            raise ValueError("invalid keys message")
+        self.keys_validated += len(keys)
+        if racer.tracker.feed(keys):
+            self.finish(racer)
+        self.standings_changed = True
+
+    def finish(self, racer):
+        """
+        marks a racer as finished, or as out of the race if they have not typed every word
+        :return:
+        """
+        if racer.tracker.finish_time is None:
+            racer.tracker.finish_time = time.perf_counter()
+            self.standings_changed = True
+
+    def standings(self):
+        """
+        :return: [name, words typed, wpm, finished] of the racers in the current race, best first
+        """
+        current_time = time.perf_counter()
+        ranked = sorted(self.entrants, key=lambda racer: (-racer.tracker.words_typed, -racer.tracker.correct,
+                                                          racer.tracker.finish_time or current_time))
+        standings = []
+        for racer in ranked:
+            tracker = racer.tracker
+            minutes = ((tracker.finish_time or current_time) - self.race_start) / 60
+            standings.append([racer.name, tracker.words_typed, int(round(tracker.words_typed / minutes)) if minutes
+                              else 0, tracker.words_typed >= self.race_words])
+        return standings
+
+    async def run_races(self):
+        """
+        runs a race COUNTDOWN seconds after a racer joins, for as long as the server is up
+        :return:
+        """
+        while True:
+            await self.racer_joined.wait()
+            await asyncio.sleep(self.countdown)
+            self.racer_joined.clear()
+            if self.racers:
+                await self.run_race()
+            if self.racers:  # everyone still connected goes again
+                self.racer_joined.set()
+
+    async def run_race(self):
+        """
+        sends every connected racer the race words, pushes standings while the race runs and the results at the end.
+        the race ends when every racer has finished or dropped out, or after the time limit
+        :return:
+        """
+        words = self.rng.sample(self.words, RACE_STREAM_WORDS)
+        self.entrants = list(self.racers)
+        start_message = encode({"type": "race", "words": words, "race_words": self.race_words})
+        for racer in self.entrants:
+            racer.tracker = RaceTracker(words, self.race_words)
+            self.send(racer, start_message)
+        self.race_start = time.perf_counter()
+        while time.perf_counter() - self.race_start < self.time_limit:
+            await asyncio.sleep(STANDINGS_INTERVAL)
+            if all(racer.tracker.finish_time is not None for racer in self.entrants):
+                break
+            if self.standings_changed:
+                self.standings_changed = False
+                standings_message = encode({"type": "standings", "racers": len(self.entrants),
+                                            "standings": self.standings()[:STANDINGS_SIZE]})
+                for racer in self.entrants:
+                    if racer in self.racers:
+                        self.send(racer, standings_message, droppable=True)
+        result_message = encode({"type": "result", "racers": len(self.entrants),
+                                 "standings": self.standings()[:STANDINGS_SIZE]})
+        for racer in self.entrants:
+            if racer in self.racers:
+                self.send(racer, result_message)
+            racer.tracker = None
+        self.entrants = []
+        self.races_run += 1
+
+
+class RaceClient:
+    """
+    the game's connection to a race server. the socket is non-blocking: send() queues messages and poll(), called once
+    per frame, sends what it can and returns the messages that have arrived without ever waiting
+    """
+    def __init__(self, host, port, name):
+        """
+        connects to a race server and joins, raises OSError if it cannot connect
+        :param host: address of the server
+        :param port: port of the server
+        :param name: user name to race as
+        """
+        self.socket = socket.create_connection((host, port), CONNECT_TIMEOUT)
+        self.socket.setblocking(False)
+        self.received = bytearray()
+        self.outgoing = bytearray()
+        self.closed = False
+        self.send({"type": "join", "name": name})
+
+    def send(self, message):
+        """
+        queues a message, sending as much of it as the socket takes straight away
+        :param message: dict to send
+        :return:
+        """
+        self.outgoing += encode(message)
+        self.flush()
+
+    def send_keys(self, keys):
+        """
+        queues keystrokes the engine accepted, split into messages of at most MAX_KEYS_PER_MESSAGE keys
+        :param keys: string of keystrokes
+        :return:
+        """
+        for start in range(0, len(keys), MAX_KEYS_PER_MESSAGE):
+            self.outgoing += encode({"type": "keys", "keys": keys[start:start + MAX_KEYS_PER_MESSAGE]})
+        self.flush()
+
+    def flush(self):
+        """
+        sends as much of the queued data as the socket will take without blocking
+        :return:
+        """
+        try:
+            while self.outgoing:
+                sent = self.socket.send(self.outgoing)
+                del self.outgoing[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.closed = True
+
+    def poll(self):
+        """
+        sends queued data and reads whatever has arrived
+        :return: list of the complete messages received since the last poll
+        """
+        self.flush()
+        while not self.closed:
+            try:
+                chunk = self.socket.recv(RECEIVE_SIZE)
+            except BlockingIOError:
+                break
+            except OSError:
+                chunk = b""
+            if not chunk:  # the server closed the connection
+                self.closed = True
+                break
+            self.received += chunk
+        *lines, rest = self.received.split(b"\n")
+        self.received = bytearray(rest)
+        messages = []
+        for line in lines:
+            try:
+                messages.append(decode(line))
+            except ValueError:
+                pass
+        return messages
+
+    def close(self):
+        self.closed = True
+        self.socket.close()
+
+
+async def join_race(host, port, name):
+    """
+    connects a fake client for load testing
+    :return: (reader, writer) once the server has welcomed it
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode({"type": "join", "name": name}))
+    await reader.readline()
+    return reader, writer
+
+
+async def fake_racer(reader, writer, wpm, rng):
+    """
+    a client for load testing that types the race words at a set speed, sending its keys in batches
+    :return: (standings messages received, the result message)
+    """
+    standings_received = 0
+    while True:
+        message = decode(await reader.readline())
+        if message["type"] == "race":
+            break
+    keys = []
+    for word in message["words"][:message["race_words"]]:
+        for character in word:
+            if rng.random() < LOAD_TEST_ERROR_RATE:
+                keys.append("#")
+            keys.append(character)
+    keys_per_batch = max(1, int(wpm * 5 / 60 * LOAD_TEST_KEY_INTERVAL))
+
+    async def type_keys():
+        for start in range(0, len(keys), keys_per_batch):
+            await asyncio.sleep(LOAD_TEST_KEY_INTERVAL)
+            writer.write(encode({"type": "keys", "keys": "".join(keys[start:start + keys_per_batch])}))
+    typing = asyncio.create_task(type_keys())
+    while True:
+        message = decode(await reader.readline())
+        if message["type"] == "standings":
+            standings_received += 1
+        elif message["type"] == "result":
+            break
+    typing.cancel()
+    writer.close()
+    return standings_received, message
+
+
+async def load_test(racers, wpm):
+    """
+    runs one race on an in-process server between fake clients and prints how the server coped
+    :param racers: number of fake clients
+    :param wpm: typing speed of the fake clients
+    :return:
+    """
+    words = ["word{}".format(index) for index in range(1000)]
+    server = RaceServer(words, countdown=0, seed=1)
+    port = await server.start("127.0.0.1", 0, run_races=False)
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    connections = await asyncio.gather(*(join_race("127.0.0.1", port, "bot{}".format(index))
+                                         for index in range(racers)))
+    print("{} racers joined in {:.2f} s".format(racers, time.perf_counter() - start_time))
+    server.start_races()  # once everyone has joined, so they are all in the same race
+    start_time = time.perf_counter()
+    results = await asyncio.gather(*(fake_racer(reader, writer, wpm, random.Random(index))
+                                     for index, (reader, writer) in enumerate(connections)))
+    elapsed = time.perf_counter() - start_time
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    await server.close()
+    standings_counts = sorted(standings for standings, _ in results)
+    result = results[0][1]
+    print("{} racers finished a race in {:.2f} s".format(result["racers"], elapsed))
+    print("keys validated: {} ({:.0f} per second)".format(server.keys_validated, server.keys_validated / elapsed))
+    print("standings messages per racer: min {} max {}".format(standings_counts[0], standings_counts[-1]))
+    print("peak traced memory: {:.1f} MB ({:.1f} KB per racer, client and server)".format(
+        peak_memory / 1e6, peak_memory / 1e3 / racers))
+    print("winner: {}".format(result["standings"][0]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="typing game race server")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run a race server")
+    serve_parser.add_argument("--host", default="localhost", help='address to listen on, "0.0.0.0" for the LAN')
+    serve_parser.add_argument("--port", type=int, default=RACE_PORT)
+    serve_parser.add_argument("--words", default="defaulttext.txt", help="word list file races are drawn from")
+    load_parser = commands.add_parser("loadtest", help="race fake clients against an in-process server")
+    load_parser.add_argument("--racers", type=int, default=300)
+    load_parser.add_argument("--wpm", type=int, default=600)
+    args = parser.parse_args()
+
+    if args.command == "loadtest":
+        asyncio.run(load_test(args.racers, args.wpm))
+        return
+
+    async def serve():
+        server = RaceServer(WordListLoader(args.words, {}).load_all().words)
+        port = await server.start(args.host, args.port)
+        print("race server listening on {}:{}".format(args.host, port))
+        await server.server.serve_forever()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
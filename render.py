@@ -0,0 +1,83 @@
+"""
+Retained-mode rendering for the typing game's canvas
+
+Rather than pushing every change straight to Tk, the frontend tells a RetainedCanvas what each item should look like.
+The canvas remembers the options and coordinates it last sent for every item and flush() only sends the ones that
+differ, once per frame. Moves are sent together as a single Tcl script and each item whose options changed costs one
+itemconfigure call, so the Tcl round trips in a frame scale with what actually changed rather than with what was drawn.
+"""
+
+
+class RetainedCanvas:
+    """
+    caches the last sent options and coordinates of canvas items and sends only the differences on flush()
+    """
+    def __init__(self, canvas):
+        """
+        :param canvas: Canvas the items are on
+        """
+        self.canvas = canvas
+        self.path = str(canvas)  # Tcl name of the canvas widget
+        self.options = {}  # item -> {option: value} last sent
+        self.positions = {}  # item -> coordinates last sent, rounded to whole pixels
+        self.changed_options = {}  # item -> {option: value} to send on the next flush
+        self.changed_positions = {}  # item -> coordinates to send on the next flush
+
+    def track(self, item, coords, **options):
+        """
+        starts caching an item that has just been created with the given coordinates and options
+        :param item: canvas item
+        :param coords: coordinates it was created at
+        :param options: options it was created with
+        :return:
+        """
+        self.positions[item] = tuple(round(coordinate) for coordinate in coords)
+        self.options[item] = options
+
+    def configure(self, item, **options):
+        """
+        sets options of an item (e.g. text, fill, state), sent on the next flush if they differ from what was sent
+        :param item: canvas item
+        :param options: option values
+        :return:
+        """
+        sent_options = self.options.setdefault(item, {})
+        for option, value in options.items():
+            if sent_options.get(option) != value:
+                self.changed_options.setdefault(item, {})[option] = value
+            else:  # set back to what is shown before the flush
+                self.changed_options.get(item, {}).pop(option, None)
+
+    def move_to(self, item, *coords):
+        """
+        sets an item's coordinates, sent on the next flush if they differ from what was sent once rounded to whole
+        pixels, which is as precisely as Tk draws text
+        :param item: canvas item
+        :param coords: new coordinates
+        :return:
+        """
+        position = tuple(round(coordinate) for coordinate in coords)
+        if self.positions.get(item) != position:
+            self.changed_positions[item] = position
+        else:
+            self.changed_positions.pop(item, None)
+
+    def flush(self):
+        """
+        sends every change made since the last flush to Tk
+        :return: number of Tcl calls made
+        """
+        calls = 0
+        if self.changed_positions:
+            self.canvas.tk.eval("\n".join("{} coords {} {}".format(self.path, item, " ".join(map(str, position)))
+                                          for item, position in self.changed_positions.items()))
+            self.positions.update(self.changed_positions)
+            self.changed_positions.clear()
+            calls += 1
+        for item, options in self.changed_options.items():
+            if options:
+                self.canvas.itemconfigure(item, **options)
+                self.options[item].update(options)
+                calls += 1
+        self.changed_options.clear()
+        return calls
@@ -0,0 +1,260 @@
+"""
+Session recording and replay for the typing game
+
+A game is fully determined by the engine's seed, the difficulty, the font size, the word list, the word widths the
+frontend measured, the player's weakness model (for adaptive games) and which simulation step each keystroke was fed
+on. A SessionRecorder captures all of that while a game is played and saves it in a compact binary file: a fixed
+header followed by a zlib compressed body of column arrays. The word list itself is not stored, only a hash of it, so
+a replay must be played against the same list.
+
+A replay can be fast-forwarded headless, which is how a submitted score can be checked far faster than real time, or
+played back in real time in the GUI with a ReplayPlayer registered with the frame scheduler in place of the keyboard.
+"""
+import json
+import zlib
+import struct
+from array import array
+from engine import GameEngine, DIFFICULTY_DICT
+from adaptive import WeaknessModel
+from scores import write_atomically
+
+REPLAY_MAGIC = b"TWRP"
+REPLAY_VERSION = 2  # replays of earlier versions spawn words where the engine no longer would
+# magic, version, seed, font size, difficulty length, model length, width count, keystroke count, word list hash
+REPLAY_HEADER = struct.Struct("<4sIQHBIII32s")
+MAX_TRAILING_STEPS = 100000  # steps a replay may run after its last keystroke before it is considered broken
+
+
+class ReplayError(ValueError):
+    """
+    raised when a replay file is invalid or does not match the word list or engine it is played with
+    """
+
+
+def is_number(value, allow_none=False):
+    """
+    :return: whether a value decoded from JSON is an int or float (not a bool), or None if allow_none is set
+    """
+    if value is None:
+        return allow_none
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def valid_model(model):
+    """
+    checks a weakness model decoded from a replay has the shape of adaptive.WeaknessModel.to_dict(), so a tampered
+    replay can not make the engine raise anything other than ReplayError
+    :param model: the decoded model
+    :return: True if a WeaknessModel can be built from it
+    """
+    if not isinstance(model, dict) or set(model) != {"letters", "bigrams", "mean_latency"} or \
+            not is_number(model["mean_latency"], allow_none=True):
+        return False
+    for key_stats in (model["letters"], model["bigrams"]):
+        if not isinstance(key_stats, dict):
+            return False
+        for stats in key_stats.values():
+            if not isinstance(stats, list) or len(stats) != 3 or not is_number(stats[0]) or \
+                    not is_number(stats[1]) or not is_number(stats[2], allow_none=True):
+                return False
+    return True
+
+
+class Session:
+    """
+    everything needed to replay a game
+    """
+    def __init__(self, seed, difficulty, font_size, words_digest, model=None, widths=None, steps=None, characters=None,
+                 times=None):
+        """
+        :param seed: seed of the engine's random number generator
+        :param difficulty: key into DIFFICULTY_DICT
+        :param font_size: font size the game was played at
+        :param words_digest: WordIndex.digest() of the word list
+        :param model: dict of the adaptive.WeaknessModel the game was played with, None if it was not adaptive
+        :param widths: array("f") of every width the frontend measured, in the order they were measured
+        :param steps: array("I") of the simulation step each keystroke was fed on
+        :param characters: array("I") of the code point of each keystroke
+        :param times: array("f") of the seconds since the start of the game each keystroke was typed at
+        """
+        self.seed = seed
+        self.difficulty = difficulty
+        self.font_size = font_size
+        self.words_digest = words_digest
+        self.model = model
+        self.widths = widths if widths is not None else array("f")
+        self.steps = steps if steps is not None else array("I")
+        self.characters = characters if characters is not None else array("I")
+        self.times = times if times is not None else array("f")
+
+    def to_bytes(self):
+        """
+        :return: the session in the replay file format
+        """
+        difficulty = self.difficulty.encode("utf-8")
+        model = json.dumps(self.model).encode("utf-8") if self.model is not None else b""
+        header = REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, self.seed, self.font_size, len(difficulty),
+                                    len(model), len(self.widths), len(self.steps), self.words_digest)
+        body = b"".join((difficulty, model, self.widths.tobytes(), self.steps.tobytes(), self.characters.tobytes(),
+                         self.times.tobytes()))
+        return header + zlib.compress(body)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        :param data: a session in the replay file format
+        :return: Session, raises ReplayError if the data is not a valid replay
+        """
+        if len(data) < REPLAY_HEADER.size:
+            raise ReplayError("replay is too short")
+        magic, version, seed, font_size, difficulty_length, model_length, width_count, key_count, words_digest = \
+            REPLAY_HEADER.unpack_from(data)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ReplayError("not a replay, or a replay from another version of the game")
+        try:
+            body = zlib.decompress(data[REPLAY_HEADER.size:])
+        except zlib.error as error:
+            raise ReplayError("replay is corrupt: {}".format(error))
+        columns = []
+        offset = difficulty_length + model_length
+        for type_code, count in (("f", width_count), ("I", key_count), ("I", key_count), ("f", key_count)):
+            column = array(type_code)
+            column.frombytes(body[offset:offset + column.itemsize * count])
+            if len(column) != count:
+                raise ReplayError("replay is truncated")
+            columns.append(column)
+            offset += column.itemsize * count
+        try:
+            difficulty = body[:difficulty_length].decode("utf-8")
+            model = json.loads(body[difficulty_length:difficulty_length + model_length]) if model_length else None
+        except ValueError as error:
+            raise ReplayError("replay is corrupt: {}".format(error))
+        if difficulty not in DIFFICULTY_DICT:
+            raise ReplayError("replay has an unknown difficulty {!r}".format(difficulty))
+        if model is not None and not valid_model(model):
+            raise ReplayError("replay has an invalid weakness model")
+        return cls(seed, difficulty, font_size, words_digest, model, *columns)
+
+
+def save_session(file_name, session):
+    """
+    :param file_name: path to save the replay to, replaced atomically
+    :param session: Session to save
+    :return:
+    """
+    write_atomically(file_name, session.to_bytes())
+
+
+def load_session(file_name):
+    """
+    :param file_name: path of a replay file
+    :return: Session, raises ReplayError if the file is not a valid replay
+    """
+    with open(file_name, "rb") as f:
+        return Session.from_bytes(f.read())
+
+
+class SessionRecorder:
+    """
+    records a game as it is played. create it before the engine is started, as it wraps the engine's measure function
+    to log the widths of the words spawned, then pass every keystroke through feed_key() instead of the engine's and
+    call finish() once the game is over
+    """
+    def __init__(self, engine, weakness_model=None, start_time=0):
+        """
+        :param engine: GameEngine of the game, not yet started
+        :param weakness_model: adaptive.WeaknessModel the engine was created with, None if it was not
+        :param start_time: time the game started at, keystroke times are saved relative to it
+        """
+        self.engine = engine
+        self.start_time = start_time
+        # the model is copied, as the frontend goes on to update it with this game's keystrokes
+        self.session = Session(engine.seed, engine.difficulty, engine.font_size, None,
+                               json.loads(json.dumps(weakness_model.to_dict())) if weakness_model is not None else None)
+        measure = engine.measure
+
+        def recorded_measure(text):
+            width = measure(text)
+            self.session.widths.append(width)
+            return self.session.widths[-1]  # rounded to a float like it will be on replay
+        engine.measure = recorded_measure
+
+    def feed_key(self, typed_char, timestamp):
+        """
+        records a keystroke with the simulation step it is fed on, then feeds it to the engine
+        :param typed_char: the character the user typed
+        :param timestamp: when it was typed, in the same clock as start_time
+        :return: the engine's result for the keystroke
+        """
+        self.session.steps.append(self.engine.steps)
+        self.session.characters.append(ord(typed_char))
+        self.session.times.append(timestamp - self.start_time)
+        return self.engine.feed_key(typed_char, self.session.times[-1])
+
+    def finish(self):
+        """
+        :return: the recorded Session. the word list is hashed here rather than when the game starts, as hashing a
+        large list takes a moment
+        """
+        self.session.words_digest = self.engine.word_index.digest()
+        return self.session
+
+
+class ReplayPlayer:
+    """
+    plays a session back through a new engine, feeding each keystroke on the step it was recorded on
+    register step() with the frame scheduler as the engine's update callable to watch it in real time, or call
+    fast_forward() to play it to the end at full speed
+    """
+    def __init__(self, session, word_index):
+        """
+        :param session: Session to play
+        :param word_index: WordIndex the session was played with, raises ReplayError if it is a different list
+        """
+        if word_index.digest() != session.words_digest:
+            raise ReplayError("the replay was recorded with a different word list")
+        self.session = session
+        self.next_key = 0
+        self.next_width = 0
+        model = session.model
+        self.engine = GameEngine(word_index, session.difficulty, session.font_size, measure=self.recorded_width,
+                                 seed=session.seed,
+                                 weakness_model=WeaknessModel(model["letters"], model["bigrams"], model["mean_latency"])
+                                 if model is not None else None)
+
+    def recorded_width(self, text):
+        """
+        stands in for the frontend's measure function, returning the widths in the order they were recorded
+        :param text: the word being measured, unused
+        :return: its recorded width
+        """
+        if self.next_width >= len(self.session.widths):
+            raise ReplayError("the replay spawned more words than were recorded")
+        self.next_width += 1
+        return self.session.widths[self.next_width - 1]
+
+    def step(self):
+        """
+        feeds the keystrokes recorded on the engine's current step, then steps it
+        :return: False once the game is over
+        """
+        session = self.session
+        while self.next_key < len(session.steps) and session.steps[self.next_key] <= self.engine.steps:
+            self.engine.feed_key(chr(session.characters[self.next_key]), session.times[self.next_key])
+            self.next_key += 1
+        return self.engine.step()
+
+    def fast_forward(self):
+        """
+        plays the rest of the session headless, as fast as possible
+        :return: the engine once its game is over
+        """
+        if not self.engine.in_game and not self.engine.game_over:
+            self.engine.start()
+        last_step = self.session.steps[-1] if len(self.session.steps) else 0
+        while self.step():
+            self.engine.drain_events()  # nothing draws them, but draining returns destroyed words to the pool
+            if self.engine.steps > last_step + MAX_TRAILING_STEPS:
+                raise ReplayError("the replay did not end within {} steps of its last keystroke".format(
+                    MAX_TRAILING_STEPS))
+        return self.engine
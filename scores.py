@@ -0,0 +1,712 @@
+"""
+Score persistence for the typing game
+
+Scores are loaded into memory once at startup. Each finished game is appended to a log file by a background writer
+thread, so saving a score never blocks the GUI. Every so often the writer compacts the log into the score file, which
+is written to a temporary file, fsynced and renamed over the old one so a crash can never leave it half written.
+
+Compaction keeps only the top scores in the score file, and moves every game in the log (with its accuracy, length,
+date and keystroke statistics) to its user's history file, which is only ever appended to.
+
+In memory, every user's top wpm is kept in sorted leaderboards (one overall and one per difficulty), so the score
+screen can list the top scores and look up a user's rank without touching the disk.
+
+SqliteScoreStore is an optional drop-in replacement that keeps every game in an SQLite database instead, so several
+copies of the game on one machine can share a leaderboard and the full game history can be queried.
+"""
+import os
+import json
+import time
+import queue
+import sqlite3
+import threading
+from bisect import bisect_left, insort
+from urllib.parse import quote
+
+COMPACT_EVERY = 50  # games appended to the log before it is compacted into the score file
+SQLITE_BATCH_SIZE = 500  # most queued games the SQLite writer inserts in one transaction
+SQLITE_BUSY_TIMEOUT = 5  # seconds to wait for another game instance holding the database lock
+SECONDS_PER_WEEK = 7 * 24 * 60 * 60
+HISTORY_DIR_NAME = "score_history"  # folder next to the score file that each user's games are kept in
+HISTORY_TAIL_BYTES = 4096  # bytes read at a time from the end of a history file to find its last game
+WRITE_RETRIES = 3  # attempts the writer threads make at saving the games left when the store is closed
+WRITE_RETRY_DELAY = 0.5  # seconds between those attempts
+LEADERBOARD_BLOCK = 256  # entries per block of a leaderboard's ranking, a block is split once it holds twice this
+
+
+def empty_scores():
+    """
+    :return: score state with no scores, {"scores": name -> top wpm, "difficulties": difficulty -> name -> top wpm}
+    """
+    return {"scores": {}, "difficulties": {}}
+
+
+def read_score_file(file_name):
+    """
+    reads a score file, treating a missing, empty or corrupt file as having no scores. files written before scores
+    were kept per difficulty (a plain dict of name -> top wpm) are read as overall scores
+    :param file_name: path of the score file
+    :return: score state dict, see empty_scores()
+    """
+    try:
+        with open(file_name, "r") as f:
+            score_dict = json.load(f)
+    except (OSError, ValueError):
+        return empty_scores()
+    if not isinstance(score_dict, dict):
+        return empty_scores()
+    if isinstance(score_dict.get("scores"), dict):
+        score_dict.setdefault("difficulties", {})
+        return score_dict
+    return {"scores": score_dict, "difficulties": {}}
+
+
+def read_log(file_name):
+    """
+    reads every complete record from a score log, skipping a line left half written by a crash
+    :param file_name: path of the log file
+    :return: list of record dicts
+    """
+    records = []
+    try:
+        with open(file_name, "r") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return records
+
+
+def history_path(history_dir, name):
+    """
+    :param history_dir: folder the history files are kept in
+    :param name: user name
+    :return: path of the JSON lines file of every game the user has played
+    """
+    return os.path.join(history_dir, quote(name, safe="") + ".jsonl")
+
+
+def last_record(file_name):
+    """
+    reads the last complete record of a JSON lines file without reading the rest of it
+    :param file_name: path of the file
+    :return: the record dict, or None if the file is missing or has no complete record
+    """
+    try:
+        with open(file_name, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            tail = b""
+            while end > 0:
+                start = max(0, end - HISTORY_TAIL_BYTES)
+                f.seek(start)
+                tail = f.read(end - start) + tail
+                end = start
+                lines = tail.rstrip(b"\n").split(b"\n")
+                for line in reversed(lines if end == 0 else lines[1:]):  # the first line may be cut off
+                    try:
+                        return json.loads(line)
+                    except ValueError:  # half written by a crash
+                        continue
+    except OSError:
+        pass
+    return None
+
+
+def apply_record(state, record):
+    """
+    updates a score state with one game record, keeping the user's top wpm overall and for the game's difficulty
+    :param state: score state dict, see empty_scores()
+    :param record: dict with at least name and wpm, and optionally difficulty
+    :return:
+    """
+    name, wpm_score = record["name"], record["wpm"]
+    score_dicts = [state["scores"]]
+    if record.get("difficulty"):
+        score_dicts.append(state["difficulties"].setdefault(record["difficulty"], {}))
+    for score_dict in score_dicts:
+        if name not in score_dict or score_dict[name] < wpm_score:
+            score_dict[name] = wpm_score
+
+
+class ScoreWriteError(OSError):
+    """
+    raised by close() when some games could not be saved
+    """
+
+
+class Leaderboard:
+    """
+    every user's top wpm, sorted for top-k and rank queries
+    the ranking of (-wpm, name) entries is kept in sorted blocks of up to 2 * LEADERBOARD_BLOCK entries, with the last
+    entry of each block in maxes to find an entry's block with bisect and a Fenwick tree of the block lengths to count
+    the entries before a block. an update is then an O(log n) search plus an insert into or delete from one short
+    block, rather than moving every entry after it as a single sorted list would. splitting a full block or dropping
+    an empty one rebuilds the Fenwick tree, which happens at most once every LEADERBOARD_BLOCK updates
+    """
+    def __init__(self, scores=None):
+        """
+        :param scores: optional dict of name -> top wpm to start with
+        """
+        self.scores = dict(scores or {})
+        ranking = sorted((-wpm_score, name) for name, wpm_score in self.scores.items())
+        self.blocks = [ranking[start:start + LEADERBOARD_BLOCK] for start in range(0, len(ranking), LEADERBOARD_BLOCK)]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.tree = None  # Fenwick tree of the block lengths, None until a rank is needed after the blocks change
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __contains__(self, name):
+        return name in self.scores
+
+    def get(self, name):
+        """
+        :return: the user's top wpm, or None if they have no score
+        """
+        return self.scores.get(name)
+
+    def update(self, name, wpm_score):
+        """
+        records a score for a user, keeping only their best
+        :return: True if it was a new top score for the user
+        """
+        old_score = self.scores.get(name)
+        if old_score is not None:
+            if old_score >= wpm_score:
+                return False
+            self.remove_entry((-old_score, name))
+        self.scores[name] = wpm_score
+        self.insert_entry((-wpm_score, name))
+        return True
+
+    def insert_entry(self, entry):
+        """
+        :param entry: (-wpm, name) to add to the ranking
+        :return:
+        """
+        if not self.blocks:
+            self.blocks.append([entry])
+            self.maxes.append(entry)
+            self.tree = None
+            return
+        index = min(bisect_left(self.maxes, entry), len(self.blocks) - 1)  # past the last block goes on its end
+        block = self.blocks[index]
+        insort(block, entry)
+        self.maxes[index] = block[-1]
+        if len(block) > 2 * LEADERBOARD_BLOCK:
+            self.blocks[index:index + 1] = [block[:LEADERBOARD_BLOCK], block[LEADERBOARD_BLOCK:]]
+            self.maxes[index:index + 1] = [block[LEADERBOARD_BLOCK - 1], block[-1]]
+            self.tree = None
+        else:
+            self.add_length(index, 1)
+
+    def remove_entry(self, entry):
+        """
+        :param entry: (-wpm, name) in the ranking to remove
+        :return:
+        """
+        index = bisect_left(self.maxes, entry)
+        block = self.blocks[index]
+        del block[bisect_left(block, entry)]
+        if block:
+            self.maxes[index] = block[-1]
+            self.add_length(index, -1)
+        else:
+            del self.blocks[index]
+            del self.maxes[index]
+            self.tree = None
+
+    def add_length(self, index, change):
+        """
+        updates the Fenwick tree after a block's length changed, if it is built
+        :param index: index of the block
+        :param change: entries added to the block, negative if removed
+        :return:
+        """
+        tree = self.tree
+        if tree is None:
+            return
+        index += 1
+        while index < len(tree):
+            tree[index] += change
+            index += index & -index
+
+    def entries_before(self, index):
+        """
+        :param index: index of a block
+        :return: number of entries in the blocks before it
+        """
+        if self.tree is None:  # built in O(number of blocks) by pushing each partial sum up to its parent
+            self.tree = tree = [0] + [len(block) for block in self.blocks]
+            for child in range(1, len(tree)):
+                parent = child + (child & -child)
+                if parent < len(tree):
+                    tree[parent] += tree[child]
+        count = 0
+        while index > 0:
+            count += self.tree[index]
+            index -= index & -index
+        return count
+
+    def top(self, count):
+        """
+        :param count: number of entries to list
+        :return: list of (name, wpm) from the highest score down
+        """
+        top_scores = []
+        for block in self.blocks:
+            if len(top_scores) >= count:
+                break
+            top_scores.extend((name, -negative_score) for negative_score, name in block[:count - len(top_scores)])
+        return top_scores
+
+    def rank(self, name):
+        """
+        :return: the user's position on the board (users on the same score share a rank), or None if they have no score
+        """
+        if name not in self.scores:
+            return None
+        entry = (-self.scores[name], "")  # sorts before every user on the same score
+        index = bisect_left(self.maxes, entry)
+        return self.entries_before(index) + bisect_left(self.blocks[index], entry) + 1
+
+
+def close_quietly(file):
+    """
+    closes a file after a failed write, ignoring the error closing it may raise as well
+    :param file: open file or None
+    :return: None, to clear the caller's reference to the file
+    """
+    if file is not None:
+        try:
+            file.close()
+        except OSError:
+            pass
+    return None
+
+
+def write_atomically(file_name, text):
+    """
+    writes text to a temporary file, fsyncs it and renames it over file_name so readers see the old or the new file
+    but never a partial one
+    :param file_name: path of the file to replace
+    :param text: str, or bytes to write the file in binary mode
+    :return:
+    """
+    temp_name = file_name + ".tmp"
+    with open(temp_name, "wb" if isinstance(text, bytes) else "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_name, file_name)
+    try:  # make the rename itself durable
+        directory = os.open(os.path.dirname(os.path.abspath(file_name)), os.O_RDONLY)
+    except OSError:  # not supported on every platform
+        return
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+class ScoreStore:
+    """
+    every user's top wpm, kept in memory and persisted in the background
+    record() updates the in-memory leaderboards straight away and hands the game record to a writer thread, which
+    appends it to the log and fsyncs. the writer keeps its own copy of the scores so compaction never touches the GUI's
+    """
+    def __init__(self, file_name, log_name, compact_every=COMPACT_EVERY, history_dir=None):
+        """
+        :param file_name: path of the compacted score file
+        :param log_name: path of the append-only log of games since the last compaction
+        :param compact_every: games logged before compacting
+        :param history_dir: folder of each user's game history, defaults to HISTORY_DIR_NAME next to the score file
+        """
+        self.file_name = file_name
+        self.log_name = log_name
+        if history_dir is None:
+            history_dir = os.path.join(os.path.dirname(file_name), HISTORY_DIR_NAME)
+        self.history_dir = history_dir
+        self.compact_every = compact_every
+        state = read_score_file(file_name)
+        for record in read_log(log_name):
+            apply_record(state, record)
+        self.boards = {None: Leaderboard(state["scores"])}  # difficulty -> Leaderboard, None for overall
+        for difficulty, score_dict in state["difficulties"].items():
+            self.boards[difficulty] = Leaderboard(score_dict)
+
+        self.queue = queue.Queue()
+        self.unsaved = []  # records taken off the queue but not yet in the log, only touched by the writer thread
+        self.write_error = None  # the error the writer last failed with, None once a write succeeds
+        self.writer = threading.Thread(target=self.write_records, args=(state,), daemon=True)
+        self.writer.start()
+
+    def record(self, name, wpm_score, **details):
+        """
+        saves the result of a game
+        :param name: user name
+        :param wpm_score: wpm of the game
+        :param details: anything else to keep with the record, e.g. difficulty, accuracy, seconds
+        :return:
+        """
+        record = {"name": name, "wpm": wpm_score, "date": time.time()}
+        record.update(details)
+        self.boards[None].update(name, wpm_score)
+        if record.get("difficulty"):
+            self.leaderboard(record["difficulty"]).update(name, wpm_score)
+        self.queue.put(record)
+
+    def leaderboard(self, difficulty=None):
+        """
+        :param difficulty: difficulty to get the board for, None for the overall board
+        :return: Leaderboard
+        """
+        if difficulty not in self.boards:
+            self.boards[difficulty] = Leaderboard()
+        return self.boards[difficulty]
+
+    def write_records(self, scores):
+        """
+        writer thread: appends queued records to the log and compacts it every compact_every records. a None on the
+        queue compacts whatever is left and stops the thread. records that can not be written (e.g. the disk is full)
+        are kept and tried again along with the next record, and WRITE_RETRIES times on shutdown, so a failed write
+        never stops the thread. close() reports the records that were never saved
+        :param scores: the writer's own score state, see empty_scores()
+        :return:
+        """
+        logged = len(read_log(self.log_name))
+        log_file = None
+        running = True
+        while running:
+            record = self.queue.get()
+            if record is None:
+                running = False
+            else:
+                self.unsaved.append(record)
+            for attempt in range(1 if running else WRITE_RETRIES):
+                if attempt > 0:
+                    time.sleep(WRITE_RETRY_DELAY)
+                try:
+                    if log_file is None:
+                        log_file = self.open_log()
+                    while self.unsaved:
+                        log_file.write(json.dumps(self.unsaved[0]) + "\n")
+                        log_file.flush()
+                        os.fsync(log_file.fileno())
+                        apply_record(scores, self.unsaved.pop(0))
+                        logged += 1
+                    if logged >= self.compact_every or (not running and logged > 0):
+                        log_file.close()
+                        log_file = None
+                        self.compact(scores)
+                        logged = 0
+                    self.write_error = None
+                    break
+                except OSError as error:
+                    self.write_error = error
+                    log_file = close_quietly(log_file)
+        close_quietly(log_file)
+
+    def open_log(self):
+        """
+        opens the log for appending, ending a line left half written by a crash or a failed write so the next record
+        starts clean
+        :return: the open log file
+        """
+        log_file = open(self.log_name, "a+")
+        if log_file.tell() > 0:
+            log_file.seek(log_file.tell() - 1)
+            if log_file.read(1) != "\n":
+                log_file.write("\n")
+        return log_file
+
+    def compact(self, scores):
+        """
+        moves the logged games to their users' history files, replaces the score file with the current scores and
+        empties the log. if a crash happens before the log is emptied, the log is replayed on top of the new score file
+        on the next start, which gives the same scores, and its games are moved again at the next compaction, skipping
+        the ones already at the end of a history file
+        :param scores: the writer's score state
+        :return:
+        """
+        self.append_history(read_log(self.log_name))
+        write_atomically(self.file_name, json.dumps(scores))
+        write_atomically(self.log_name, "")
+
+    def append_history(self, records):
+        """
+        appends games to their users' history files and fsyncs them, skipping games no newer than a file's last game
+        :param records: list of game records, oldest first
+        :return:
+        """
+        games_by_user = {}
+        for record in records:
+            games_by_user.setdefault(record["name"], []).append(record)
+        os.makedirs(self.history_dir, exist_ok=True)
+        for name, games in games_by_user.items():
+            file_name = history_path(self.history_dir, name)
+            last_game = last_record(file_name)
+            last_date = last_game.get("date", 0) if isinstance(last_game, dict) else 0
+            lines = "".join(json.dumps(game) + "\n" for game in games if game.get("date", 0) > last_date)
+            if not lines:
+                continue
+            with open(file_name, "a+") as f:
+                if f.tell() > 0:
+                    f.seek(f.tell() - 1)
+                    if f.read(1) != "\n":  # end a line left half written by a crash
+                        lines = "\n" + lines
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def history(self, name):
+        """
+        every game the user has played, read from disk. games still queued for the writer are not included
+        :param name: user name
+        :return: list of game records, oldest first
+        """
+        games = read_log(history_path(self.history_dir, name))
+        last_date = games[-1].get("date", 0) if games else 0
+        games.extend(record for record in read_log(self.log_name)
+                     if record.get("name") == name and record.get("date", 0) > last_date)
+        return games
+
+    def close(self):
+        """
+        writes out every queued record, compacts and stops the writer thread
+        :return: raises ScoreWriteError if some records could not be saved
+        """
+        self.queue.put(None)
+        self.writer.join()
+        if self.unsaved:
+            raise ScoreWriteError("{} games could not be saved: {}".format(len(self.unsaved), self.write_error))
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    wpm INTEGER NOT NULL,
+    accuracy INTEGER,
+    seconds INTEGER,
+    date REAL NOT NULL,
+    key_stats TEXT
+);
+CREATE INDEX IF NOT EXISTS games_user_difficulty_wpm ON games (user, difficulty, wpm);
+CREATE INDEX IF NOT EXISTS games_user_date ON games (user, date);
+CREATE TABLE IF NOT EXISTS best (
+    user TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    wpm INTEGER NOT NULL,
+    PRIMARY KEY (user, difficulty)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS best_difficulty_wpm ON best (difficulty, wpm);
+"""
+INSERT_GAME = "INSERT INTO games (user, difficulty, wpm, accuracy, seconds, date, key_stats) " \
+              "VALUES (?, ?, ?, ?, ?, ?, ?)"
+UPSERT_BEST = "INSERT INTO best (user, difficulty, wpm) VALUES (?, ?, ?) " \
+              "ON CONFLICT (user, difficulty) DO UPDATE SET wpm = excluded.wpm WHERE excluded.wpm > best.wpm"
+
+
+def connect_sqlite(db_name):
+    """
+    opens a connection to the score database in WAL mode, so readers in other game instances are never blocked by a
+    writer, and creates the tables and indexes if they do not exist yet
+    :param db_name: path of the database file
+    :return: sqlite3.Connection
+    """
+    connection = sqlite3.connect(db_name, timeout=SQLITE_BUSY_TIMEOUT)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")  # still crash safe in WAL mode
+    connection.executescript(SQLITE_SCHEMA)
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(games)")]
+    if "key_stats" not in columns:  # databases created before keystroke statistics were kept
+        connection.execute("ALTER TABLE games ADD COLUMN key_stats TEXT")
+    return connection
+
+
+class SqliteLeaderboard:
+    """
+    the same queries as Leaderboard, answered from the best table of the score database
+    the overall board is stored with an empty difficulty. every query is a fixed parameterised statement, which
+    sqlite3 compiles once per connection and reuses from its statement cache
+    """
+    def __init__(self, connection, difficulty):
+        self.connection = connection
+        self.difficulty = difficulty or ""
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM best WHERE difficulty = ?",
+                                       (self.difficulty,)).fetchone()[0]
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def get(self, name):
+        """
+        :return: the user's top wpm, or None if they have no score
+        """
+        row = self.connection.execute("SELECT wpm FROM best WHERE user = ? AND difficulty = ?",
+                                      (name, self.difficulty)).fetchone()
+        return row[0] if row else None
+
+    def top(self, count):
+        """
+        :param count: number of entries to list
+        :return: list of (name, wpm) from the highest score down
+        """
+        return self.connection.execute("SELECT user, wpm FROM best WHERE difficulty = ? ORDER BY wpm DESC, user "
+                                       "LIMIT ?", (self.difficulty, count)).fetchall()
+
+    def rank(self, name):
+        """
+        :return: the user's position on the board (users on the same score share a rank), or None if they have no score
+        """
+        wpm_score = self.get(name)
+        if wpm_score is None:
+            return None
+        return self.connection.execute("SELECT COUNT(*) FROM best WHERE difficulty = ? AND wpm > ?",
+                                       (self.difficulty, wpm_score)).fetchone()[0] + 1
+
+
+class SqliteScoreStore:
+    """
+    score store backed by an SQLite database, with the same record() / leaderboard() / close() interface as
+    ScoreStore
+    every game is kept in the games table and each user's best per difficulty in the best table. record() queues the
+    game for a writer thread, which inserts whatever has queued up in one transaction, so a burst of games costs one
+    commit. reads use their own connection and only ever see committed games
+    """
+    def __init__(self, db_name, import_file_name=None):
+        """
+        :param db_name: path of the database file, shared by every game instance that uses it
+        :param import_file_name: optional JSON score file whose scores are copied into a new, empty database
+        """
+        self.db_name = db_name
+        self.connection = connect_sqlite(db_name)
+        if import_file_name is not None and len(self.leaderboard()) == 0:
+            self.import_scores(read_score_file(import_file_name))
+
+        self.queue = queue.Queue()
+        self.unsaved = []  # games taken off the queue but not yet committed, only touched by the writer thread
+        self.write_error = None  # the error the writer last failed with, None once a write succeeds
+        self.writer = threading.Thread(target=self.write_records, daemon=True)
+        self.writer.start()
+
+    def import_scores(self, state):
+        """
+        copies the top scores from a JSON score state into the best table
+        :param state: score state dict, see empty_scores()
+        :return:
+        """
+        rows = [(name, "", wpm_score) for name, wpm_score in state["scores"].items()]
+        for difficulty, score_dict in state["difficulties"].items():
+            rows.extend((name, difficulty, wpm_score) for name, wpm_score in score_dict.items())
+        with self.connection:
+            self.connection.executemany(UPSERT_BEST, rows)
+
+    def record(self, name, wpm_score, **details):
+        """
+        saves the result of a game
+        :param name: user name
+        :param wpm_score: wpm of the game
+        :param details: difficulty, accuracy, seconds and key_stats of the game, all optional
+        :return:
+        """
+        key_stats = details.get("key_stats")
+        self.queue.put((name, details.get("difficulty") or "", wpm_score, details.get("accuracy"),
+                        details.get("seconds"), time.time(), json.dumps(key_stats) if key_stats else None))
+
+    def leaderboard(self, difficulty=None):
+        """
+        :param difficulty: difficulty to get the board for, None for the overall board
+        :return: SqliteLeaderboard
+        """
+        return SqliteLeaderboard(self.connection, difficulty)
+
+    def best_per_week(self, name, difficulty=None):
+        """
+        the user's top wpm in every week they played
+        :param name: user name
+        :param difficulty: only count games on this difficulty, None for all
+        :return: list of (start of the week as a unix time, top wpm), oldest first
+        """
+        query = "SELECT CAST(date / ? AS INTEGER) AS week, MAX(wpm) FROM games WHERE user = ?"
+        parameters = [SECONDS_PER_WEEK, name]
+        if difficulty is not None:
+            query += " AND difficulty = ?"
+            parameters.append(difficulty)
+        rows = self.connection.execute(query + " GROUP BY week ORDER BY week", parameters).fetchall()
+        return [(week * SECONDS_PER_WEEK, best_wpm) for week, best_wpm in rows]
+
+    def averages(self, name):
+        """
+        the user's average results on each difficulty
+        :param name: user name
+        :return: dict of difficulty -> (games played, average wpm, average accuracy)
+        """
+        rows = self.connection.execute("SELECT difficulty, COUNT(*), AVG(wpm), AVG(accuracy) FROM games "
+                                       "WHERE user = ? GROUP BY difficulty", (name,)).fetchall()
+        return {difficulty: (games, average_wpm, average_accuracy)
+                for difficulty, games, average_wpm, average_accuracy in rows}
+
+    def write_records(self):
+        """
+        writer thread: waits for a game, then inserts it along with everything else already queued (up to
+        SQLITE_BATCH_SIZE games) in a single transaction. a None on the queue stops the thread. games that can not be
+        inserted (e.g. another instance held the database lock for longer than SQLITE_BUSY_TIMEOUT) are kept and tried
+        again along with the next game, and WRITE_RETRIES times on shutdown, so a failed write never stops the thread.
+        close() reports the games that were never saved
+        :return:
+        """
+        connection = None
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < SQLITE_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [game for game in batch if game is not None]
+            self.unsaved.extend(batch)
+            for attempt in range(1 if running else WRITE_RETRIES):
+                if attempt > 0:
+                    time.sleep(WRITE_RETRY_DELAY)
+                try:
+                    if connection is None:
+                        connection = connect_sqlite(self.db_name)
+                    while self.unsaved:
+                        games = self.unsaved[:SQLITE_BATCH_SIZE]
+                        best_rows = []
+                        for name, difficulty, wpm_score, _, _, _, _ in games:
+                            best_rows.append((name, "", wpm_score))
+                            if difficulty:
+                                best_rows.append((name, difficulty, wpm_score))
+                        with connection:  # one transaction for the whole batch, rolled back if it fails
+                            connection.executemany(INSERT_GAME, games)
+                            connection.executemany(UPSERT_BEST, best_rows)
+                        del self.unsaved[:len(games)]
+                    self.write_error = None
+                    break
+                except (sqlite3.Error, OSError) as error:
+                    self.write_error = error
+        if connection is not None:
+            connection.close()
+
+    def close(self):
+        """
+        writes out every queued game, stops the writer thread and closes the database
+        :return: raises ScoreWriteError if some games could not be saved
+        """
+        self.queue.put(None)
+        self.writer.join()
+        self.connection.close()
+        if self.unsaved:
+            raise ScoreWriteError("{} games could not be saved: {}".format(len(self.unsaved), self.write_error))
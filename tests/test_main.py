@@ -0,0 +1,121 @@
+"""
+regression tests for the frame scheduler driving a game through to its end screen and for closing at startup, with
+the Tk objects the game draws on replaced by recorders
+"""
+import pytest
+import main
+from engine import GameEngine
+from replay import SessionRecorder, ReplayPlayer
+
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel"]
+MAX_FRAMES = 10000  # frames a game gets to end in before the test fails
+
+
+class FakeMaster:
+    """
+    stands in for the Tk root, keeping the callback of the pending after() so a test can run frames one at a time
+    """
+    def __init__(self):
+        self.pending = None
+
+    def after(self, interval, callback):
+        self.pending = callback
+        return "after#1"
+
+    def after_cancel(self, after_id):
+        self.pending = None
+
+
+class FakeCanvas:
+    """
+    stands in for the RetainedCanvas and the CanvasItemPool, accepting every call
+    """
+    def configure(self, *args, **kwargs):
+        pass
+
+    def move_to(self, *args):
+        pass
+
+    def flush(self):
+        pass
+
+    def acquire(self, *args, **kwargs):
+        return object()
+
+    def release(self, item):
+        pass
+
+
+@pytest.fixture
+def game(monkeypatch):
+    """
+    sets up main's globals for a game without Tk
+    :return: (FakeMaster the frames run on, list the end screen appends to each time it is shown)
+    """
+    master = FakeMaster()
+    end_screens = []
+    canvas = FakeCanvas()
+    monkeypatch.setattr(main, "FIXED_TIMESTEP", False)  # one simulation step per frame
+    monkeypatch.setattr(main, "frame_scheduler", main.FrameScheduler(master))
+    monkeypatch.setattr(main, "retained_canvas", canvas)
+    monkeypatch.setattr(main, "text_pool", canvas)
+    monkeypatch.setattr(main, "word_items", {})
+    monkeypatch.setattr(main, "key_buffer", main.KeyBuffer())
+    monkeypatch.setattr(main, "explode", lambda word: None)
+    monkeypatch.setattr(main, "show_end_screen", lambda: end_screens.append(main.engine.game_over))
+    monkeypatch.setattr(main, "recorder", None)
+    monkeypatch.setattr(main, "racing", False)
+    return master, end_screens
+
+
+def run_frames(master):
+    """
+    runs frames until the scheduler goes idle
+    :return: number of frames run
+    """
+    for frame in range(MAX_FRAMES):
+        if master.pending is None:
+            return frame
+        callback, master.pending = master.pending, None
+        callback()
+    raise AssertionError("the scheduler was still running after {} frames".format(MAX_FRAMES))
+
+
+def test_lost_game_reaches_end_screen(game, monkeypatch):
+    master, end_screens = game
+    monkeypatch.setattr(main, "engine", GameEngine(WORDS, "hard", seed=1))
+    main.engine.start()
+    main.add_game(main.engine.step, main.process_keys)  # nothing is typed, so the words reach the bottom
+    run_frames(master)
+    assert main.engine.game_over
+    assert end_screens == [True]
+    assert main.frame_scheduler.entities == []
+
+
+def test_replay_reaches_end_screen(game, monkeypatch):
+    master, end_screens = game
+    recorded = GameEngine(WORDS, "hard", seed=2)
+    recorder = SessionRecorder(recorded)
+    recorded.start()
+    while recorded.step():
+        recorded.drain_events()
+    player = ReplayPlayer(recorder.finish(), recorded.word_index)
+    monkeypatch.setattr(main, "engine", player.engine)
+    main.engine.start()
+    main.add_game(player.step)
+    run_frames(master)
+    assert main.engine.game_over
+    assert end_screens == [True]
+    assert main.frame_scheduler.entities == []
+
+
+def test_closing_when_ready_skips_background_load(monkeypatch):
+    destroyed = []
+    loaded = []
+    monkeypatch.setattr(main, "root", type("FakeRoot", (), {"destroy": lambda self: destroyed.append(True)})())
+    monkeypatch.setattr(main, "score_store", None)
+    monkeypatch.setattr(main, "closed", False)
+    monkeypatch.setattr(main, "load_in_background", lambda: loaded.append(True))
+    main.first_screen_drawn(main.close)  # as the startup benchmark does
+    assert destroyed == [True]
+    assert loaded == []
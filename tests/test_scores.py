@@ -0,0 +1,30 @@
+"""
+tests for the blocked leaderboard, checked against a plain sorted list
+"""
+import random
+import pytest
+import scores
+from scores import Leaderboard
+
+
+@pytest.mark.parametrize("block", [1, 2, 256])
+def test_leaderboard_matches_sorted_list(monkeypatch, block):
+    monkeypatch.setattr(scores, "LEADERBOARD_BLOCK", block)  # small blocks split and empty often
+    rng = random.Random(block)
+    expected = {"user{}".format(number): rng.randint(0, 50) for number in range(30)}
+    board = Leaderboard(expected)
+    for step in range(5000):
+        name = "user{}".format(rng.randint(0, 200))
+        wpm_score = rng.randint(0, 120)
+        new_best = name not in expected or wpm_score > expected[name]
+        assert board.update(name, wpm_score) == new_best
+        if new_best:
+            expected[name] = wpm_score
+        if step % 50 == 0:
+            ranking = sorted(expected.items(), key=lambda item: (-item[1], item[0]))
+            assert board.top(10) == ranking[:10]
+            assert board.top(len(ranking) + 1) == ranking
+            for name, wpm_score in ranking:
+                assert board.rank(name) == 1 + sum(other > wpm_score for other in expected.values())
+    assert board.rank("nobody") is None
+    assert len(board) == len(expected)
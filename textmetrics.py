@@ -0,0 +1,126 @@
+"""
+Text measurement for laying out the typing game's words
+
+The engine needs the drawn width of every word it spawns, to keep words apart and inside the play area. Asking Tk for
+a width is a Tcl round trip, so a TextMeasurer keeps the widths it has measured in an LRU cache keyed by (font family,
+size, word), and the frontend fills the cache for the whole dictionary with precompute() before a game starts. A word
+that is not in the cache is estimated from a table of character widths instead, which precompute() also measures with
+Tk, so the spawn path never calls into Tk.
+
+Without a display (e.g. in the benchmarks and parameter sweeps) widths come from FALLBACK_EM_WIDTHS, the advance widths
+of DejaVu Sans, Tk's usual default font on Linux.
+"""
+from collections import OrderedDict
+
+MEASURE_CACHE_SIZE = 50000  # widths kept in a TextMeasurer's cache
+PIXELS_PER_POINT = 96 / 72  # Tk font sizes are in points, at the usual 96 dpi
+# width of each character as a fraction of the font's em size
+FALLBACK_EM_WIDTHS = {
+    "a": 0.613, "b": 0.635, "c": 0.550, "d": 0.635, "e": 0.615, "f": 0.352, "g": 0.635, "h": 0.634, "i": 0.278,
+    "j": 0.278, "k": 0.579, "l": 0.278, "m": 0.974, "n": 0.634, "o": 0.612, "p": 0.635, "q": 0.635, "r": 0.411,
+    "s": 0.521, "t": 0.392, "u": 0.634, "v": 0.592, "w": 0.818, "x": 0.592, "y": 0.592, "z": 0.525,
+    "A": 0.684, "B": 0.686, "C": 0.698, "D": 0.770, "E": 0.632, "F": 0.575, "G": 0.775, "H": 0.752, "I": 0.295,
+    "J": 0.295, "K": 0.656, "L": 0.557, "M": 0.863, "N": 0.748, "O": 0.787, "P": 0.603, "Q": 0.787, "R": 0.695,
+    "S": 0.635, "T": 0.611, "U": 0.732, "V": 0.684, "W": 0.989, "X": 0.685, "Y": 0.611, "Z": 0.685,
+    "0": 0.636, "1": 0.636, "2": 0.636, "3": 0.636, "4": 0.636, "5": 0.636, "6": 0.636, "7": 0.636, "8": 0.636,
+    "9": 0.636, "'": 0.275, "-": 0.361, ".": 0.318, ",": 0.318, "!": 0.400, "?": 0.531, " ": 0.318,
+}
+FALLBACK_EM_WIDTH = 0.6  # width of a character missing from the table
+
+
+def estimate_text_width(text, font_size):
+    """
+    width of text in pixels from the fallback table, used when no real font measurement is available
+    :param text: the text to measure
+    :param font_size: font size in points
+    :return: width in pixels
+    """
+    return sum(FALLBACK_EM_WIDTHS.get(character, FALLBACK_EM_WIDTH) for character in text) * font_size * \
+        PIXELS_PER_POINT
+
+
+class TextMeasurer:
+    """
+    widths of words in pixels, cached per (font family, size, word) with the least recently used dropped beyond
+    cache_size
+    """
+    def __init__(self, font_factory=None, cache_size=MEASURE_CACHE_SIZE):
+        """
+        :param font_factory: optional callable taking a font family and size and returning an object with a
+        measure(text) method, e.g. a tkinter.font.Font. None to measure with the fallback table only
+        :param cache_size: widths to keep
+        """
+        self.font_factory = font_factory
+        self.cache_size = cache_size
+        self.widths = OrderedDict()  # (family, size, word) -> width, least recently used first
+        self.char_widths = {}  # (family, size) -> {character: width} measured by precompute()
+        self.fonts = {}  # (family, size) -> font from font_factory
+
+    def measure(self, text, family, size):
+        """
+        :param text: the word to measure
+        :param family: font family
+        :param size: font size in points
+        :return: width of the word in pixels, from the cache if it is there, otherwise estimated without calling Tk
+        """
+        key = (family, size, text)
+        width = self.widths.get(key)
+        if width is None:
+            width = self.estimate(text, family, size)
+            self.remember(key, width)
+        else:
+            self.widths.move_to_end(key)
+        return width
+
+    def estimate(self, text, family, size):
+        """
+        :return: width of text as the sum of its characters' widths, measured by precompute() if it has been run for
+        the font, otherwise from the fallback table
+        """
+        char_widths = self.char_widths.get((family, size))
+        if char_widths is None:
+            return estimate_text_width(text, size)
+        fallback = FALLBACK_EM_WIDTH * size * PIXELS_PER_POINT
+        return sum(char_widths.get(character, fallback) for character in text)
+
+    def remember(self, key, width):
+        """
+        adds a width to the cache, dropping the least recently used beyond cache_size
+        :return:
+        """
+        self.widths[key] = width
+        if len(self.widths) > self.cache_size:
+            self.widths.popitem(last=False)
+
+    def precompute(self, words, family, size):
+        """
+        measures words with the font factory and caches their widths, along with the width of every character in
+        them. call it in chunks for a large dictionary, only the last cache_size words measured are kept
+        :param words: iterable of words
+        :param family: font family
+        :param size: font size in points
+        :return:
+        """
+        if self.font_factory is None:
+            for word in words:
+                self.measure(word, family, size)
+            return
+        font = self.fonts.get((family, size))
+        if font is None:
+            font = self.fonts[(family, size)] = self.font_factory(family, size)
+        char_widths = self.char_widths.setdefault((family, size), {})
+        for word in words:
+            key = (family, size, word)
+            if key in self.widths:  # measured for an earlier game
+                self.widths.move_to_end(key)
+                continue
+            for character in word:
+                if character not in char_widths:
+                    char_widths[character] = font.measure(character)
+            self.remember(key, font.measure(word))
+
+    def measure_function(self, family, size):
+        """
+        :return: callable taking a word and returning its width in the given font, for GameEngine's measure argument
+        """
+        return lambda text: self.measure(text, family, size)
@@ -0,0 +1,282 @@
+"""
+Difficulty curve tuning by batch simulation
+
+Plays large numbers of headless games with modelled typists over a grid of engine parameters, spread across every
+core with a ProcessPoolExecutor, and reports how each combination of parameters plays:
+
+  survival      seconds of game time before a word reached the bottom, mean and median, and the fraction of games
+                that lasted the full --seconds
+  wpm           wpm the typists achieved, mean and 10th-90th percentile
+  spawn fails   fraction of spawns that found no room in the spawn band and had to wait
+  particles     explosion lines on screen, mean over every step and peak, when particle_speed is swept. explosions
+                do not change how a game plays, only how much the frontend has to draw each frame
+
+Every game has its own seed, and game n uses the same seed (so the same typist and the same words) for every
+combination, so differences between combinations come from the parameters rather than from luck. Typists are drawn
+per game from normal distributions of wpm and error rate.
+
+Games run in batches, and each finished batch is appended to the results file as one JSON line per game, so a long
+sweep can be watched with --summarise from another terminal while it runs. Running the same sweep again with the same
+results file skips the games already in it, so an interrupted sweep resumes where it stopped.
+
+usage: python tune.py --param speed_increment=1.0003,1.0005,1.0008 --param difficulty=easy,medium [--games N]
+       python tune.py --summarise tune_results.jsonl
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from analytics import percentile
+from bots import BotTypist, play
+from engine import GameEngine, DIFFICULTY_DICT, CANVAS_WIDTH, CANVAS_HEIGHT
+from particles import ParticleSystem
+from scores import read_log
+from wordlist import WordListLoader
+
+RESULTS_FILE_NAME = "tune_results.jsonl"
+TUNABLE_PARAMS = {"difficulty": str, "start_velocity": float, "max_word_length": int, "speed_increment": float,
+                  "spawn_y": float, "particle_speed": float}  # parameter -> type its values are parsed as
+ENGINE_PARAMS = ("start_velocity", "max_word_length", "speed_increment", "spawn_y")  # passed on to GameEngine
+GAMES_PER_COMBINATION = 200
+GAMES_PER_BATCH = 25  # games a worker plays per task, enough to outweigh the cost of sending the task
+TUNE_GAME_SECONDS = 300  # game time a game is capped at, so good typists on easy settings do not play forever
+TYPIST_WPM = (60, 20)  # mean and standard deviation of the typists' wpm
+TYPIST_ERROR_RATE = (0.05, 0.03)  # mean and standard deviation of the typists' error rate
+MIN_TYPIST_WPM = 10
+SEED = 4321
+
+worker_words = None  # WordIndex each worker process plays with, loaded once by load_worker_words()
+
+
+def load_worker_words(file_name):
+    """
+    runs once in every worker process, so the word list is read once per process rather than sent with every task
+    :param file_name: path of the word list
+    :return:
+    """
+    global worker_words
+    worker_words = WordListLoader(file_name, {}).load_all()
+
+
+def draw_typist(seed):
+    """
+    :param seed: the game's seed
+    :return: BotTypist with a wpm and error rate drawn from the TYPIST_WPM and TYPIST_ERROR_RATE distributions
+    """
+    rng = random.Random(seed)
+    wpm = max(MIN_TYPIST_WPM, rng.gauss(*TYPIST_WPM))
+    error_rate = min(0.5, max(0.0, rng.gauss(*TYPIST_ERROR_RATE)))
+    return BotTypist(wpm, error_rate, seed=seed)
+
+
+def track_particles(particles, counts):
+    """
+    :param particles: ParticleSystem without a canvas
+    :param counts: list the number of live particles is appended to after every step
+    :return: on_events callable for play() that explodes every typed word like the frontend does
+    """
+    def on_events(events):
+        for kind, word in events:
+            if kind == "explode":
+                particles.emit(word.x, word.y)
+        particles.step()
+        counts.append(len(particles.x))
+    return on_events
+
+
+def play_batch(params, seeds, max_seconds):
+    """
+    plays a game for every seed with the given engine parameters, in a worker process
+    :param params: dict of TUNABLE_PARAMS values, difficulty is required
+    :param seeds: list of game seeds
+    :param max_seconds: game time each game is capped at
+    :return: list of result dicts, one per game
+    """
+    engine_params = {name: value for name, value in params.items() if name in ENGINE_PARAMS}
+    results = []
+    for seed in seeds:
+        particle_counts = []
+        on_events = None
+        if "particle_speed" in params:  # only simulated when swept, as it slows every game down
+            particles = ParticleSystem(None, CANVAS_WIDTH, CANVAS_HEIGHT, speed=params["particle_speed"])
+            on_events = track_particles(particles, particle_counts)
+        engine = play(GameEngine(worker_words, params["difficulty"], seed=seed, **engine_params), draw_typist(seed),
+                      max_seconds=max_seconds, on_events=on_events)
+        result = {"params": params, "seed": seed, "survival": round(engine.time, 2),
+                  "capped": engine.time >= max_seconds, "wpm": engine.wpm(), "words": engine.words_typed,
+                  "spawns": engine.next_word_id, "spawn_failures": engine.spawn_failures}
+        if on_events is not None:
+            result["particles_mean"] = round(sum(particle_counts) / len(particle_counts), 2) if particle_counts else 0
+            result["particles_peak"] = max(particle_counts, default=0)
+        results.append(result)
+    return results
+
+
+def parse_param(text):
+    """
+    :param text: a --param argument, name=value,value,...
+    :return: (name, list of values), raises argparse.ArgumentTypeError if it is not valid
+    """
+    name, _, values = text.partition("=")
+    if name not in TUNABLE_PARAMS or not values:
+        raise argparse.ArgumentTypeError("expected name=value,value,... with name one of {}".format(
+            ", ".join(TUNABLE_PARAMS)))
+    try:
+        parsed = [TUNABLE_PARAMS[name](value) for value in values.split(",")]
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+    if name == "difficulty" and any(value not in DIFFICULTY_DICT for value in parsed):
+        raise argparse.ArgumentTypeError("difficulties are {}".format(", ".join(DIFFICULTY_DICT)))
+    return name, parsed
+
+
+def combinations(grid):
+    """
+    :param grid: list of (name, values) pairs
+    :return: list of params dicts, one for every combination of values, always including a difficulty
+    """
+    grid = dict(grid)
+    grid.setdefault("difficulty", ["medium"])
+    names = list(grid)
+    return [dict(zip(names, values)) for values in product(*(grid[name] for name in names))]
+
+
+def params_key(params):
+    """
+    :return: hashable key of a params dict, the same whatever order its items are in
+    """
+    return json.dumps(params, sort_keys=True)
+
+
+def summarise(results):
+    """
+    aggregates game results per combination of parameters
+    :param results: list of result dicts from play_batch()
+    :return: list of (params, summary dict) pairs in the order each combination first appears
+    """
+    grouped = {}
+    for result in results:
+        grouped.setdefault(params_key(result["params"]), []).append(result)
+    summaries = []
+    for games in grouped.values():
+        survival = sorted(game["survival"] for game in games)
+        wpm = sorted(game["wpm"] for game in games)
+        spawns = sum(game["spawns"] for game in games)  # a spawn that had to wait counts once as a failure
+        summary = {
+            "games": len(games), "survival_mean": round(sum(survival) / len(games), 1),
+            "survival_p50": survival[len(survival) // 2],
+            "capped": round(sum(game["capped"] for game in games) / len(games), 3),
+            "wpm_mean": round(sum(wpm) / len(games), 1), "wpm_p10": percentile(wpm, 0.1),
+            "wpm_p90": percentile(wpm, 0.9),
+            "spawn_fail_rate": round(sum(game["spawn_failures"] for game in games) / spawns, 4) if spawns else 0}
+        if all("particles_mean" in game for game in games):
+            summary["particles_mean"] = round(sum(game["particles_mean"] for game in games) / len(games), 1)
+            summary["particles_peak"] = max(game["particles_peak"] for game in games)
+        summaries.append((games[0]["params"], summary))
+    return summaries
+
+
+def format_table(summaries):
+    """
+    :param summaries: list of (params, summary dict) pairs from summarise()
+    :return: the summaries as a text table, one row per combination
+    """
+    if not summaries:
+        return "no results"
+    param_names = sorted({name for params, _ in summaries for name in params})
+    metric_names = list(dict.fromkeys(name for _, summary in summaries for name in summary))  # in first seen order
+    rows = [param_names + metric_names]
+    for params, summary in summaries:
+        rows.append([str(params.get(name, "")) for name in param_names] +
+                    [str(summary.get(name, "")) for name in metric_names])
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    return "\n".join("  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+def end_partial_line(file_name):
+    """
+    ends a line left half written by an interrupted run with a newline, so results appended after it are not joined
+    onto it. the half line itself is skipped by read_log() and its game played again
+    :param file_name: path of the results file
+    :return:
+    """
+    try:
+        with open(file_name, "rb+") as f:
+            if f.seek(0, os.SEEK_END) == 0:
+                return
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+    except FileNotFoundError:
+        pass
+
+
+def sweep(grid, games, results_file_name, word_file_name, workers=None, max_seconds=TUNE_GAME_SECONDS):
+    """
+    plays every combination of the grid's parameters, appending results to the results file as batches finish and
+    skipping games already in it
+    :param grid: list of (name, values) pairs
+    :param games: games per combination
+    :param results_file_name: path of the JSON lines results file
+    :param word_file_name: path of the word list the games are played with
+    :param workers: number of worker processes, defaults to the number of cores
+    :param max_seconds: game time each game is capped at
+    :return: list of (params, summary dict) pairs of every combination in the grid
+    """
+    param_sets = combinations(grid)
+    wanted = {params_key(params) for params in param_sets}
+    results = [result for result in read_log(results_file_name) if params_key(result["params"]) in wanted]
+    done = {(params_key(result["params"]), result["seed"]) for result in results}
+    batches = []
+    for params in param_sets:
+        seeds = [SEED + game for game in range(games) if (params_key(params), SEED + game) not in done]
+        batches.extend((params, seeds[start:start + GAMES_PER_BATCH])
+                       for start in range(0, len(seeds), GAMES_PER_BATCH))
+    total = len(param_sets) * games
+    print("{} combinations x {} games, {} already played, {} batches to run".format(
+        len(param_sets), games, len(results), len(batches)), file=sys.stderr)
+    end_partial_line(results_file_name)
+    start_time = time.perf_counter()
+    played = 0
+    with ProcessPoolExecutor(workers, initializer=load_worker_words, initargs=(word_file_name,)) as executor, \
+            open(results_file_name, "a") as results_file:
+        futures = [executor.submit(play_batch, params, seeds, max_seconds) for params, seeds in batches]
+        for future in as_completed(futures):
+            batch_results = future.result()
+            results_file.write("".join(json.dumps(result) + "\n" for result in batch_results))
+            results_file.flush()  # so --summarise and a resumed run see every finished batch
+            results.extend(batch_results)
+            played += len(batch_results)
+            elapsed = time.perf_counter() - start_time
+            print("{}/{} games, {:.0f} games per second".format(len(results), total, played / elapsed),
+                  file=sys.stderr)
+    order = {params_key(params): index for index, params in enumerate(param_sets)}
+    return sorted(summarise(results), key=lambda summary: order[params_key(summary[0])])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sweep engine parameters with simulated games")
+    parser.add_argument("--param", type=parse_param, action="append", default=[],
+                        help="name=value,value,... to sweep, one of {}".format(", ".join(TUNABLE_PARAMS)))
+    parser.add_argument("--games", type=int, default=GAMES_PER_COMBINATION, help="games per combination")
+    parser.add_argument("--seconds", type=float, default=TUNE_GAME_SECONDS, help="game time each game is capped at")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to one per core")
+    parser.add_argument("--words", default="defaulttext.txt", help="word list the games are played with")
+    parser.add_argument("--results", default=RESULTS_FILE_NAME, help="results file, resumed if it exists")
+    parser.add_argument("--summarise", metavar="RESULTS_FILE", help="only print the table of a results file")
+    args = parser.parse_args()
+
+    if args.summarise:
+        print(format_table(summarise(read_log(args.summarise))))
+        return
+    if not os.path.exists(args.words):
+        parser.error("word list {} not found".format(args.words))
+    print(format_table(sweep(args.param, args.games, args.results, args.words, args.workers, args.seconds)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""
+Word list loading, caching and indexing for the typing game
+
+Word list files are read a chunk of lines at a time so a large file can be loaded without freezing the GUI. Words are
+deduplicated and sorted by length once when a game is prepared, so the words eligible for a difficulty are always a
+prefix of the index. Spawning a word then samples from that prefix in constant time, with the words already on screen
+swapped out of the way rather than being rejected and redrawn.
+
+Built indexes are saved to a binary cache keyed by the source file's path, size and modification time, so the next
+game with the same file memory-maps the cache instead of parsing the file again.
+"""
+import os
+import mmap
+import struct
+import hashlib
+from array import array
+
+MIN_ELIGIBLE_WORDS = 4  # fewest words short enough for a difficulty that a game can be played with
+LOADER_CHUNK_LINES = 20000  # lines read per call to WordListLoader.load_lines()
+MAX_LINE_LENGTH = 1024  # characters of a line that are looked at, the rest of a longer line is skipped
+CACHE_DIR = "wordcache"  # folder the compiled word list caches are kept in
+CACHE_MAGIC = b"TWWI"
+CACHE_VERSION = 1
+# magic, version, source size, source mtime_ns, source path length, word count, longest word length
+CACHE_HEADER = struct.Struct("<4sIQqIII")
+
+
+class WordListError(ValueError):
+    """
+    raised when a word list does not have enough eligible words to play with
+    """
+
+
+class WordListLoader:
+    """
+    streams a word list file line by line, keeping the first word of every line
+    words are deduplicated with a set as they are read, keeping the order they first appear in, and the number of
+    words short enough for each difficulty is counted in the same pass. only the unique words and one line at a time
+    are held in memory. call load_lines() repeatedly (e.g. from root.after) until it returns True
+    """
+    def __init__(self, file_name, max_word_lengths):
+        """
+        :param file_name: path of the text file, raises FileNotFoundError if it does not exist
+        :param max_word_lengths: dict of difficulty -> longest word allowed for it
+        """
+        self.file = open(file_name, encoding="utf-8", errors="replace")
+        self.max_word_lengths = max_word_lengths
+        self.words = []  # unique words in the order they first appear
+        self.seen = set()
+        self.eligible_counts = {difficulty: 0 for difficulty in max_word_lengths}
+        self.done = False
+
+    def read_line(self):
+        """
+        reads the next line, skipping past anything beyond MAX_LINE_LENGTH characters
+        :return: the line, or "" at the end of the file
+        """
+        line = self.file.readline(MAX_LINE_LENGTH)
+        if len(line) == MAX_LINE_LENGTH and not line.endswith("\n"):
+            rest = line
+            while len(rest) == MAX_LINE_LENGTH and not rest.endswith("\n"):  # discard the rest of a very long line
+                rest = self.file.readline(MAX_LINE_LENGTH)
+        return line
+
+    def load_lines(self, max_lines=LOADER_CHUNK_LINES):
+        """
+        reads up to max_lines more lines of the file
+        :param max_lines: number of lines to read in this call
+        :return: True once the whole file has been read
+        """
+        for _ in range(max_lines):
+            line = self.read_line()
+            if line == "":
+                self.done = True
+                self.file.close()
+                break
+            tokens = line.split(None, 1)  # removes all characters after whitespace
+            if not tokens or tokens[0] in self.seen:
+                continue
+            word = tokens[0]
+            self.seen.add(word)
+            self.words.append(word)
+            for difficulty, max_word_length in self.max_word_lengths.items():
+                if len(word) <= max_word_length:
+                    self.eligible_counts[difficulty] += 1
+        return self.done
+
+    def load_all(self):
+        """
+        reads the rest of the file in one go, for use outside the GUI
+        :return: WordIndex of the words read
+        """
+        while not self.load_lines():
+            pass
+        return self.index()
+
+    def index(self):
+        """
+        :return: WordIndex of the words read so far
+        """
+        return WordIndex(self.words)
+
+
+class WordIndex:
+    """
+    deduplicated words sorted by length, with the number of words at or under each length
+    """
+    def __init__(self, words, length_ends=None):
+        """
+        :param words: iterable of words, empty strings and duplicates are dropped (first occurrence kept)
+        :param length_ends: only given with words that are already unique and sorted (e.g. from the cache),
+        length_ends[n] is the number of words with at most n characters
+        """
+        if length_ends is None:
+            unique_words = list(dict.fromkeys(word for word in words if word != ""))
+            words = sorted(unique_words, key=len)  # stable, so words of equal length keep their file order
+            length_ends = [0] * (len(words[-1]) + 1 if words else 1)
+            for word in words:
+                length_ends[len(word)] += 1
+            for length in range(1, len(length_ends)):  # running total
+                length_ends[length] += length_ends[length - 1]
+        self.words = words
+        self.length_ends = length_ends
+        self.words_digest = None  # sha256 of the words, worked out the first time digest() is called
+
+    def __len__(self):
+        return len(self.words)
+
+    def digest(self):
+        """
+        :return: sha256 digest of the words in index order, identifying the word list a game was played with
+        """
+        if self.words_digest is None:
+            words_hash = hashlib.sha256()
+            for word in self.words:
+                words_hash.update(word.encode("utf-8"))
+                words_hash.update(b"\n")
+            self.words_digest = words_hash.digest()
+        return self.words_digest
+
+    def eligible_count(self, max_word_length):
+        """
+        :param max_word_length: longest word allowed, may be float("inf")
+        :return: how many words are at most max_word_length characters long
+        """
+        if max_word_length >= len(self.length_ends) - 1:
+            return len(self.words)
+        return self.length_ends[max_word_length]
+
+    def sampler(self, max_word_length, rng):
+        """
+        creates a sampler over the words eligible for the given maximum length
+        :param max_word_length: longest word allowed
+        :param rng: random.Random instance to sample with
+        :return: WordSampler
+        """
+        return WordSampler(self, max_word_length, rng)
+
+
+class MappedWords:
+    """
+    read-only sequence of the words stored in a memory-mapped cache file, each word is decoded when it is looked up
+    """
+    def __init__(self, cache_map, offsets, blob_start):
+        self.cache_map = cache_map
+        self.offsets = offsets  # byte offset of every word in the blob, plus the end of the last word
+        self.blob_start = blob_start
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError("word index out of range")
+        start = self.blob_start + self.offsets[index]
+        return self.cache_map[start:self.blob_start + self.offsets[index + 1]].decode("utf-8")
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def cache_path(file_name):
+    """
+    :param file_name: path of a word list file
+    :return: path of the cache file for it inside CACHE_DIR
+    """
+    key = hashlib.sha1(os.path.abspath(file_name).encode("utf-8")).hexdigest()[:20]
+    return os.path.join(CACHE_DIR, key + ".cache")
+
+
+def read_cache_header(cache_file):
+    """
+    :param cache_file: open binary cache file
+    :return: (source path, source size, source mtime_ns, word count, longest word length), or None if not a cache
+    """
+    header = cache_file.read(CACHE_HEADER.size)
+    if len(header) != CACHE_HEADER.size:
+        return None
+    magic, version, size, mtime_ns, path_length, word_count, longest = CACHE_HEADER.unpack(header)
+    if magic != CACHE_MAGIC or version != CACHE_VERSION:
+        return None
+    return cache_file.read(path_length).decode("utf-8"), size, mtime_ns, word_count, longest
+
+
+def load_cached_index(file_name):
+    """
+    memory-maps the cached index of a word list file if there is one that matches the file's current size and
+    modification time, and whose length matches the counts in its header
+    :param file_name: path of the word list file
+    :return: WordIndex backed by the cache, or None if there is no up to date, complete cache
+    """
+    try:
+        source_stat = os.stat(file_name)
+        with open(cache_path(file_name), "rb") as f:
+            header = read_cache_header(f)
+            if header is None or header[0] != os.path.abspath(file_name) or \
+                    header[1:3] != (source_stat.st_size, source_stat.st_mtime_ns):
+                return None
+            word_count, longest = header[3:]
+            table_start = f.tell()
+            cache_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # no cache, or it could not be read
+        return None
+    blob_start = table_start + (longest + 1 + word_count + 1) * 4
+    if len(cache_map) < blob_start:  # cut short, e.g. by a full disk
+        cache_map.close()
+        return None
+    tables = memoryview(cache_map)[table_start:blob_start]
+    length_ends = tables[:(longest + 1) * 4].cast("I").tolist()
+    offsets = tables[(longest + 1) * 4:].cast("I")
+    if len(cache_map) != blob_start + offsets[word_count] or (length_ends and length_ends[-1] != word_count):
+        offsets.release()  # the map can only be closed once no views of it are left
+        tables.release()
+        cache_map.close()
+        return None
+    return WordIndex(MappedWords(cache_map, offsets, blob_start), length_ends)
+
+
+def save_cached_index(file_name, word_index):
+    """
+    writes a word list's index to its cache file, replacing it atomically, then evicts caches that have gone stale.
+    the cache is only an optimisation so failing to write it is ignored
+    :param file_name: path of the word list file the index was built from
+    :param word_index: WordIndex built from the file
+    :return:
+    """
+    try:
+        source_stat = os.stat(file_name)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        source_path = os.path.abspath(file_name).encode("utf-8")
+        blob = bytearray()
+        offsets = array("I", [0])
+        for word in word_index.words:
+            blob += word.encode("utf-8")
+            offsets.append(len(blob))
+        length_ends = array("I", word_index.length_ends)
+        target = cache_path(file_name)
+        with open(target + ".tmp", "wb") as f:
+            f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, source_stat.st_size, source_stat.st_mtime_ns,
+                                      len(source_path), len(word_index), len(length_ends) - 1))
+            f.write(source_path)
+            f.write(length_ends.tobytes())
+            f.write(offsets.tobytes())
+            f.write(blob)
+        os.replace(target + ".tmp", target)
+        evict_stale_caches()
+    except OSError:
+        pass
+
+
+def evict_stale_caches(extension=".cache", read_header=read_cache_header):
+    """
+    deletes cache files whose source file has been deleted or changed since the cache was written
+    :param extension: extension of the cache files to check, e.g. ".lines" for passage.py's line indexes
+    :param read_header: function reading the header of an open cache file of that kind, returning (source path, source
+    size, source mtime_ns, ...) or None if it is not a valid cache
+    :return:
+    """
+    for entry in os.scandir(CACHE_DIR):
+        if not entry.name.endswith(extension):
+            continue
+        try:
+            with open(entry.path, "rb") as f:
+                header = read_header(f)
+            if header is not None:
+                source_stat = os.stat(header[0])
+                if header[1:3] == (source_stat.st_size, source_stat.st_mtime_ns):
+                    continue
+        except (OSError, ValueError):
+            pass
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+class WordSampler:
+    """
+    draws distinct random words from the eligible prefix of a WordIndex in O(1)
+    the prefix is treated as a virtual array whose last `taken` slots hold the words currently in play. drawing a word
+    swaps it into that tail and releasing it swaps it back, so words in play are never drawn twice. only the swapped
+    slots are stored, the index itself is never copied or modified
+    """
+    def __init__(self, word_index, max_word_length, rng):
+        self.words = word_index.words
+        self.pool_size = word_index.eligible_count(max_word_length)
+        if self.pool_size < MIN_ELIGIBLE_WORDS:
+            raise WordListError("only {} words are short enough for this difficulty, at least {} are needed".format(
+                self.pool_size, MIN_ELIGIBLE_WORDS))
+        self.rng = rng
+        self.slots = {}  # virtual position -> word index, for positions that have been swapped
+        self.taken = {}  # word currently in play -> its virtual position
+
+    def slot(self, position):
+        """
+        :return: index into the word list of the word at the given virtual position
+        """
+        return self.slots.get(position, position)
+
+    def swap(self, a, b):
+        """
+        swaps two virtual positions, only remembering positions that no longer hold their own index
+        :return:
+        """
+        value_a, value_b = self.slot(a), self.slot(b)
+        for position, value in ((a, value_b), (b, value_a)):
+            if position == value:
+                self.slots.pop(position, None)
+            else:
+                self.slots[position] = value
+
+    def advance(self):
+        """
+        uniform sampling needs no precomputation, kept so the engine can treat every sampler the same
+        :return:
+        """
+
+    def take(self):
+        """
+        draws a random eligible word that is not already in play and marks it as in play
+        :return: the word
+        """
+        free = self.pool_size - len(self.taken)
+        if free <= 0:
+            raise WordListError("every eligible word is already in play")
+        position = self.rng.randrange(free)
+        last_free = free - 1
+        self.swap(position, last_free)
+        word = self.words[self.slot(last_free)]
+        self.taken[word] = last_free
+        return word
+
+    def release(self, word):
+        """
+        returns a word to the pool once it has left play
+        :param word: a word previously returned by take()
+        :return:
+        """
+        position = self.taken.pop(word)
+        first_taken = self.pool_size - len(self.taken) - 1  # the slot that becomes free
+        if position != first_taken:
+            moved_word = self.words[self.slot(first_taken)]
+            self.swap(position, first_taken)
+            self.taken[moved_word] = position
+
+
+class SequenceSampler:
+    """
+    hands out a fixed list of words in order, wrapping around at the end, e.g. a race's shared words so every racer
+    gets the same words in the same order. any MIN_ELIGIBLE_WORDS words in a row must differ, as that many words can
+    be in play at once
+    """
+    def __init__(self, words):
+        """
+        :param words: list of words, at least MIN_ELIGIBLE_WORDS long
+        """
+        if len(words) < MIN_ELIGIBLE_WORDS:
+            raise WordListError("only {} words to play with, at least {} are needed".format(
+                len(words), MIN_ELIGIBLE_WORDS))
+        self.words = words
+        self.next_index = 0
+
+    def advance(self):
+        """
+        nothing to precompute
+        :return:
+        """
+
+    def take(self):
+        """
+        :return: the next word of the sequence
+        """
+        word = self.words[self.next_index % len(self.words)]
+        self.next_index += 1
+        return word
+
+    def release(self, word):
+        """
+        words are handed out in order whether or not they are still in play, so there is nothing to return
+        :param word: a word previously returned by take()
+        :return:
+        """